@@ -0,0 +1,177 @@
+import bisect
+import itertools
+import threading
+from typing import Callable, Dict, List, Optional
+
+import numpy as np
+
+from classify import compatible
+from wire import node_of
+
+
+class Detection:
+    """One node's detection of an acoustic event."""
+    __slots__ = ("node_id", "time", "amplitude", "data", "event_type", "association")
+
+    def __init__(self, node_id, time: float, amplitude: float, data=None, event_type: Optional[str] = None):
+        self.node_id = node_id
+        self.time = time
+        self.amplitude = amplitude
+        self.data = data  # Optional payload, e.g. an audio snippet
+        self.event_type = event_type  # Classifier label, None if the node does not classify
+        self.association = None
+
+
+class Association:
+    """Detections from different nodes that belong to the same physical event."""
+
+    def __init__(self, event_id: int, detections: List[Detection]):
+        self.id = event_id
+        self.detections: Dict[object, Detection] = {}
+        for detection in detections:
+            self.attach(detection)
+
+    def attach(self, detection: Detection) -> None:
+        self.detections[detection.node_id] = detection
+        detection.association = self
+
+    def snapshot(self) -> "Association":
+        """A copy with its own detections dict, unaffected by later attaches."""
+        copy = Association.__new__(Association)
+        copy.id = self.id
+        copy.detections = dict(self.detections)
+        return copy
+
+    @property
+    def first_time(self) -> float:
+        return min(d.time for d in self.detections.values())
+
+    def event_times(self) -> dict:
+        return {node_id: d.time for node_id, d in self.detections.items()}
+
+    @property
+    def event_type(self) -> Optional[str]:
+        """The most common label among the detections that have one, None if none do."""
+        labels = [d.event_type for d in self.detections.values() if d.event_type not in (None, "unknown")]
+        if not labels:
+            return "unknown" if any(d.event_type for d in self.detections.values()) else None
+        return max(set(labels), key=labels.count)
+
+
+class EventAssociator:
+    """Time-indexed store of local and remote detections that groups them into events.
+
+    Detections are kept sorted by time (bisect), bounded by `max_age` seconds
+    behind the newest detection and by `max_detections`. Two detections from
+    nodes i and j can only stem from the same source if their time difference
+    is at most |p_i - p_j| / c (+ `tolerance`). As soon as `min_nodes`
+    mutually consistent detections exist, an Association is created and
+    passed to `on_fix`; later consistent detections from other nodes are
+    attached to it and reported again. on_fix gets a snapshot taken under
+    the lock, so it can read the detections while other threads keep
+    adding; it runs outside the lock. Pairs with an unknown node position
+    fall back to `max_window` seconds. Detections with different event types
+    are never grouped; an unknown type goes with anything. Extra channels of
+    one node ("<node id>#<n>") count as nodes, but an event also needs
+    `min_hosts` different nodes, as one array alone cannot fix a position.
+    """
+
+    def __init__(self, min_nodes: int = 3, min_hosts: int = 2, max_age: float = 10.0, max_detections: int = 4096,
+                 max_window: float = 0.5, tolerance: float = 0.005, speed_of_sound: float = 343.0,
+                 on_fix: Optional[Callable[[Association], None]] = None):
+        self.min_nodes = min_nodes
+        self.min_hosts = min_hosts
+        self.max_age = max_age
+        self.max_detections = max_detections
+        self.max_window = max_window
+        self.tolerance = tolerance
+        self.speed_of_sound = speed_of_sound
+        self.on_fix = on_fix
+        self.positions: Dict[object, np.ndarray] = {}
+        self._diameter = 0.0
+        self._times: List[float] = []
+        self._detections: List[Detection] = []
+        self._open: List[Association] = []
+        self._ids = itertools.count(1)
+        self._lock = threading.Lock()
+
+    def set_geometry(self, positions: Optional[dict]) -> None:
+        """Node positions (meters) used to bound the physically possible TDOA per pair."""
+        with self._lock:
+            self.positions = {k: np.asarray(v, dtype=float) for k, v in (positions or {}).items()}
+            self._diameter = 0.0
+            if len(self.positions) > 1:
+                pos = np.array(list(self.positions.values()))
+                self._diameter = float(np.max(np.linalg.norm(pos[:, None, :] - pos[None, :, :], axis=2)))
+
+    def window(self, node_a, node_b) -> float:
+        """Largest possible arrival-time difference between two nodes."""
+        pa, pb = self.positions.get(node_a), self.positions.get(node_b)
+        if pa is None or pb is None:
+            return self.max_window
+        return float(np.linalg.norm(pa - pb)) / self.speed_of_sound + self.tolerance
+
+    def search_window(self) -> float:
+        """How far apart in time related detections can be, over all node pairs."""
+        return max(self.max_window, self._diameter / self.speed_of_sound + self.tolerance)
+
+    def _consistent(self, detection: Detection, members) -> bool:
+        return all(detection.node_id != m.node_id
+                   and abs(detection.time - m.time) <= self.window(detection.node_id, m.node_id)
+                   and compatible(detection.event_type, m.event_type)
+                   for m in members)
+
+    def add(self, node_id, time: float, amplitude: float, data=None,
+            event_type: Optional[str] = None) -> Optional[Association]:
+        """Store a detection and return a snapshot of the Association it completed or extended, if any."""
+        detection = Detection(node_id, time, amplitude, data, event_type)
+        with self._lock:
+            i = bisect.bisect_right(self._times, time)
+            self._times.insert(i, time)
+            self._detections.insert(i, detection)
+            self._prune()
+            association = self._associate(detection)
+            if association is not None:
+                association = association.snapshot()
+        if association is not None and self.on_fix is not None:
+            self.on_fix(association)
+        return association
+
+    def _prune(self) -> None:
+        cutoff = self._times[-1] - self.max_age
+        drop = max(bisect.bisect_left(self._times, cutoff), len(self._times) - self.max_detections)
+        if drop > 0:
+            del self._times[:drop]
+            del self._detections[:drop]
+        horizon = self._times[-1] - 2 * self.search_window()
+        self._open = [a for a in self._open if a.first_time >= horizon]
+
+    def _associate(self, detection: Detection) -> Optional[Association]:
+        # Extend the closest event that already has a fix
+        extendable = [a for a in self._open
+                      if detection.node_id not in a.detections
+                      and self._consistent(detection, a.detections.values())]
+        if extendable:
+            association = min(extendable, key=lambda a: abs(a.first_time - detection.time))
+            association.attach(detection)
+            return association
+
+        # Otherwise look for enough unassigned detections around this one
+        w = self.search_window()
+        lo = bisect.bisect_left(self._times, detection.time - w)
+        hi = bisect.bisect_right(self._times, detection.time + w)
+        candidates = sorted((d for d in self._detections[lo:hi]
+                             if d.association is None and d.node_id != detection.node_id),
+                            key=lambda d: abs(d.time - detection.time))
+        members = [detection]
+        for candidate in candidates:
+            if self._consistent(candidate, members):
+                members.append(candidate)
+        if len(members) < self.min_nodes or len({node_of(m.node_id) for m in members}) < self.min_hosts:
+            return None
+        association = Association(next(self._ids), members)
+        self._open.append(association)
+        return association
+
+    def __len__(self) -> int:
+        return len(self._times)
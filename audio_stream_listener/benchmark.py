@@ -0,0 +1,131 @@
+import argparse
+import contextlib
+import io
+import json
+import subprocess
+import sys
+import time
+
+import numpy as np
+
+from logqueue import start_logging
+from metrics import STAGES
+from simulate import SOURCE_MODELS, Simulation, make_scenario
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description="Run N simulated listeners over loopback and report localization accuracy and cost")
+    parser.add_argument("--nodes", type=int, default=4)
+    parser.add_argument("--events", type=int, default=10)
+    parser.add_argument("--kind", choices=sorted(SOURCE_MODELS) + ["mixed"], default="gunshot")
+    parser.add_argument("--channels", type=int, default=1, help="Microphones per node")
+    parser.add_argument("--array-spacing", type=float, default=1.0,
+                        help="Diameter of each node's microphone array (m) with --channels")
+    parser.add_argument("--workers", type=int, default=None, help="Detection threads per node with --channels")
+    parser.add_argument("--spacing", type=float, default=100.0, help="Diameter of the node circle (m)")
+    parser.add_argument("--area", type=float, default=300.0, help="Side of the square sources are drawn from (m)")
+    parser.add_argument("--interval", type=float, default=2.0, help="Seconds between events")
+    parser.add_argument("--noise", type=float, default=0.05, help="Background noise standard deviation")
+    parser.add_argument("--skew-us", type=float, default=0.0,
+                        help="Standard deviation of each node's residual clock error (microseconds)")
+    parser.add_argument("--loss", type=float, default=0.0, help="Probability a detection to one peer is lost")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--snippet-ms", type=float, default=None)
+    parser.add_argument("--trigger", choices=["adaptive", "fixed"], default="adaptive")
+    parser.add_argument("--snr-db", type=float, default=None, help="Adaptive trigger SNR, default the detector's")
+    parser.add_argument("--classify-ms", type=float, default=None, help="Classify detections from this much audio")
+    parser.add_argument("--low-power", action="store_true", help="Run the detectors in low-power mode")
+    parser.add_argument("--transport", choices=["thread", "asyncio"], default="thread")
+    parser.add_argument("--topology", choices=["full", "ring"], default="full",
+                        help="Connect every node to every other, or each only to its two neighbours")
+    parser.add_argument("--gossip-ttl", type=int, default=0, help="Relay detections for this many hops")
+    parser.add_argument("--base-port", type=int, default=47000)
+    parser.add_argument("--verbose", action="store_true", help="Show the listeners' own output")
+    parser.add_argument("--startup", type=int, default=0, metavar="RUNS",
+                        help="Instead, time cold starts to a first detection in this many fresh processes")
+    return parser.parse_args()
+
+
+def percentiles(values: np.ndarray, scale: float = 1.0) -> str:
+    if len(values) == 0:
+        return "n/a"
+    p50, p90, p95, p99 = np.percentile(values * scale, [50, 90, 95, 99])
+    return f"p50={p50:.2f} p90={p90:.2f} p95={p95:.2f} p99={p99:.2f}"
+
+
+def report(results: dict) -> None:
+    cpu = results["detector_cpu"]
+    print(f"Events: {results['events']}, fixes: {results['fixes']}, "
+          f"missed: {results['missed']}, false fixes: {results['false_fixes']}, "
+          f"lost messages: {results['lost_messages']}, relayed: {results['relayed']}")
+    print(f"Triggers: {results['triggers']}, detection messages sent: {results['messages_sent']}, "
+          f"wrongly typed fixes: {results['type_errors']}")
+    print(f"Error (m):       {percentiles(results['errors'])}")
+    print(f"Latency (ms):    {percentiles(results['latencies'], 1000)}")
+    print(f"Detector CPU (s/node): mean={cpu.mean():.3f} max={cpu.max():.3f}, "
+          f"process CPU (s/node): {results['process_cpu_per_node']:.3f}")
+    print(f"Throughput: {results['fixes'] / results['wall_time']:.1f} fixes/s, "
+          f"{results['audio_seconds'] / results['wall_time']:.1f}x real time")
+    # capture and receive are wall clock ages, meaningless on the simulated timeline
+    print("Stage time (ms, all nodes):")
+    for stage in STAGES[1:4] + STAGES[5:]:
+        stats = results["stages"][stage]
+        if stats["count"]:
+            print(f"  {stage:<12} n={stats['count']:<5} mean={stats['mean_ms']:.3f} p50={stats['p50_ms']:.3f} "
+                  f"p99={stats['p99_ms']:.3f}")
+
+
+PROBE = "import time; t0 = time.perf_counter(); import json, sys, simulate; " \
+        "print(json.dumps(simulate.startup_probe(t0, **json.loads(sys.argv[1]))))"
+
+
+def startup(runs: int, detector_kwargs: dict) -> None:
+    """Median cold start of a node, each run in a new interpreter so nothing is imported yet."""
+    rows = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        out = subprocess.run([sys.executable, "-c", PROBE, json.dumps(detector_kwargs)],
+                             capture_output=True, text=True, check=True).stdout
+        wall = time.perf_counter() - start
+        result = json.loads(out.strip().splitlines()[-1])
+        rows.append((result["import"], result["setup"], result["first_detection"] or np.nan, wall))
+    imports, setup, detect, wall = np.median(np.array(rows), axis=0) * 1000
+    # The first event comes right after the noise floor warm-up, fed faster than real time
+    print(f"Startup over {runs} runs (median ms): import={imports:.1f} setup={setup:.1f} "
+          f"first detection={detect:.1f}, whole process={wall:.1f}")
+
+
+def main():
+    args = parse_args()
+    if args.startup:
+        startup(args.startup, {"low_power": args.low_power, "trigger": args.trigger,
+                               "snippet_seconds": args.snippet_ms / 1000 if args.snippet_ms else None,
+                               "classify_seconds": args.classify_ms / 1000 if args.classify_ms else None})
+        return
+    scenario = make_scenario(args.nodes, args.events, args.kind, spacing=args.spacing, area=args.area,
+                             interval=args.interval, noise=args.noise, skew=args.skew_us * 1e-6,
+                             loss=args.loss, seed=args.seed, channels=args.channels,
+                             array_spacing=args.array_spacing)
+    snippet_seconds = args.snippet_ms / 1000 if args.snippet_ms else None
+    classify_seconds = args.classify_ms / 1000 if args.classify_ms else None
+    log = io.StringIO()
+    log_listener = start_logging(stream=None if args.verbose else log)
+    with contextlib.nullcontext() if args.verbose else contextlib.redirect_stdout(log):
+        simulation = Simulation(scenario, base_port=args.base_port, transport=args.transport,
+                                topology=args.topology, gossip_ttl=args.gossip_ttl,
+                                snippet_seconds=snippet_seconds, low_power=args.low_power,
+                                trigger=args.trigger, classify_seconds=classify_seconds, workers=args.workers)
+        if args.snr_db is not None:
+            for detector in simulation.detectors:
+                detector.set_tunable("snr_db", args.snr_db)
+        simulation.connect()
+        simulation.run()
+        simulation.close()
+        time.sleep(0.1)  # Let the reader threads print their goodbyes
+        log_listener.stop()
+    report(simulation.results())
+
+
+if __name__ == "__main__":
+    main()
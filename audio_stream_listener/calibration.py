@@ -0,0 +1,368 @@
+import json
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, List, Optional
+
+import numpy as np
+
+from multilateration import SPEED_OF_SOUND, locate
+
+log = logging.getLogger(__name__)
+
+
+def _canonical(positions: np.ndarray) -> np.ndarray:
+    """Move node 0 to the origin, node 1 onto the +x axis and node 2 to y > 0 (the solver's gauge)."""
+    positions = positions - positions[0]
+    dims = positions.shape[1]
+    basis = []
+    for i in range(1, min(dims + 1, len(positions))):
+        v = positions[i].copy()
+        for b in basis:
+            v -= (v @ b) * b
+        if np.linalg.norm(v) < 1e-9:
+            break
+        basis.append(v / np.linalg.norm(v))
+    if len(basis) < dims:
+        return positions
+    if dims == 3:
+        basis[2] = np.cross(basis[0], basis[1])
+    return positions @ np.array(basis).T
+
+
+def classical_mds(distance: np.ndarray, dims: int = 2) -> np.ndarray:
+    """(N, dims) positions, in _canonical's gauge, best matching an (N, N) matrix of pairwise distances."""
+    n = len(distance)
+    centering = np.eye(n) - 1.0 / n
+    gram = -0.5 * centering @ (distance ** 2) @ centering
+    values, vectors = np.linalg.eigh(gram)
+    top = np.argsort(values)[::-1][:dims]
+    return _canonical(vectors[:, top] * np.sqrt(np.maximum(values[top], 1e-9)))
+
+
+class SelfCalibrator:
+    """Node positions and clock offsets from repeated loud events, by bundle adjustment.
+
+    Each event k heard by node i gives t_ik = e_k + |s_k - p_i| / c + b_i,
+    with unknown source s_k, emission time e_k, node position p_i and clock
+    offset b_i. All of them are solved jointly with Levenberg-Marquardt,
+    Huber-weighted, dropping events that still fit badly afterwards. The
+    normal equations are block-sparse (every residual touches one event and
+    one node), so the event blocks are eliminated with a Schur complement and
+    only an N(D+1) system over the nodes is solved per step.
+
+    The first solve starts from classical MDS on pairwise distances bounded by
+    the spread of each pair's TDOAs; after that every new event is located
+    against the current geometry and a few warm-started iterations are run
+    over the last `max_events` events. A node joining later triggers a new
+    initial solve. The geometry is relative: node 0 is the origin, node 1
+    lies on the +x axis and node 2 at y > 0, with node 0's clock as the
+    reference. With `path`, it is saved there after solves and can be loaded
+    on restart. `range_prior` (e.g. RSSI ranges, see ranging.py) fills in
+    the initial distance of pairs that no event has been heard by yet.
+
+    add_event only queues the event; after start() a background thread
+    solves over everything queued since its last solve and then publishes
+    the result. geometry(), clock_offsets() and correct() return the last
+    published solution, so callers never wait for a solve.
+    """
+
+    def __init__(self, dims: int = 2, speed_of_sound: float = SPEED_OF_SOUND, min_events: int = 10,
+                 max_events: int = 500, iterations: int = 5, initial_iterations: int = 100,
+                 solve_clocks: bool = True, huber: float = 1.0, outlier: float = 10.0, max_rms: float = 1.0,
+                 path: Optional[str] = None, save_interval: float = 10.0):
+        self.dims = dims
+        self.speed_of_sound = speed_of_sound
+        self.min_events = min_events
+        self.max_events = max_events
+        self.iterations = iterations
+        self.initial_iterations = initial_iterations
+        self.solve_clocks = solve_clocks
+        self.huber = huber  # Meters; larger residuals are down-weighted
+        self.outlier = outlier  # Meters; events fitting worse than this (misassociations) are dropped
+        self.max_rms = max_rms
+        self.path = path
+        self.save_interval = save_interval
+        self.last_save = 0.0
+        self.node_ids: List = []
+        self.positions: Optional[np.ndarray] = None  # (N, D), None until the first solve
+        self.clock_bias = np.zeros(0)  # Per node, in meters (c * clock offset)
+        # event id -> [times dict, source (D,), emission in meters after the event's first arrival]
+        self.events: "OrderedDict[object, list]" = OrderedDict()
+        self.rms = np.inf
+        # (node id, node id) -> meters, used for pairs without TDOAs in the initial solve
+        self.range_prior: Dict[tuple, float] = {}
+        # Events queued by add_event, taken by the solver; the lock guards them and the published solution
+        self.pending: "OrderedDict[object, dict]" = OrderedDict()
+        self.solution = None  # (node ids, positions, clock bias, rms) of the last solve
+        self.lock = threading.Lock()
+        self.solve_lock = threading.Lock()
+        self.wake = threading.Event()
+        self.running = False
+
+    @property
+    def calibrated(self) -> bool:
+        solution = self.solution
+        return solution is not None and solution[3] <= self.max_rms
+
+    def start(self) -> "SelfCalibrator":
+        self.running = True
+        threading.Thread(target=self.run, daemon=True).start()
+        return self
+
+    def stop(self) -> None:
+        self.running = False
+        self.wake.set()
+
+    def run(self) -> None:
+        while self.running:
+            self.wake.wait()
+            self.wake.clear()
+            if self.running:
+                self.update()
+
+    def add_event(self, event_id, event_times: dict) -> None:
+        """Queue one associated event (or an update of it) for the next solve."""
+        times = {n: t for n, t in event_times.items() if t is not None}
+        if len(times) < self.dims + 2:
+            return  # Fully absorbed by the event's own unknowns
+        with self.lock:
+            self.pending.pop(event_id, None)
+            self.pending[event_id] = times
+        self.wake.set()
+
+    def update(self) -> bool:
+        """Take the queued events and re-solve; returns whether a new solution was published."""
+        with self.solve_lock:
+            with self.lock:
+                pending, self.pending = self.pending, OrderedDict()
+            if not pending:
+                return False
+            for event_id, times in pending.items():
+                for node_id in times:
+                    if node_id not in self.node_ids:
+                        self.node_ids.append(node_id)
+                        self.positions = None
+                known = self.events.pop(event_id, None)
+                self.events[event_id] = [times, None if known is None else known[1], 0.0]
+            while len(self.events) > self.max_events:
+                self.events.popitem(last=False)
+
+            if self.positions is None:
+                if len(self.events) < self.min_events or not self._initialize():
+                    return False
+                self._solve(self.initial_iterations)
+            else:
+                self._locate_new()
+                self._solve(self.iterations)
+            self._publish()
+        if self.path is not None and time.time() - self.last_save >= self.save_interval:
+            self.save(self.path)
+        return True
+
+    def _publish(self) -> None:
+        with self.lock:
+            self.solution = (list(self.node_ids), self.positions.copy(), self.clock_bias.copy(), self.rms)
+
+    def geometry(self) -> Dict[object, list]:
+        """Calibrated node positions keyed by node id, as used for mic_positions."""
+        solution = self.solution
+        if solution is None:
+            return {}
+        return {n: p.tolist() for n, p in zip(solution[0], solution[1])}
+
+    def clock_offsets(self) -> Dict[object, float]:
+        """Seconds each node's clock runs ahead of node 0's."""
+        solution = self.solution
+        if solution is None:
+            return {}
+        return {n: float(b / self.speed_of_sound) for n, b in zip(solution[0], solution[2])}
+
+    def correct(self, event_times: dict) -> dict:
+        """Event times with the calibrated clock offsets removed."""
+        offsets = self.clock_offsets()
+        return {n: t - offsets.get(n, 0.0) if t is not None else None for n, t in event_times.items()}
+
+    def _matrices(self):
+        """(K, N) ranges in meters after each event's first arrival, and the (K, N) valid mask."""
+        column = {n: i for i, n in enumerate(self.node_ids)}
+        ranges = np.zeros((len(self.events), len(self.node_ids)))
+        valid = np.zeros_like(ranges, dtype=bool)
+        for k, (times, _, _) in enumerate(self.events.values()):
+            first = min(times.values())
+            for node_id, t in times.items():
+                ranges[k, column[node_id]] = (t - first) * self.speed_of_sound
+                valid[k, column[node_id]] = True
+        return ranges, valid
+
+    def _initialize(self) -> bool:
+        """Initial positions and clock biases from the spread of every pair's TDOAs, then MDS."""
+        n = len(self.node_ids)
+        if n < self.dims + 1:
+            return False
+        ranges, valid = self._matrices()
+        diff = np.where(valid[:, :, None] & valid[:, None, :], ranges[:, :, None] - ranges[:, None, :], np.nan)
+        observed = np.any(np.isfinite(diff), axis=0)
+        hi = np.where(observed, np.nanmax(np.where(np.isfinite(diff), diff, -np.inf), axis=0), 0.0)
+        lo = np.where(observed, np.nanmin(np.where(np.isfinite(diff), diff, np.inf), axis=0), 0.0)
+        # Endfire sources (behind one node, in line with the other) give d_ij + b_ij and -d_ij + b_ij
+        distance = (hi - lo) / 2
+        distance[~observed] = np.mean(distance[observed]) if observed.any() else 1.0
+        for (a, b), meters in self.range_prior.items():
+            if a in self.node_ids and b in self.node_ids:
+                i, j = self.node_ids.index(a), self.node_ids.index(b)
+                if not observed[i, j]:
+                    distance[i, j] = distance[j, i] = meters
+
+        bias = np.zeros(n)
+        if self.solve_clocks:
+            i, j = np.nonzero(np.triu(observed, 1))
+            rows = np.zeros((len(i) + 1, n))
+            rows[np.arange(len(i)), i] = 1
+            rows[np.arange(len(i)), j] = -1
+            rows[-1, 0] = 1  # Node 0 is the reference clock
+            bias = np.linalg.lstsq(rows, np.append((hi + lo)[i, j] / 2, 0.0), rcond=None)[0]
+
+        self.positions = classical_mds(distance, self.dims)
+        self.clock_bias = bias
+        for entry in self.events.values():
+            entry[1] = None
+        self._locate_new()
+        return True
+
+    def _locate_new(self) -> None:
+        """Source and emission estimates for events that have none yet, from the current geometry."""
+        column = {n: i for i, n in enumerate(self.node_ids)}
+        for entry in self.events.values():
+            times, source, _ = entry
+            if source is not None:
+                continue
+            idx = np.array([column[n] for n in times])
+            first = min(times.values())
+            ranges = np.array([(t - first) * self.speed_of_sound for t in times.values()])
+            positions = self.positions[idx]
+            source, _ = locate(positions, (ranges - self.clock_bias[idx]) / self.speed_of_sound,
+                               self.speed_of_sound)
+            if not np.all(np.isfinite(source)):
+                source = positions.mean(axis=0)
+            entry[1] = source
+            entry[2] = float(np.mean(ranges - self.clock_bias[idx] - np.linalg.norm(positions - source, axis=1)))
+
+    def _residuals(self, positions, bias, sources, emissions, ranges, valid):
+        delta = sources[:, None, :] - positions[None, :, :]
+        dist = np.maximum(np.linalg.norm(delta, axis=2), 1e-9)
+        res = np.where(valid, dist + emissions[:, None] + bias[None, :] - ranges, 0.0)
+        return res, delta / dist[..., None]
+
+    def _solve(self, iterations: int) -> None:
+        """Levenberg-Marquardt over all nodes and the events in the window."""
+        ranges, valid = self._matrices()
+        entries = list(self.events.values())
+        sources = np.array([e[1] for e in entries])
+        emissions = np.array([e[2] for e in entries])
+        positions, bias = self.positions, self.clock_bias
+        n_nodes, dims = positions.shape
+        p = dims + 1
+
+        # Gauge: node 0 fixed, node 1 on the x axis, node 2 in the xy plane; bias of node 0 is 0
+        free = np.ones((n_nodes, p), dtype=bool)
+        free[0] = False
+        for i in range(1, min(dims, n_nodes)):
+            free[i, i:dims] = False
+        if not self.solve_clocks:
+            free[:, dims] = False
+
+        res, unit = self._residuals(positions, bias, sources, emissions, ranges, valid)
+        weights = np.where(np.abs(res) > self.huber, self.huber / np.maximum(np.abs(res), 1e-12), 1.0)
+        cost = np.sum(weights * res ** 2)
+        damping = 1e-3
+        eye_p = np.eye(p)
+        for _ in range(iterations):
+            sqrt_w = np.sqrt(weights) * valid
+            J_event = np.concatenate((unit, np.ones(valid.shape + (1,))), axis=2) * sqrt_w[..., None]
+            J_node = np.concatenate((-unit, np.ones(valid.shape + (1,))), axis=2) * sqrt_w[..., None] * free
+            r = res * sqrt_w
+
+            C = np.einsum('kna,knb->kab', J_event, J_event)
+            A = np.einsum('kna,knb->nab', J_node, J_node)
+            W = np.einsum('kna,knq->knaq', J_event, J_node)
+            g_event = np.einsum('kna,kn->ka', J_event, r)
+            g_node = np.einsum('knq,kn->nq', J_node, r)
+
+            C = C + damping * np.einsum('kaa->ka', C)[..., None] * eye_p + 1e-9 * eye_p
+            A = A + damping * np.einsum('naa->na', A)[..., None] * eye_p + (~free)[..., None] * eye_p
+            C_inv = np.linalg.inv(C)
+            # Schur complement: eliminate every event block, solve for the nodes only
+            reduced = -np.einsum('kiap,kab,kjbq->ipjq', W, C_inv, W, optimize=True)
+            reduced[np.arange(n_nodes), :, np.arange(n_nodes), :] += A
+            rhs = -g_node + np.einsum('kiap,kab,kb->ip', W, C_inv, g_event, optimize=True)
+            size = n_nodes * p
+            step_node = np.linalg.solve(reduced.reshape(size, size) + 1e-9 * np.eye(size),
+                                        rhs.reshape(size)).reshape(n_nodes, p) * free
+            step_event = np.einsum('kab,kb->ka', C_inv,
+                                   -g_event - np.einsum('kiap,ip->ka', W, step_node))
+
+            new = (positions + step_node[:, :dims], bias + step_node[:, dims],
+                   sources + step_event[:, :dims], emissions + step_event[:, dims])
+            new_res, new_unit = self._residuals(*new, ranges, valid)
+            new_cost = np.sum(weights * new_res ** 2)
+            if new_cost < cost:
+                improvement = cost - new_cost
+                positions, bias, sources, emissions = new
+                res, unit, cost = new_res, new_unit, new_cost
+                weights = np.where(np.abs(res) > self.huber, self.huber / np.maximum(np.abs(res), 1e-12), 1.0)
+                cost = np.sum(weights * res ** 2)
+                damping /= 3
+                if improvement <= 1e-10 * max(cost, 1e-12):
+                    break
+            else:
+                damping *= 3
+
+        self.positions, self.clock_bias = positions, bias
+        for entry, source, emission in zip(entries, sources, emissions):
+            entry[1], entry[2] = source, float(emission)
+        worst = np.max(np.abs(res), axis=1)
+        keep = worst <= max(self.outlier, 10 * np.median(worst))
+        for event_id in [e for e, k in zip(list(self.events), keep) if not k]:
+            del self.events[event_id]
+        self.rms = float(np.sqrt(np.sum(res[keep] ** 2) / max(valid[keep].sum(), 1)))
+
+    def save(self, path: str) -> None:
+        """Write the geometry and clock offsets as JSON (atomically)."""
+        solution = self.solution
+        if solution is None:
+            return
+        node_ids, positions, clock_bias, rms = solution
+        state = {
+            "dims": self.dims,
+            "speed_of_sound": self.speed_of_sound,
+            "rms": rms,
+            "events": len(self.events),
+            "updated": time.time(),
+            "nodes": {str(n): {"position": p.tolist(), "clock_offset": float(b / self.speed_of_sound)}
+                      for n, p, b in zip(node_ids, positions, clock_bias)},
+        }
+        with open(path + ".tmp", "w") as f:
+            json.dump(state, f, indent=2)
+        os.replace(path + ".tmp", path)
+        self.last_save = time.time()
+
+    @classmethod
+    def load(cls, path: str, **kwargs) -> "SelfCalibrator":
+        """A calibrator that continues from the geometry saved at `path` (if it exists)."""
+        calibrator = cls(path=path, **kwargs)
+        if not os.path.exists(path):
+            return calibrator
+        with open(path) as f:
+            state = json.load(f)
+        calibrator.dims = state["dims"]
+        calibrator.speed_of_sound = state.get("speed_of_sound", calibrator.speed_of_sound)
+        calibrator.rms = state.get("rms", np.inf)
+        calibrator.node_ids = list(state["nodes"])
+        calibrator.positions = np.array([n["position"] for n in state["nodes"].values()], dtype=float)
+        calibrator.clock_bias = np.array([n["clock_offset"] for n in state["nodes"].values()]) * calibrator.speed_of_sound
+        calibrator._publish()
+        log.info(f"Loaded calibration of {len(calibrator.node_ids)} nodes from {path} (rms {calibrator.rms:.3f} m)")
+        return calibrator
@@ -0,0 +1,159 @@
+import time
+import threading
+from typing import Optional
+
+import numpy as np
+
+
+class RingBuffer:
+    """Preallocated single-producer/single-consumer audio ring buffer.
+
+    The producer (the PortAudio callback) only ever advances `write_pos`, the
+    consumer keeps its own read position, so no lock is needed. Every written
+    block also stores an anchor (first sample index, capture time) which lets
+    any sample be stamped from the stream clock plus the running sample count.
+    """
+
+    def __init__(self, capacity: int, rate: int, channels: int = 1,
+                 dtype=np.float32, max_anchors: int = 512):
+        self.capacity = int(capacity)
+        self.rate = rate
+        self.channels = channels
+        self.data = np.zeros((self.capacity, channels), dtype=dtype)
+        # Block anchors: sample index of block start and its capture time
+        self.anchor_sample = np.full(max_anchors, -1, dtype=np.int64)
+        self.anchor_time = np.zeros(max_anchors, dtype=np.float64)
+        self.anchor_count = 0
+        self.write_pos = 0  # Total number of samples ever written
+        self.dropped_samples = 0  # Samples overwritten before the consumer read them
+        # (target write_pos, event) per blocked consumer, replaced whole under waiters_lock so the
+        # producer can iterate it without locking
+        self.waiters = ()
+        self.waiters_lock = threading.Lock()
+
+    def write(self, frames: np.ndarray, capture_time: float) -> None:
+        """Append frames captured at `capture_time` (time of the first frame)."""
+        frames = frames.reshape(-1, self.channels)
+        n = len(frames)
+        if n > self.capacity:
+            frames = frames[-self.capacity:]
+            capture_time += (n - self.capacity) / self.rate
+            self.dropped_samples += n - self.capacity
+            self.write_pos += n - self.capacity
+            n = self.capacity
+
+        start = self.write_pos
+        slot = self.anchor_count % len(self.anchor_sample)
+        self.anchor_sample[slot] = start
+        self.anchor_time[slot] = capture_time
+
+        offset = start % self.capacity
+        first = min(n, self.capacity - offset)
+        self.data[offset:offset + first] = frames[:first]
+        self.data[:n - first] = frames[first:]
+
+        # Publish only after data and anchor are in place
+        self.anchor_count += 1
+        self.write_pos = start + n
+        for target, event in self.waiters:
+            if self.write_pos >= target:
+                event.set()
+
+    def wait_until(self, pos: int, timeout: float) -> bool:
+        """Block until at least `pos` samples have been written.
+
+        The producer wakes a waiter only once its target is reached, so
+        waiting for a long block is one wake-up, not one per callback.
+        """
+        if self.write_pos >= pos:
+            return True
+        waiter = (pos, threading.Event())
+        with self.waiters_lock:
+            self.waiters += (waiter,)
+        try:
+            # Checked again after registering, in case the write landed in between
+            if self.write_pos < pos:
+                waiter[1].wait(timeout)
+            return self.write_pos >= pos
+        finally:
+            with self.waiters_lock:
+                self.waiters = tuple(w for w in self.waiters if w is not waiter)
+
+    def oldest_pos(self) -> int:
+        """Index of the oldest sample still held in the buffer."""
+        return max(0, self.write_pos - self.capacity)
+
+    def read(self, start: int, count: int) -> Optional[np.ndarray]:
+        """Copy samples [start, start+count), or None if they are not (or no longer) available."""
+        if count <= 0 or start < self.oldest_pos() or start + count > self.write_pos:
+            return None
+        offset = start % self.capacity
+        first = min(count, self.capacity - offset)
+        out = np.empty((count, self.channels), dtype=self.data.dtype)
+        out[:first] = self.data[offset:offset + first]
+        out[first:] = self.data[:count - first]
+        # The producer may have lapped us while copying
+        if start < self.oldest_pos():
+            return None
+        return out
+
+    def read_strided(self, start: int, count: int, step: int) -> Optional[np.ndarray]:
+        """Every `step`-th sample of [start, start+count), for cheap low-rate scans."""
+        if count <= 0 or start < self.oldest_pos() or start + count > self.write_pos:
+            return None
+        out = self.data[(start + np.arange(0, count, step)) % self.capacity]
+        if start < self.oldest_pos():
+            return None
+        return out
+
+    def time_of(self, sample_index: float) -> float:
+        """Capture time of a (possibly fractional) sample index."""
+        valid = np.where(self.anchor_sample <= sample_index, self.anchor_sample, -1)
+        slot = int(np.argmax(valid))
+        if valid[slot] < 0:
+            # Older than any anchor we still hold, extrapolate from the oldest one
+            slot = int(np.argmin(np.where(self.anchor_sample >= 0, self.anchor_sample, np.iinfo(np.int64).max)))
+        return float(self.anchor_time[slot] + (sample_index - self.anchor_sample[slot]) / self.rate)
+
+    def index_at(self, timestamp: float) -> int:
+        """Nearest sample index for a capture time."""
+        slot = int(np.argmax(np.where(self.anchor_time <= timestamp, self.anchor_sample, -1)))
+        if self.anchor_sample[slot] < 0:
+            slot = int(np.argmax(self.anchor_sample))
+        return int(round(self.anchor_sample[slot] + (timestamp - self.anchor_time[slot]) * self.rate))
+
+
+class StreamClock:
+    """Maps PortAudio stream time onto wall-clock time.
+
+    The offset between the stream clock and `time.time()` is measured once, so
+    all subsequent stamps follow the ADC clock rather than scheduler wakeups.
+    Host APIs that report no ADC time fall back to a pure sample counter.
+    Streams of one host can take the offset of a `reference` clock, which
+    puts all their stamps on the same time base.
+    """
+
+    def __init__(self, rate: int, reference: Optional["StreamClock"] = None):
+        self.rate = rate
+        self.reference = reference
+        self.offset = None
+        self.samples_seen = 0
+        self.start_time = None
+
+    def stamp(self, time_info: dict, frame_count: int) -> float:
+        """Wall-clock time of the first frame of the block the callback received."""
+        adc_time = time_info.get('input_buffer_adc_time', 0.0) if time_info else 0.0
+        current_time = time_info.get('current_time', 0.0) if time_info else 0.0
+        now = time.time()
+        if adc_time > 0 and current_time > 0:
+            if self.offset is None:
+                reference = self.reference.offset if self.reference is not None else None
+                self.offset = reference if reference is not None else now - current_time
+            stamp = adc_time + self.offset
+        else:
+            if self.start_time is None:
+                # The block has already been captured when the callback fires
+                self.start_time = now - frame_count / self.rate
+            stamp = self.start_time + self.samples_seen / self.rate
+        self.samples_seen += frame_count
+        return stamp
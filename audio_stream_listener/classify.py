@@ -0,0 +1,101 @@
+from typing import Optional, Tuple
+
+import numpy as np
+
+
+class EventClassifier:
+    """Rule-based labelling of a trigger window as one of wire.EVENT_TYPES.
+
+    The window starts just before the onset and is `window_seconds` long;
+    everything is computed from one FFT and a 1 ms peak envelope, well
+    under a chunk period even for a half-second window. Features:
+
+    - band energy fractions below 150 Hz, 150-500 Hz, 500-2000 Hz and above
+    - spectral centroid (Hz) and flatness (0 for a pure tone, 1 for white noise)
+    - rise time: from 10% to 90% of the envelope peak
+    - contrast: envelope peak over the background before the onset (dB),
+      low when the trigger is the middle of a sustained sound
+    - duration: time from the onset that the envelope stays above 10% of
+      its peak and clear of the background level before the onset (capped
+      at the end of the window)
+    """
+
+    BANDS = (0, 150, 500, 2000)
+    FRAME_SECONDS = 0.001
+
+    def __init__(self, rate: int, window_seconds: float = 0.25, pre_seconds: float = 0.02):
+        self.rate = rate
+        self.window_seconds = window_seconds
+        self.pre_seconds = pre_seconds
+        self.length = int(window_seconds * rate)
+        self.frame = max(int(self.FRAME_SECONDS * rate), 1)
+        self.freqs = np.fft.rfftfreq(self.length, 1.0 / rate)
+        self.band_starts = np.searchsorted(self.freqs, self.BANDS)
+
+    def features(self, samples: np.ndarray) -> dict:
+        spectrum = np.fft.rfft(samples, self.length)
+        power = spectrum.real ** 2 + spectrum.imag ** 2
+        total = max(power.sum(), 1e-20)
+        bands = np.add.reduceat(power, self.band_starts) / total
+        centroid = float(power @ self.freqs / total)
+        flatness = float(np.exp(np.mean(np.log(power[1:] + 1e-20))) / (np.mean(power[1:]) + 1e-20))
+
+        n_frames = len(samples) // self.frame
+        envelope = np.abs(samples[:n_frames * self.frame]).reshape(n_frames, self.frame).max(axis=1)
+        peak_frame = int(np.argmax(envelope))
+        peak = max(envelope[peak_frame], 1e-20)
+        pre_frames = int(self.pre_seconds / self.FRAME_SECONDS) // 2
+        background = np.median(envelope[:pre_frames]) if pre_frames else 0.0
+        floor = max(0.1 * peak, min(2 * background, 0.5 * peak))
+        start = int(np.argmax(envelope[:peak_frame + 1] >= floor))
+        rise_end = int(np.argmax(envelope[:peak_frame + 1] >= 0.9 * peak))
+        below = np.flatnonzero(envelope[peak_frame:] < floor)
+        end = peak_frame + int(below[0]) if len(below) else n_frames
+        return {
+            "band_low": float(bands[0]), "band_mid_low": float(bands[1]),
+            "band_mid_high": float(bands[2]), "band_high": float(bands[3]),
+            "centroid": centroid,
+            "flatness": flatness,
+            "rise_time": max(rise_end - start, 0) * self.FRAME_SECONDS,
+            "duration": (end - start) * self.FRAME_SECONDS,
+            "contrast": float(20 * np.log10(peak / max(background, 1e-20))),
+        }
+
+    def label(self, f: dict) -> str:
+        long = f["duration"] >= 0.8 * self.window_seconds
+        low = f["band_low"] + f["band_mid_low"]
+        onset = f["contrast"] >= 10
+        if (long and f["flatness"] < 0.05 and (f["rise_time"] > 0.01 or not onset)
+                and f["band_low"] < 0.5):
+            return "drone"  # Sustained and harmonic, rotor tones above the boom band
+        if not onset:
+            return "unknown"
+        if f["rise_time"] <= 0.005 and f["duration"] < 0.1 and f["centroid"] > 500:
+            return "gunshot"  # Sharp, short and broadband
+        if f["rise_time"] <= 0.002 and f["duration"] >= 0.1 and low > 0.5:
+            return "explosion"  # Sharp but long and heavy in the low end
+        if f["band_low"] > 0.5 and f["centroid"] < 300:
+            return "artillery"  # Slower low-frequency boom
+        return "unknown"
+
+    def classify(self, samples: np.ndarray) -> Tuple[str, dict]:
+        """(label, features) of a trigger window."""
+        features = self.features(np.asarray(samples, dtype=float))
+        return self.label(features), features
+
+    def classify_ring(self, ring, onset_time: float, timeout: float,
+                      channel: int = 0) -> Optional[Tuple[str, dict]]:
+        """Classify the window at `onset_time` on `channel` of a RingBuffer, waiting for it to be captured."""
+        start = ring.index_at(onset_time) - int(self.pre_seconds * self.rate)
+        if not ring.wait_until(start + self.length, timeout):
+            return None
+        samples = ring.read(max(start, ring.oldest_pos()), self.length)
+        if samples is None:
+            return None
+        return self.classify(samples[:, channel])
+
+
+def compatible(type_a: Optional[str], type_b: Optional[str]) -> bool:
+    """Whether two detections may be the same event: unknown (or unclassified) matches anything."""
+    return type_a in (None, "unknown") or type_b in (None, "unknown") or type_a == type_b
+
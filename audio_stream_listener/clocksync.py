@@ -0,0 +1,121 @@
+import math
+import threading
+import time
+from typing import Optional
+
+
+class ClockEstimator:
+    """Offset and drift of one peer's clock relative to ours.
+
+    Every NTP-style exchange yields t1 (our send), t2 (peer receive),
+    t3 (peer send) and t4 (our receive), giving
+        offset = ((t2 - t1) + (t3 - t4)) / 2   (peer clock minus ours)
+        delay  = (t4 - t1) - (t3 - t2)
+    The offset is tracked as a running weighted linear fit over local time,
+    offset(t) = offset0 + drift * (t - t_ref), using exponentially forgotten
+    sums so each update is O(1). Samples are weighted by 1/delay^2 since
+    asymmetric queueing, the main error source, grows with delay.
+    """
+
+    def __init__(self, forgetting: float = 0.98, min_samples: int = 4):
+        self.forgetting = forgetting
+        self.min_samples = min_samples
+        self.samples = 0
+        self.t_ref = None
+        self.min_delay = math.inf
+        # Weighted sums of 1, x, y, x^2, xy, y^2
+        self.sw = self.sx = self.sy = self.sxx = self.sxy = self.syy = 0.0
+
+    def update(self, t1: float, t2: float, t3: float, t4: float) -> None:
+        offset = ((t2 - t1) + (t3 - t4)) / 2
+        delay = max((t4 - t1) - (t3 - t2), 1e-6)
+        if self.t_ref is None:
+            self.t_ref = t4
+        self.min_delay = min(self.min_delay, delay)
+        # Discard exchanges that were obviously queued somewhere
+        if self.samples >= self.min_samples and delay > 4 * self.min_delay + 0.001:
+            return
+        x = t4 - self.t_ref
+        w = 1.0 / delay ** 2
+        f = self.forgetting
+        self.sw = f * self.sw + w
+        self.sx = f * self.sx + w * x
+        self.sy = f * self.sy + w * offset
+        self.sxx = f * self.sxx + w * x * x
+        self.sxy = f * self.sxy + w * x * offset
+        self.syy = f * self.syy + w * offset * offset
+        self.samples += 1
+
+    @property
+    def synced(self) -> bool:
+        return self.samples >= self.min_samples
+
+    def _fit(self):
+        mean_x = self.sx / self.sw
+        mean_y = self.sy / self.sw
+        var_x = self.sxx / self.sw - mean_x ** 2
+        drift = (self.sxy / self.sw - mean_x * mean_y) / var_x if var_x > 1e-9 else 0.0
+        return mean_x, mean_y, drift
+
+    def offset_at(self, local_time: float) -> float:
+        """Peer clock minus local clock at a local time."""
+        if not self.samples:
+            return 0.0
+        mean_x, mean_y, drift = self._fit()
+        return mean_y + drift * (local_time - self.t_ref - mean_x)
+
+    def to_local(self, remote_time: float) -> float:
+        """Convert a timestamp taken on the peer's clock to our clock."""
+        if not self.synced:
+            return remote_time
+        # offset_at() takes a local time: evaluate it at the estimate from the offset at remote_time,
+        # which is off by offset * drift at most
+        return remote_time - self.offset_at(remote_time - self.offset_at(remote_time))
+
+    def stats(self) -> dict:
+        """Current offset, drift (s/s) and a one-sigma uncertainty (s)."""
+        if not self.samples:
+            return {"offset": None, "drift": None, "uncertainty": None, "samples": 0}
+        mean_x, mean_y, drift = self._fit()
+        var_x = self.sxx / self.sw - mean_x ** 2
+        var_y = self.syy / self.sw - mean_y ** 2
+        residual = max(var_y - drift ** 2 * var_x, 0.0)
+        return {
+            "offset": self.offset_at(time.time()),
+            "drift": drift,
+            # Fit scatter plus the worst case asymmetry of the best exchange
+            "uncertainty": math.sqrt(residual) + self.min_delay / 2,
+            "samples": self.samples,
+        }
+
+
+class ClockSyncService:
+    """Background thread that runs a sync exchange each `interval` seconds with every peer that speaks it.
+
+    Peers that announced protocol version 1 or later in HELLO answer
+    CLOCK_SYNC; legacy text peers would only log every request.
+    """
+
+    def __init__(self, network, interval: float = 1.0):
+        self.network = network
+        self.interval = interval
+        self.seq = 0
+        self.running = False
+        self.thread: Optional[threading.Thread] = None
+
+    def start(self) -> None:
+        self.running = True
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def stop(self) -> None:
+        self.running = False
+
+    def run(self) -> None:
+        while self.running:
+            self.seq += 1
+            for connection in self.network.connections:
+                if connection.peer_version < 1:
+                    continue
+                self.network.send_clock_sync(connection, self.seq, False, time.time())
+            time.sleep(self.interval)
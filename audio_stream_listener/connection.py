@@ -1,88 +1,421 @@
+import asyncio
+import io
+import itertools
+import logging
+import queue
+import random
 import socket
 import threading
 import sys
+from collections import OrderedDict, deque
 from typing import List, Optional
-import netifaces
+import time
 
-class Connection:
-    def __init__(self, socket: socket.socket, connection_id: int):
+import wire
+from clocksync import ClockEstimator, ClockSyncService
+from logqueue import start_logging
+from metrics import Metrics
+
+log = logging.getLogger(__name__)
+
+class WireState:
+    """Per-connection state of the text/binary protocol negotiation."""
+
+    def init_wire(self, binary_enabled: bool):
+        self.binary_enabled = binary_enabled
+        self.peer_version = 0
+        self.binary_out = False  # Peer understands frames, so we send them
+        self.binary_in = False  # Peer has switched, so we read frames
+        self.marker_sent = False
+        self.pending_event = None  # MSG_EVENT waiting for its MSG_SNIPPET
+        self.last_heartbeat = None
+        self.latest_event_time = None
+        self.latest_snippet = None  # (snippet_start_time, samples) of the latest event
+        self.clock = ClockEstimator()  # Peer clock relative to ours
+        self.node_id = self.address  # Replaced by the node id the peer announces in HELLO
+        self.peer_port = None  # Port the peer listens on, from its HELLO
+        self.gossip = False  # Peer relays MSG_GOSSIP, so it gets other nodes' events too
+
+    def encode_outgoing(self, text: Optional[str], binary: Optional[bytes] = None) -> bytes:
+        """Bytes to put on the wire for a message given as a text line and/or a binary frame."""
+        if not self.binary_out:
+            return f"{text}\n".encode()
+        out = b""
+        if not self.marker_sent:
+            out = f"{wire.BINARY_MARKER}\n".encode()
+            self.marker_sent = True
+        return out + (binary if binary is not None else wire.encode_text(text))
+
+class Connection(WireState):
+    def __init__(self, socket: socket.socket, connection_id: int, binary_enabled: bool = True):
         self.socket = socket
         self.id = connection_id
         self.address = socket.getpeername()[0]
         self.port = socket.getpeername()[1]
-        self.in_buffer = self.socket.makefile('r')
-        self.out_buffer = self.socket.makefile('w')
-        self.latest_event_time = None
+        self.in_buffer = self.socket.makefile('rb')
+        self.write_lock = threading.Lock()
+        self.init_wire(binary_enabled)
         
     def send_message(self, message: str):
+        self.send_encoded(message)
+
+    def send_encoded(self, text: Optional[str], binary: Optional[bytes] = None, key: Optional[str] = None):
+        # Written right away, so there is never a queued message for `key` to replace
         try:
-            self.out_buffer.write(f"{message}\n")
-            self.out_buffer.flush()
+            with self.write_lock:
+                self.socket.sendall(self.encode_outgoing(text, binary))
         except Exception as e:
-            print(f"Error sending message: {e}")
+            log.error(f"Error sending message: {e}")
             
     def close_connection(self):
+        try:
+            # Wakes up the reader thread, which close() alone does not while makefile() is open
+            self.socket.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
         try:
             self.socket.close()
-            print(f"Connection {self.id} closed.")
+            log.info(f"Connection {self.id} closed.")
+        except Exception as e:
+            log.error(f"Error closing connection: {e}")
+
+class InterfaceMap:
+    """IPv4 addresses of the local interfaces, scanned once and again only when the network changes.
+
+    On Linux a netlink socket subscribed to link and address changes wakes
+    a thread that rescans; elsewhere it rescans every `poll_interval`
+    seconds. netifaces is imported on the first scan.
+    """
+
+    RTMGRP_LINK = 0x1
+    RTMGRP_IPV4_IFADDR = 0x10
+
+    def __init__(self, poll_interval: float = 30.0):
+        self.poll_interval = poll_interval
+        self.addresses = {}  # interface -> [IPv4 address, ...]
+        self.my_ip = None
+        self.error = None
+        self.refreshes = 0
+        self.lock = threading.Lock()
+        self.watching = False
+
+    def refresh(self) -> None:
+        try:
+            import netifaces
+            addresses = {}
+            for interface in netifaces.interfaces():
+                addrs = netifaces.ifaddresses(interface).get(netifaces.AF_INET, [])
+                addresses[interface] = [addr['addr'] for addr in addrs]
+            error = None
         except Exception as e:
-            print(f"Error closing connection: {e}")
+            addresses, error = {}, e
+        external = [ip for ips in addresses.values() for ip in ips if not ip.startswith('127.')]
+        with self.lock:
+            self.addresses = addresses
+            self.my_ip = external[0] if external else None
+            self.error = error
+            self.refreshes += 1
+
+    def watch(self) -> None:
+        """Rescan in a background thread whenever the network changes."""
+        with self.lock:
+            if self.watching:
+                return
+            self.watching = True
+        threading.Thread(target=self._watch, daemon=True).start()
+
+    def _watch(self) -> None:
+        try:
+            sock = socket.socket(socket.AF_NETLINK, socket.SOCK_RAW, socket.NETLINK_ROUTE)
+            sock.bind((0, self.RTMGRP_LINK | self.RTMGRP_IPV4_IFADDR))
+        except (AttributeError, OSError):
+            sock = None
+        while True:
+            if sock is not None:
+                sock.recv(65536)
+                time.sleep(0.1)  # Address changes come in bursts
+                sock.setblocking(False)
+                try:
+                    while sock.recv(65536):
+                        pass
+                except BlockingIOError:
+                    pass
+                sock.setblocking(True)
+            else:
+                time.sleep(self.poll_interval)
+            self.refresh()
+
+    def external_ip(self) -> str:
+        if not self.refreshes:
+            self.refresh()
+            self.watch()
+        if self.error is not None:
+            return f"Error retrieving IP address: {self.error}"
+        return self.my_ip or "Could not determine external IP address."
+
+
+_interfaces = InterfaceMap()
+
+
+class SeenCache:
+    """Bounded set of recently seen keys, oldest forgotten first."""
+
+    def __init__(self, max_entries: int = 8192):
+        self.max_entries = max_entries
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    def add(self, key) -> bool:
+        """Remember `key`; False if it was already there."""
+        with self.lock:
+            if key in self.entries:
+                return False
+            self.entries[key] = None
+            if len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+            return True
+
+    def __len__(self) -> int:
+        return len(self.entries)
 
 class P2PNetwork:
-    def __init__(self, port: int):
+    def __init__(self, port: int, protocol: str = "binary", gossip_ttl: int = 0,
+                 gossip_fanout: Optional[int] = None):
+        # Copy-on-write: mutated only under connections_lock, so iterating a snapshot is always safe
         self.connections: List[Connection] = []
+        self.connections_lock = threading.Lock()
         self.connection_id_counter = 1
         self.listening_port = port
         self.server_socket = None
+        # Called as event_handler(connection, amplitude, timestamp, snippet, event_type, channel, origin) for
+        # every peer detection; origin is the node that heard it when it was relayed, else None
+        self.event_handler = None
+        # "binary" offers the framed protocol to peers (falling back to text), "text" never does
+        self.protocol = protocol
+        # Random start, so that after a restart relays do not take this node's new events for ones they have
+        # seen (gossip keys on origin and event id); half the 32-bit range is left before EVENT's id overflows
+        self.event_ids = itertools.count(random.randrange(1, 1 << 31))
+        # Identity of this node in fixes and towards peers, the IP address unless set
+        self.node_id = None
+        self.clock_sync = None
+        # With gossip_ttl > 0, detections travel up to that many hops: every node passes on
+        # the events it has not seen yet, by (origin node, event id), to `gossip_fanout`
+        # random peers (None: all of them) that speak gossip
+        self.gossip_ttl = gossip_ttl
+        self.gossip_fanout = gossip_fanout
+        self.seen = SeenCache()
+        self.relayed = 0
+        self.duplicates = 0
+        # Stage latencies and counters, shared with the detector; the outgoing queues only exist
+        # with AsyncConnection
+        self.metrics = Metrics()
+        self.metrics.gauge("connections", lambda: len(self.connections))
+        self.metrics.gauge("peer_queue_depth", lambda: max(
+            (c.queue_depth() for c in self.connections if hasattr(c, "queue_depth")), default=0))
+        self.metrics.gauge("peer_dropped", lambda: sum(getattr(c, "dropped", 0) for c in self.connections))
+        self.metrics.gauge("gossip_relayed", lambda: self.relayed)
+        self.metrics.gauge("gossip_duplicates", lambda: self.duplicates)
         
     def start_server(self):
         try:
             self.server_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
             self.server_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
             self.server_socket.bind(('', self.listening_port))
-            self.server_socket.listen(5)
-            print(f"Server started on port {self.listening_port}")
+            self.server_socket.listen(128)
+            log.info(f"Server started on port {self.listening_port}")
             
             while True:
                 client_socket, _ = self.server_socket.accept()
-                connection = Connection(client_socket, self.connection_id_counter)
-                self.connections.append(connection)
-                self.connection_id_counter += 1
+                connection = self.add_connection(lambda connection_id: Connection(
+                    client_socket, connection_id, self.protocol == "binary"))
                 threading.Thread(target=self.handle_connection, args=(connection,)).start()
-                print(f"New connection from {connection.address}:{connection.port}")
+                log.info(f"New connection from {connection.address}:{connection.port}")
                 
         except Exception as e:
-            print(f"Error starting server: {e}")
+            log.error(f"Error starting server: {e}")
             
+    def add_connection(self, make_connection):
+        """Create a connection with the next ID and register it."""
+        with self.connections_lock:
+            connection = make_connection(self.connection_id_counter)
+            self.connection_id_counter += 1
+            self.connections = self.connections + [connection]
+        if connection.binary_enabled:
+            connection.send_message(wire.hello_line(self.my_node_id(), self.listening_port, self.gossip_ttl > 0))
+        return connection
+
+    def remove_connection(self, connection) -> None:
+        with self.connections_lock:
+            if connection in self.connections:
+                self.connections = [c for c in self.connections if c is not connection]
+
+    def handle_message(self, connection, message: str):
+        """Dispatch one line received from a peer."""
+        if message.startswith(wire.HELLO):
+            connection.peer_version, node_id, connection.peer_port, connection.gossip = wire.parse_hello(message)
+            if node_id:
+                connection.node_id = node_id
+            if connection.binary_enabled and connection.peer_version >= 1:
+                connection.binary_out = True
+        elif message == wire.BINARY_MARKER:
+            connection.binary_in = True
+        elif message.startswith("CLOCK_SYNC"):
+            receive_time = time.time()
+            try:
+                fields = dict(part.split('=', 1) for part in message.split()[1:])
+                self.handle_clock_sync(connection, int(fields['seq']), fields['reply'] == '1',
+                                       float(fields['t1']), float(fields['t2']), float(fields['t3']),
+                                       receive_time)
+            except Exception as e:
+                log.warning(f"Error parsing clock sync message: {e}")
+        # Handle noise detection messages
+        elif message.startswith("NOISE_DETECTED"):
+            try:
+                amplitude, timestamp, snippet, event_type, channel = wire.parse_event_text(message)
+                self.dispatch_event(connection, amplitude, timestamp, snippet, event_type, channel)
+            except Exception as e:
+                log.warning(f"Error parsing noise detection message: {e}")
+        else:
+            log.info(f"Message received from {connection.address}:{connection.port} - {message}")
+
+    def handle_frame(self, connection, msg_type: int, payload: memoryview):
+        """Dispatch one binary frame received from a peer."""
+        if msg_type == wire.MSG_EVENT:
+            event_id, timestamp, amplitude, flags, event_type, channel = wire.decode_event(payload)
+            if flags & wire.EVENT_FLAG_SNIPPET:
+                connection.pending_event = (event_id, amplitude, timestamp, event_type, channel)
+            else:
+                self.dispatch_event(connection, amplitude, timestamp, None, event_type, channel)
+        elif msg_type == wire.MSG_SNIPPET:
+            event_id, start, rate, samples = wire.decode_snippet_frame(payload)
+            pending = connection.pending_event
+            if pending is not None and pending[0] == event_id:
+                connection.pending_event = None
+                self.dispatch_event(connection, pending[1], pending[2], (start, samples), *pending[3:])
+        elif msg_type == wire.MSG_GOSSIP:
+            self.handle_gossip(connection, payload)
+        elif msg_type == wire.MSG_TEXT:
+            self.handle_message(connection, bytes(payload).decode(errors='replace'))
+        elif msg_type == wire.MSG_HEARTBEAT:
+            connection.last_heartbeat = wire.HEARTBEAT.unpack_from(payload)
+        elif msg_type == wire.MSG_CLOCK_SYNC:
+            receive_time = time.time()
+            seq, is_reply, t1, t2, t3 = wire.CLOCK_SYNC.unpack_from(payload)
+            self.handle_clock_sync(connection, seq, bool(is_reply), t1, t2, t3, receive_time)
+        # Unknown types are skipped so newer peers can add messages
+
+    def handle_gossip(self, connection, payload: memoryview):
+        """Deliver a relayed event once, and pass it on while it has hops left."""
+        hops, origin, frames = wire.decode_gossip(payload)
+        stream = io.BytesIO(frames)
+        event = wire.read_frame(stream)
+        if event is None or event[0] != wire.MSG_EVENT:
+            return
+        event_id, timestamp, amplitude, flags, event_type, channel = wire.decode_event(event[1])
+        if origin == self.my_node_id() or not self.seen.add((origin, event_id)):
+            self.duplicates += 1
+            return
+        snippet, rate = None, 44100
+        if flags & wire.EVENT_FLAG_SNIPPET:
+            snippet_frame = wire.read_frame(stream)
+            if snippet_frame is not None and snippet_frame[0] == wire.MSG_SNIPPET:
+                _, start, rate, samples = wire.decode_snippet_frame(snippet_frame[1])
+                snippet = (start, samples)
+        timestamp, snippet = self.dispatch_event(connection, amplitude, timestamp, snippet, event_type, channel,
+                                                 origin)
+        if hops > 1:
+            # Timestamps are now on our clock, which is what our peers sync against
+            self.send_gossip(origin, event_id, hops - 1, amplitude, timestamp, snippet, rate, event_type, channel,
+                             exclude=connection)
+            self.relayed += 1
+
+    def gossip_targets(self, origin, exclude=None) -> list:
+        targets = [c for c in self.connections
+                   if c.gossip and c.binary_out and c is not exclude and c.node_id != origin]
+        if self.gossip_fanout is not None and len(targets) > self.gossip_fanout:
+            targets = random.sample(targets, self.gossip_fanout)
+        return targets
+
+    def send_gossip(self, origin, event_id: int, hops: int, amplitude: float, timestamp: float, snippet, rate: int,
+                    event_type=None, channel: int = 0, exclude=None):
+        targets = self.gossip_targets(origin, exclude)
+        if targets:
+            frames = wire.encode_event(event_id, amplitude, timestamp, snippet, rate, event_type, channel)
+            message = wire.encode_gossip(hops, origin, frames)
+            for connection in targets:
+                connection.send_encoded(None, message)
+
+    def gossip_stats(self) -> dict:
+        return {"ttl": self.gossip_ttl, "seen": len(self.seen), "relayed": self.relayed,
+                "duplicates": self.duplicates, "gossip_peers": sum(c.gossip for c in self.connections)}
+
+    def dispatch_event(self, connection, amplitude: float, timestamp: float, snippet, event_type=None,
+                       channel: int = 0, origin=None):
+        """Hand a peer's (or, with `origin`, a relayed) detection to event_handler; returns it on our clock."""
+        # Peer timestamps are on the peer's clock, move them onto ours
+        timestamp = connection.clock.to_local(timestamp)
+        if snippet is not None:
+            snippet = (connection.clock.to_local(snippet[0]), snippet[1])
+        connection.latest_event_time = timestamp
+        connection.latest_snippet = snippet
+        self.metrics.observe("receive", time.time() - timestamp)
+        self.metrics.count("peer_detections")
+        if self.event_handler is not None:
+            self.deliver_event(connection, amplitude, timestamp, snippet, event_type, channel, origin)
+        via = f" via {connection.address}:{connection.port}" if origin is not None else ""
+        log.info(f"Noise detected by peer {origin or f'{connection.address}:{connection.port}'}{via} "
+                 f"Amplitude: {amplitude:.2f}, Time: {timestamp}, Type: {event_type}")
+        return timestamp, snippet
+
+    def deliver_event(self, *event):
+        """Call event_handler; the reader thread of the connection runs it."""
+        self.event_handler(*event)
+
+    def handle_clock_sync(self, connection, seq: int, is_reply: bool,
+                          t1: float, t2: float, t3: float, receive_time: float):
+        """Answer a sync request, or feed a completed exchange into the peer's clock estimate."""
+        if is_reply:
+            connection.clock.update(t1, t2, t3, receive_time)
+        else:
+            self.send_clock_sync(connection, seq, True, t1, receive_time)
+
+    def send_clock_sync(self, connection, seq: int, is_reply: bool, t1: float, t2: float = 0.0):
+        # t3 is stamped as late as possible, right before encoding
+        t3 = time.time() if is_reply else 0.0
+        text = f"CLOCK_SYNC seq={seq} reply={int(is_reply)} t1={t1:.6f} t2={t2:.6f} t3={t3:.6f}"
+        binary = wire.encode_clock_sync(seq, is_reply, t1, t2, t3) if connection.binary_out else None
+        # A request still queued behind a slow peer carries a stale t1, so a newer one replaces it;
+        # replies answer one particular request and are never replaced
+        connection.send_encoded(text, binary, key=None if is_reply else "clock_sync")
+
+    def start_clock_sync(self, interval: float = 1.0):
+        """Keep estimating every peer's clock offset in the background."""
+        self.clock_sync = ClockSyncService(self, interval)
+        self.clock_sync.start()
+
+    def clock_stats(self) -> dict:
+        """Offset, drift and uncertainty of every peer's clock, keyed by address."""
+        return {f"{conn.address}:{conn.port}": conn.clock.stats() for conn in self.connections}
+
     def handle_connection(self, connection: Connection):
         try:
             while True:
-                message = connection.in_buffer.readline().strip()
+                if connection.binary_in:
+                    frame = wire.read_frame(connection.in_buffer)
+                    if frame is None:
+                        break
+                    self.handle_frame(connection, *frame)
+                    continue
+                message = connection.in_buffer.readline().decode(errors='replace').strip()
                 if not message:
                     break
-                
-                # Handle noise detection messages
-                if message.startswith("NOISE_DETECTED"):
-                    try:
-                        # Parse the message
-                        parts = message.split()
-                        amplitude = float(parts[1].split('=')[1])
-                        timestamp = float(parts[2].split('=')[1])
-                        connection.latest_event_time = timestamp
-                        print(f"\nNoise detected by peer {connection.address}:{connection.port}")
-                        print(f"Amplitude: {amplitude:.2f}, Time: {timestamp}")
-                        print("> ", end='', flush=True)  # Restore command prompt
-                    except Exception as e:
-                        print(f"Error parsing noise detection message: {e}")
-                else:
-                    print(f"Message received from {connection.address}:{connection.port} - {message}")
+                self.handle_message(connection, message)
                     
         except Exception as e:
-            print(f"Connection error with {connection.address}:{connection.port}")
+            log.warning(f"Connection error with {connection.address}:{connection.port}")
         finally:
             connection.close_connection()
-            if connection in self.connections:
-                self.connections.remove(connection)
+            self.remove_connection(connection)
                 
     def connect(self, destination: str, port: int):
         try:
@@ -91,19 +424,18 @@ class P2PNetwork:
             # Check for duplicate connections
             for conn in self.connections:
                 if conn.address == destination and conn.port == port:
-                    print(f"Error: Duplicate connection to {destination}:{port}")
+                    log.warning(f"Error: Duplicate connection to {destination}:{port}")
                     return
                     
             client_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
             client_socket.connect((destination, port))
-            connection = Connection(client_socket, self.connection_id_counter)
-            self.connections.append(connection)
-            self.connection_id_counter += 1
+            connection = self.add_connection(lambda connection_id: Connection(
+                    client_socket, connection_id, self.protocol == "binary"))
             threading.Thread(target=self.handle_connection, args=(connection,)).start()
-            print(f"Connected to {destination}:{port}")
+            log.info(f"Connected to {destination}:{port}")
             
         except Exception as e:
-            print(f"Error connecting to {destination}:{port}: {e}")
+            log.error(f"Error connecting to {destination}:{port}: {e}")
             
     def send(self, connection_id: int, message: str):
         connection = next((conn for conn in self.connections if conn.id == connection_id), None)
@@ -112,6 +444,38 @@ class P2PNetwork:
             print(f"Message sent to Connection ID: {connection_id}")
         else:
             print(f"Error: Connection ID {connection_id} not found.")
+
+    def broadcast(self, message: str):
+        """Send a message to every connected peer."""
+        for connection in self.connections:
+            connection.send_message(message)
+
+    def broadcast_event(self, amplitude: float, timestamp: float, snippet=None, rate: int = 44100,
+                        connections=None, event_type=None, channel: int = 0):
+        """Send a detection to every peer (or to `connections`), as a frame or a text line depending on what it speaks.
+
+        With gossip on, peers that relay get it wrapped for gossip_ttl hops.
+        """
+        event_id = next(self.event_ids)
+        text = binary = gossip = None
+        me = self.my_node_id()
+        if self.gossip_ttl > 0:
+            self.seen.add((me, event_id))
+        for connection in self.connections if connections is None else connections:
+            if self.gossip_ttl > 0 and connection.gossip and connection.binary_out:
+                if gossip is None:
+                    frames = wire.encode_event(event_id, amplitude, timestamp, snippet, rate, event_type, channel)
+                    gossip = wire.encode_gossip(self.gossip_ttl, me, frames)
+                connection.send_encoded(None, gossip)
+            elif connection.binary_out:
+                if binary is None:
+                    binary = wire.encode_event(event_id, amplitude, timestamp, snippet, rate, event_type, channel)
+                connection.send_encoded(None, binary)
+            else:
+                # Still encoded correctly if the peer switches to binary in between
+                if text is None:
+                    text = wire.format_event_text(amplitude, timestamp, snippet, event_type, channel)
+                connection.send_encoded(text)
             
     def list_connections(self):
         if not self.connections:
@@ -132,7 +496,7 @@ class P2PNetwork:
                 print(f"Failed to send termination message: {e}")
             finally:
                 connection.close_connection()
-                self.connections.remove(connection)
+                self.remove_connection(connection)
                 print(f"Connection {connection_id} terminated.")
         else:
             print(f"Error: Connection ID {connection_id} not found.")
@@ -141,18 +505,233 @@ class P2PNetwork:
         for connection in self.connections[:]:
             self.terminate_connection(connection.id)
             
+    def my_node_id(self) -> str:
+        return self.node_id or self.get_my_ip()
+
     def get_my_ip(self):
+        # Cached, as every detection and fix asks for the node id
+        return _interfaces.external_ip()
+
+class AsyncConnection(WireState):
+    """A peer connection driven by asyncio streams with a bounded outgoing queue.
+
+    send_message never blocks: it hands the message to the event loop, where
+    it is queued and written by this peer's own writer task, so a stalled
+    peer only ever delays itself. When the queue is full, `policy` decides:
+    "drop_oldest" evicts the oldest queued message, "drop_newest" discards
+    the new one. Messages sent with a coalesce `key` replace a queued
+    message with the same key instead of queueing behind it; clock sync
+    requests use this, as only the newest one is worth sending.
+    """
+
+    POLICIES = ("drop_oldest", "drop_newest")
+
+    def __init__(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter, connection_id: int,
+                 loop: asyncio.AbstractEventLoop, queue_size: int = 256, policy: str = "drop_oldest",
+                 binary_enabled: bool = True):
+        if policy not in self.POLICIES:
+            raise ValueError(f"Unknown queue policy {policy}, expected one of {self.POLICIES}")
+        self.reader = reader
+        self.writer = writer
+        self.id = connection_id
+        peer = writer.get_extra_info('peername')
+        self.address = peer[0]
+        self.port = peer[1]
+        self.loop = loop
+        self.queue_size = queue_size
+        self.policy = policy
+        self.queue = deque()  # (key, text, binary), only touched on the loop thread
+        self.queue_ready = asyncio.Event()
+        self.dropped = 0
+        self.coalesced = 0
+        self.sent = 0
+        self.closed = False
+        self.init_wire(binary_enabled)
+
+    def send_message(self, message: str, key: Optional[str] = None):
+        """Queue a message for this peer; safe to call from any thread."""
+        self.send_encoded(message, None, key)
+
+    def send_encoded(self, text: Optional[str], binary: Optional[bytes] = None, key: Optional[str] = None):
+        """Queue a message given as a text line and/or binary frame; the form is picked when written."""
+        if self.closed:
+            return
+        if self._on_loop_thread():
+            self._enqueue(key, text, binary)
+        else:
+            self.loop.call_soon_threadsafe(self._enqueue, key, text, binary)
+
+    def _on_loop_thread(self) -> bool:
         try:
-            for interface in netifaces.interfaces():
-                addrs = netifaces.ifaddresses(interface)
-                if netifaces.AF_INET in addrs:
-                    for addr in addrs[netifaces.AF_INET]:
-                        ip = addr['addr']
-                        if not ip.startswith('127.'):
-                            return ip
-            return "Could not determine external IP address."
+            return asyncio.get_running_loop() is self.loop
+        except RuntimeError:
+            return False
+
+    def _enqueue(self, key, text: Optional[str], binary: Optional[bytes]):
+        if key is not None:
+            for i, queued in enumerate(self.queue):
+                if queued[0] == key:
+                    self.queue[i] = (key, text, binary)
+                    self.coalesced += 1
+                    return
+        if len(self.queue) >= self.queue_size:
+            self.dropped += 1
+            if self.policy == "drop_newest":
+                return
+            self.queue.popleft()
+        self.queue.append((key, text, binary))
+        self.queue_ready.set()
+
+    async def write_loop(self):
+        try:
+            while not self.closed:
+                if not self.queue:
+                    self.queue_ready.clear()
+                    await self.queue_ready.wait()
+                    continue
+                _, text, binary = self.queue.popleft()
+                self.writer.write(self.encode_outgoing(text, binary))
+                await self.writer.drain()
+                self.sent += 1
+        except (ConnectionError, asyncio.CancelledError):
+            pass
+
+    def queue_depth(self) -> int:
+        return len(self.queue)
+
+    def close_connection(self):
+        if self.closed:
+            return
+        self.closed = True
+        try:
+            if self._on_loop_thread():
+                self._close()
+            else:
+                self.loop.call_soon_threadsafe(self._close)
+            log.info(f"Connection {self.id} closed.")
+        except Exception as e:
+            log.error(f"Error closing connection: {e}")
+
+    def _close(self):
+        # Hand whatever is still queued to the transport, which flushes it before closing
+        while self.queue:
+            _, text, binary = self.queue.popleft()
+            self.writer.write(self.encode_outgoing(text, binary))
+        self.queue_ready.set()
+        self.writer.close()
+
+
+class AsyncP2PNetwork(P2PNetwork):
+    """P2PNetwork on a single asyncio event loop instead of a thread per connection.
+
+    The loop runs in whichever thread calls start_server (main() already runs
+    it as a daemon thread). All other methods keep their blocking signatures
+    for the command loop and are safe to call from any thread. Peer
+    detections go through a queue to one handler thread, so association and
+    solving never hold up reading and sending on the loop.
+    """
+
+    def __init__(self, port: int, queue_size: int = 256, policy: str = "drop_oldest",
+                 protocol: str = "binary", gossip_ttl: int = 0, gossip_fanout: Optional[int] = None):
+        super().__init__(port, protocol, gossip_ttl, gossip_fanout)
+        self.queue_size = queue_size
+        self.policy = policy
+        self.loop = asyncio.new_event_loop()
+        self.loop_ready = threading.Event()
+        self.events = queue.Queue()
+        self.metrics.gauge("event_queue_depth", self.events.qsize)
+
+    def deliver_event(self, *event):
+        self.events.put(event)
+
+    def handle_events(self):
+        while True:
+            event = self.events.get()
+            try:
+                self.event_handler(*event)
+            except Exception as e:
+                log.error(f"Error handling event from {event[0].address}:{event[0].port}: {e}")
+
+    def start_server(self):
+        threading.Thread(target=self.handle_events, daemon=True).start()
+        asyncio.set_event_loop(self.loop)
+        try:
+            server = self.loop.run_until_complete(
+                asyncio.start_server(self._accept, host=None, port=self.listening_port,
+                                     reuse_address=True, backlog=1024))
+            self.server_socket = server
+            log.info(f"Server started on port {self.listening_port}")
+            self.loop_ready.set()
+            self.loop.run_forever()
+        except Exception as e:
+            log.error(f"Error starting server: {e}")
+            self.loop_ready.set()
+
+    def _register(self, reader, writer) -> AsyncConnection:
+        connection = self.add_connection(lambda connection_id: AsyncConnection(
+            reader, writer, connection_id, self.loop, self.queue_size, self.policy,
+            self.protocol == "binary"))
+        connection.writer_task = self.loop.create_task(connection.write_loop())
+        connection.reader_task = self.loop.create_task(self._read_loop(connection))
+        return connection
+
+    async def _accept(self, reader, writer):
+        connection = self._register(reader, writer)
+        log.info(f"New connection from {connection.address}:{connection.port}")
+
+    async def _read_loop(self, connection: AsyncConnection):
+        try:
+            while True:
+                if connection.binary_in:
+                    frame = await wire.read_frame_async(connection.reader)
+                    if frame is None:
+                        break
+                    self.handle_frame(connection, *frame)
+                    continue
+                line = await connection.reader.readline()
+                message = line.decode(errors='replace').strip()
+                if not message:
+                    break
+                self.handle_message(connection, message)
         except Exception as e:
-            return f"Error retrieving IP address: {e}"
+            log.warning(f"Connection error with {connection.address}:{connection.port}")
+        finally:
+            connection.close_connection()
+            connection.writer_task.cancel()
+            self.remove_connection(connection)
+
+    async def _connect(self, destination: str, port: int) -> AsyncConnection:
+        reader, writer = await asyncio.open_connection(destination, port)
+        return self._register(reader, writer)
+
+    def connect(self, destination: str, port: int, timeout: float = 10.0):
+        for conn in self.connections:
+            if conn.address == destination and conn.port == port:
+                log.warning(f"Error: Duplicate connection to {destination}:{port}")
+                return
+        try:
+            self.loop_ready.wait(timeout)
+            future = asyncio.run_coroutine_threadsafe(self._connect(destination, port), self.loop)
+            future.result(timeout)
+            log.info(f"Connected to {destination}:{port}")
+        except Exception as e:
+            log.error(f"Error connecting to {destination}:{port}: {e}")
+
+    def terminate_connection(self, connection_id: int):
+        connection = next((conn for conn in self.connections if conn.id == connection_id), None)
+        if connection:
+            connection.send_message("Connection is being terminated.")
+            connection.close_connection()
+            self.remove_connection(connection)
+            print(f"Connection {connection_id} terminated.")
+        else:
+            print(f"Error: Connection ID {connection_id} not found.")
+
+    def queue_stats(self) -> dict:
+        """Queue depth and drop counters per connection ID."""
+        return {conn.id: {"depth": conn.queue_depth(), "dropped": conn.dropped,
+                          "coalesced": conn.coalesced, "sent": conn.sent}
+                for conn in self.connections}
 
 def print_help():
     print("Available commands:")
@@ -175,6 +754,7 @@ def main():
     else:
         port = 4093
         
+    start_logging()
     network = P2PNetwork(port)
     server_thread = threading.Thread(target=network.start_server)
     server_thread.daemon = True
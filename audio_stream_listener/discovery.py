@@ -0,0 +1,123 @@
+import logging
+import random
+import socket
+import struct
+import threading
+import time
+from typing import Dict, Optional, Tuple
+
+log = logging.getLogger(__name__)
+
+BEACON = "TNDISC"
+
+
+class Discovery:
+    """Find peers on the local network by UDP beacons and keep `degree` connections open.
+
+    Every node broadcasts (or, for a multicast `address`, multicasts)
+    "TNDISC node=<id> port=<tcp port>" each `interval` seconds and listens
+    for the others' beacons. While it has fewer than `degree` connections
+    it dials a random peer it heard within `expiry` seconds; of two nodes
+    that hear each other only the one with the smaller (id, port) dials,
+    so they do not connect twice. Together with gossip relaying
+    (P2PNetwork gossip_ttl) detections reach nodes without a direct link.
+    """
+
+    def __init__(self, network, port: int = 47999, address: str = "255.255.255.255", interval: float = 2.0,
+                 degree: int = 4, expiry: float = 10.0):
+        self.network = network
+        self.port = port
+        self.address = address
+        self.interval = interval
+        self.degree = degree
+        self.expiry = expiry
+        # (node id, tcp port) -> (ip address, time last heard)
+        self.peers: Dict[Tuple[str, int], Tuple[str, float]] = {}
+        self.lock = threading.Lock()
+        self.running = False
+        self.sock: Optional[socket.socket] = None
+
+    def open_socket(self) -> socket.socket:
+        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM, socket.IPPROTO_UDP)
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        if hasattr(socket, "SO_REUSEPORT"):
+            # Several nodes on one host all hear the beacons
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_BROADCAST, 1)
+        sock.bind(("", self.port))
+        if socket.inet_aton(self.address)[0] >> 4 == 14:  # 224.0.0.0/4
+            membership = struct.pack("4sl", socket.inet_aton(self.address), socket.INADDR_ANY)
+            sock.setsockopt(socket.IPPROTO_IP, socket.IP_ADD_MEMBERSHIP, membership)
+            sock.setsockopt(socket.IPPROTO_IP, socket.IP_MULTICAST_LOOP, 1)
+        sock.settimeout(self.interval)
+        return sock
+
+    def start(self) -> None:
+        self.sock = self.open_socket()
+        self.running = True
+        for target in (self.listen, self.announce, self.maintain):
+            threading.Thread(target=target, daemon=True).start()
+
+    def stop(self) -> None:
+        self.running = False
+
+    def me(self) -> Tuple[str, int]:
+        return self.network.my_node_id(), self.network.listening_port
+
+    def announce(self) -> None:
+        while self.running:
+            node_id, port = self.me()
+            try:
+                self.sock.sendto(f"{BEACON} node={node_id} port={port}".encode(), (self.address, self.port))
+            except OSError as e:
+                log.error(f"Error sending discovery beacon: {e}")
+            time.sleep(self.interval)
+
+    def listen(self) -> None:
+        while self.running:
+            try:
+                data, (address, _) = self.sock.recvfrom(512)
+            except socket.timeout:
+                continue
+            except OSError:
+                if self.running:
+                    time.sleep(self.interval)
+                continue
+            parts = data.decode(errors="replace").split()
+            if not parts or parts[0] != BEACON:
+                continue
+            fields = dict(part.split("=", 1) for part in parts[1:] if "=" in part)
+            try:
+                key = (fields["node"], int(fields["port"]))
+            except (KeyError, ValueError):
+                continue
+            if key != self.me():
+                with self.lock:
+                    self.peers[key] = (address, time.time())
+
+    def connected(self, key: Tuple[str, int], address: str) -> bool:
+        return any((c.node_id, c.peer_port) == key or (c.address, c.port) == (address, key[1])
+                   for c in self.network.connections)
+
+    def candidates(self) -> list:
+        """Live peers that we should dial and are not connected to yet."""
+        now = time.time()
+        me = self.me()
+        with self.lock:
+            self.peers = {k: v for k, v in self.peers.items() if now - v[1] < self.expiry}
+            peers = list(self.peers.items())
+        return [(key, address) for key, (address, _) in peers if key > me and not self.connected(key, address)]
+
+    def maintain(self) -> None:
+        while self.running:
+            missing = self.degree - len(self.network.connections)
+            if missing > 0:
+                candidates = self.candidates()
+                for (_, port), address in random.sample(candidates, min(missing, len(candidates))):
+                    self.network.connect(address, port)
+            time.sleep(self.interval)
+
+    def stats(self) -> dict:
+        with self.lock:
+            return {"peers": len(self.peers), "connections": len(self.network.connections),
+                    "degree": self.degree}
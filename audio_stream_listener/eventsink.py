@@ -0,0 +1,288 @@
+import glob
+import json
+import logging
+import os
+import queue
+import re
+import threading
+import time
+from typing import List, Optional
+
+import numpy as np
+
+from wire import EVENT_TYPES
+
+log = logging.getLogger(__name__)
+
+# One row per fix in the columnar archive
+ARCHIVE_DTYPE = np.dtype([
+    ("event_id", "<i8"),
+    ("time", "<f8"),  # Earliest arrival time of the event
+    ("x", "<f8"),
+    ("y", "<f8"),
+    ("z", "<f8"),
+    ("amplitude", "<f4"),
+    ("n_nodes", "<i2"),
+    ("error_major", "<f4"),  # 1-sigma error ellipse axes (m), NaN for degenerate fixes
+    ("error_minor", "<f4"),
+    ("event_type", "u1"),  # Index into wire.EVENT_TYPES, 0 (unknown) when not classified
+])
+
+
+def archive_row(event: dict) -> tuple:
+    """Flatten a JSONL event into an ARCHIVE_DTYPE row."""
+    times = [t for t in event.get("event_times", {}).values() if t is not None]
+    source = [float("nan") if v is None else v for v in ((event.get("coord_dict") or {}).get("source") or [])]
+    x, y, z = (source + [float("nan")] * 3)[:3]
+    if len(source) == 2:
+        z = 0.0
+    uncertainty = event.get("uncertainty") or {}
+    event_type = event.get("type")
+    return (event.get("event_id", -1), min(times) if times else float("nan"),
+            x, y, z, event.get("amplitude", float("nan")), len(times),
+            uncertainty.get("semi_major", float("nan")), uncertainty.get("semi_minor", float("nan")),
+            EVENT_TYPES.index(event_type) if event_type in EVENT_TYPES else 0)
+
+
+class EventSink:
+    """Non-blocking JSONL event writer with rotation and a columnar archive.
+
+    write() only queues the event; a background thread appends batches to
+    `path`, flushes after every batch and fsyncs at most every
+    `fsync_interval` seconds. The file is rotated to `<stem>.<UTC time>.jsonl`
+    once it exceeds `rotate_bytes` or is older than `rotate_seconds`. On
+    start the existing file is appended to, after cutting off a partial last
+    line left by a crash.
+
+    With `archive=True`, every event is also added to NumPy structured-array
+    chunks of `chunk_size` rows in `<stem>.archive/`, which archive_chunks
+    memory-maps. A partial chunk is written once its oldest row is
+    `archive_interval` seconds old, so a crash loses at most that much.
+    `archive_format="parquet"` writes Parquet instead when pyarrow is
+    installed.
+    """
+
+    def __init__(self, path: str, rotate_bytes: int = 64 * 1024 * 1024, rotate_seconds: float = 24 * 3600,
+                 fsync_interval: float = 1.0, max_queue: int = 10000, archive: bool = True,
+                 chunk_size: int = 4096, archive_format: str = "npy", archive_interval: float = 60.0):
+        self.path = path
+        self.stem = os.path.splitext(path)[0]
+        self.rotate_bytes = rotate_bytes
+        self.rotate_seconds = rotate_seconds
+        self.fsync_interval = fsync_interval
+        self.queue = queue.Queue(maxsize=max_queue)
+        self.dropped = 0
+        self.written = 0
+        self.archive = archive
+        self.chunk_size = chunk_size
+        self.archive_format = archive_format
+        self.archive_interval = archive_interval
+        if archive_format == "parquet":
+            try:
+                import pyarrow  # noqa: F401
+            except ImportError:
+                log.warning("pyarrow not installed, archiving as .npy chunks")
+                self.archive_format = "npy"
+        self.archive_dir = f"{self.stem}.archive"
+        self.pending_rows: List[tuple] = []
+        self.pending_since = 0.0  # When the oldest pending row was added
+        self.file = None
+        self.opened_at = 0.0
+        self.last_fsync = 0.0
+        self.running = False
+        self.thread: Optional[threading.Thread] = None
+
+    def start(self) -> "EventSink":
+        self._open()
+        if self.archive:
+            os.makedirs(self.archive_dir, exist_ok=True)
+        self.running = True
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+        return self
+
+    def write(self, event: dict) -> None:
+        """Queue an event for writing; never blocks the caller."""
+        try:
+            self.queue.put_nowait(event)
+        except queue.Full:
+            self.dropped += 1
+
+    def close(self) -> None:
+        """Write everything still queued, then close the files."""
+        self.running = False
+        if self.thread is not None:
+            self.thread.join()
+        self._drain()
+        self._flush_archive()
+        if self.file is not None:
+            self._sync()
+            self.file.close()
+            self.file = None
+
+    def _open(self) -> None:
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._repair_tail()
+        self.file = open(self.path, "a")
+        self.opened_at = time.time()
+        if self.file.tell() > 0:
+            # Rotation age counts from the first event in the file
+            self.opened_at = self._first_event_time()
+
+    def _first_event_time(self) -> float:
+        """Time of the first event in the file: its earliest arrival time.
+
+        Without one, the file's birth time where the OS keeps it, else its
+        last write, which makes the file look younger than it is.
+        """
+        try:
+            with open(self.path) as f:
+                first = json.loads(f.readline())
+            times = [t for t in first.get("event_times", {}).values() if t is not None]
+            if times:
+                return min(min(times), time.time())
+        except (OSError, ValueError, AttributeError):
+            pass
+        stat = os.stat(self.path)
+        return getattr(stat, "st_birthtime", stat.st_mtime)
+
+    def _repair_tail(self) -> None:
+        """Cut off a partial last line so appended events stay valid JSONL."""
+        if not os.path.exists(self.path) or os.path.getsize(self.path) == 0:
+            return
+        with open(self.path, "rb+") as f:
+            f.seek(0, os.SEEK_END)
+            size = f.tell()
+            pos = size
+            while pos > 0:
+                step = min(4096, pos)
+                f.seek(pos - step)
+                block = f.read(step)
+                newline = block.rfind(b"\n")
+                if newline != -1:
+                    pos = pos - step + newline + 1
+                    break
+                pos -= step
+            if pos != size:
+                f.truncate(pos)
+
+    def _rotate(self) -> None:
+        self._sync()
+        self.file.close()
+        stamp = time.strftime("%Y%m%dT%H%M%SZ", time.gmtime())
+        rotated = f"{self.stem}.{stamp}.jsonl"
+        suffix = 1
+        while os.path.exists(rotated):
+            rotated = f"{self.stem}.{stamp}-{suffix}.jsonl"
+            suffix += 1
+        os.replace(self.path, rotated)
+        self._flush_archive()
+        self._open()
+
+    def _sync(self) -> None:
+        self.file.flush()
+        os.fsync(self.file.fileno())
+        self.last_fsync = time.time()
+
+    def _drain(self) -> int:
+        """Write every queued event as one batch."""
+        lines = []
+        self._mark_pending()
+        while True:
+            try:
+                event = self.queue.get_nowait()
+            except queue.Empty:
+                break
+            lines.append(json.dumps(event))
+            if self.archive:
+                self.pending_rows.append(archive_row(event))
+        if lines:
+            self.file.write("\n".join(lines) + "\n")
+            self.file.flush()
+            self.written += len(lines)
+        if len(self.pending_rows) >= self.chunk_size:
+            self._flush_archive()
+        return len(lines)
+
+    def _run(self) -> None:
+        while self.running:
+            try:
+                # Wake on the first event, then take everything queued behind it
+                self._write_first(self.queue.get(timeout=self.fsync_interval))
+            except queue.Empty:
+                pass
+            self._drain()
+            now = time.time()
+            if now - self.last_fsync >= self.fsync_interval:
+                self._sync()
+            if self.pending_rows and now - self.pending_since >= self.archive_interval:
+                self._flush_archive()
+            if self.file.tell() >= self.rotate_bytes or now - self.opened_at >= self.rotate_seconds:
+                if self.file.tell() > 0:
+                    self._rotate()
+
+    def _write_first(self, event: dict) -> None:
+        self.file.write(json.dumps(event) + "\n")
+        self.written += 1
+        if self.archive:
+            self._mark_pending()
+            self.pending_rows.append(archive_row(event))
+
+    def _mark_pending(self) -> None:
+        if not self.pending_rows:
+            self.pending_since = time.time()
+
+    def _flush_archive(self) -> None:
+        if not self.archive or not self.pending_rows:
+            return
+        rows = np.array(self.pending_rows, dtype=ARCHIVE_DTYPE)
+        self.pending_rows = []
+        index = next_chunk_index(self.archive_dir)
+        name = os.path.join(self.archive_dir, f"chunk-{index:06d}")
+        if self.archive_format == "parquet":
+            import pyarrow as pa
+            import pyarrow.parquet as pq
+            pq.write_table(pa.table({field: rows[field] for field in ARCHIVE_DTYPE.names}), name + ".parquet")
+        else:
+            # Write then rename, so a reader never maps a half-written chunk
+            np.save(name + ".tmp.npy", rows)
+            os.replace(name + ".tmp.npy", name + ".npy")
+
+
+def next_chunk_index(archive_dir: str) -> int:
+    """One past the highest finished chunk number in an archive (temporary files do not count)."""
+    indices = [int(m.group(1)) for m in (re.fullmatch(r"chunk-(\d+)\.(npy|parquet)", os.path.basename(path))
+                                         for path in glob.glob(os.path.join(archive_dir, "chunk-*")))
+               if m]
+    return max(indices, default=-1) + 1
+
+
+def archive_chunks(archive_dir: str) -> List[np.ndarray]:
+    """Every .npy chunk of an archive, memory-mapped, oldest first."""
+    return [np.load(path, mmap_mode="r")
+            for path in sorted(glob.glob(os.path.join(archive_dir, "chunk-*.npy")))
+            if not path.endswith(".tmp.npy")]
+
+
+def load_archive(archive_dir: str) -> np.ndarray:
+    """All chunks of an archive as one structured array."""
+    chunks = [_upgrade(c) for c in archive_chunks(archive_dir)]
+    if not chunks:
+        return np.empty(0, dtype=ARCHIVE_DTYPE)
+    return chunks[0] if len(chunks) == 1 else np.concatenate(chunks)
+
+
+def _upgrade(chunk: np.ndarray) -> np.ndarray:
+    """Chunks written before a column was added get it filled with NaN (or 0 for integer columns)."""
+    if chunk.dtype == ARCHIVE_DTYPE:
+        return chunk
+    out = np.zeros(len(chunk), dtype=ARCHIVE_DTYPE)
+    for name in ARCHIVE_DTYPE.names:
+        if ARCHIVE_DTYPE[name].kind == "f":
+            out[name] = np.nan
+    for name in chunk.dtype.names:
+        if name in ARCHIVE_DTYPE.names:
+            out[name] = chunk[name]
+    return out
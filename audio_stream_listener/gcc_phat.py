@@ -0,0 +1,58 @@
+from typing import Dict, Hashable, Optional
+
+import numpy as np
+
+from onset import parabolic_refine
+
+
+class GccPhat:
+    """Pairwise TDOA between audio snippets with GCC-PHAT.
+
+    PHAT weighting of X * conj(Y) is the same as multiplying the two
+    whitened spectra X/|X| and conj(Y/|Y|), so each snippet is transformed
+    and whitened exactly once when added; every pair then costs a single
+    product and inverse FFT.
+    """
+
+    def __init__(self, rate: int, snippet_samples: int, max_tau: Optional[float] = None):
+        self.rate = rate
+        self.nfft = 1 << (2 * snippet_samples - 1).bit_length()
+        self.max_shift = self.nfft // 2
+        if max_tau is not None:
+            self.max_shift = min(self.max_shift, int(max_tau * rate) + 1)
+        self.spectra: Dict[Hashable, np.ndarray] = {}
+        self.start_times: Dict[Hashable, float] = {}
+
+    def add(self, key: Hashable, samples: np.ndarray, start_time: float) -> None:
+        """Register a snippet whose first sample was captured at `start_time`."""
+        spectrum = np.fft.rfft(samples - np.mean(samples), self.nfft)
+        magnitude = np.abs(spectrum)
+        self.spectra[key] = spectrum / np.maximum(magnitude, np.finfo(np.float64).tiny)
+        self.start_times[key] = start_time
+
+    def clear(self) -> None:
+        self.spectra.clear()
+        self.start_times.clear()
+
+    def lag(self, key_a: Hashable, key_b: Hashable) -> float:
+        """Delay of snippet b relative to snippet a, in fractional samples."""
+        cc = np.fft.irfft(self.spectra[key_b] * np.conj(self.spectra[key_a]), self.nfft)
+        # Arrange lags as -max_shift..max_shift
+        cc = np.concatenate((cc[-self.max_shift:], cc[:self.max_shift + 1]))
+        idx = int(np.argmax(cc))
+        return parabolic_refine(cc, idx) - self.max_shift
+
+    def tdoa(self, key_a: Hashable, key_b: Hashable) -> float:
+        """Arrival time at b minus arrival time at a, in seconds."""
+        return float(self.start_times[key_b] - self.start_times[key_a]
+                     + self.lag(key_a, key_b) / self.rate)
+
+    def pairwise(self) -> Dict[tuple, float]:
+        """TDOA for every pair of registered snippets."""
+        keys = list(self.spectra)
+        return {(a, b): self.tdoa(a, b) for i, a in enumerate(keys) for b in keys[i + 1:]}
+
+    def aligned_times(self, reference_key: Hashable, reference_time: float) -> Dict[Hashable, float]:
+        """Arrival times of all snippets, anchored to the reference node's own onset time."""
+        return {key: reference_time + (self.tdoa(reference_key, key) if key != reference_key else 0.0)
+                for key in self.spectra}
@@ -0,0 +1,45 @@
+import logging
+import queue
+import sys
+from logging.handlers import QueueHandler, QueueListener
+
+
+class DroppingQueueHandler(QueueHandler):
+    """QueueHandler that drops (and counts) records instead of blocking when the queue is full."""
+
+    def __init__(self, log_queue: queue.Queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def enqueue(self, record: logging.LogRecord) -> None:
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # Same process, so no need to pre-format for pickling; the listener thread formats
+        return record
+
+
+def start_logging(level: int = logging.INFO, stream=None, max_queue: int = 10000) -> QueueListener:
+    """Send all logging through a bounded queue to a background thread writing to `stream` (stdout).
+
+    Detection and connection threads then only pay for an enqueue, and a
+    slow console can never stall them. Call stop() on the
+    returned listener to flush at exit. The handler is the listener's
+    `producer` attribute, for its drop count.
+    """
+    log_queue = queue.Queue(maxsize=max_queue)
+    console = logging.StreamHandler(stream if stream is not None else sys.stdout)
+    console.setFormatter(logging.Formatter("%(message)s"))
+    handler = DroppingQueueHandler(log_queue)
+    root = logging.getLogger()
+    root.setLevel(level)
+    for old in [h for h in root.handlers if isinstance(h, DroppingQueueHandler)]:
+        root.removeHandler(old)
+    root.addHandler(handler)
+    listener = QueueListener(log_queue, console, respect_handler_level=True)
+    listener.producer = handler
+    listener.start()
+    return listener
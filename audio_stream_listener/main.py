@@ -1,26 +1,45 @@
-import json
-import pyaudio
+import argparse
+import logging
+import os
 import numpy as np
 import sys
 import time
 import threading
 from typing import Optional
-from connection import P2PNetwork
+from connection import AsyncConnection, AsyncP2PNetwork, P2PNetwork
+from discovery import Discovery
+from capture import RingBuffer, StreamClock
+from multicapture import (PA_CONTINUE, PA_FLOAT32, PA_INPUT_OVERFLOW, first_input_device, input_devices, open_audio,
+                          open_inputs, parse_input, run_channel_pool)
+from onset import OnsetTimer
+from gcc_phat import GccPhat
+from classify import EventClassifier
+from ranging import RangingService
+from multilateration import TIMING_SIGMA, covariance_batch, locate, positions_array, uncertainty_dict
+from association import EventAssociator
+from calibration import SelfCalibrator
+from nodeindex import NodeSelector
+from noisefloor import NoiseFloor
+from tracker import MultiTargetTracker
+from eventsink import EventSink
+from logqueue import start_logging
+from metrics import Metrics, MetricsDumper
+from wire import node_of, sensor_id
 
-import numpy as np
+log = logging.getLogger(__name__)
 
 def get_sound_position(timestamps: dict,
                       speed_of_sound: float = 343.0,  # meters/second
                       mic_positions: dict = None) -> dict:
     if len(timestamps) < 3:
-        print("Need at least 3 timestamps to calculate position")
+        log.info("Need at least 3 timestamps to calculate position")
         return None
     
-    # Use first 3 devices when sorted by ID
-    sorted_devices = sorted(timestamps.keys())[:3]
+    sorted_devices = sorted(timestamps.keys())
     
-    # Default mic positions (equilateral triangle)
+    # Default mic positions (equilateral triangle) only cover the first 3 devices
     if mic_positions is None:
+        sorted_devices = sorted_devices[:3]
         default_positions = [
             np.array([0, 0]),      # First device
             np.array([1, 0]),      # Second device
@@ -30,54 +49,14 @@ def get_sound_position(timestamps: dict,
             device_id: pos 
             for device_id, pos in zip(sorted_devices, default_positions)
         }
+    else:
+        sorted_devices = [d for d in sorted_devices if d in mic_positions]
+        mic_positions = {d: np.asarray(mic_positions[d], dtype=float) for d in sorted_devices}
     
-    # Get reference time (earliest timestamp)
-    reference_time = min(timestamps[device_id] for device_id in sorted_devices)
-    reference_device = min(
-        ((device_id, timestamps[device_id]) for device_id in sorted_devices),
-        key=lambda x: x[1]
-    )[0]
-    
-    # Calculate time differences relative to reference mic
-    time_diffs = {}
-    for device_id in sorted_devices:
-        if device_id == reference_device:
-            continue
-        time_diffs[device_id] = timestamps[device_id] - reference_time
-    
-    # Convert time differences to distance differences
-    distance_diffs = {
-        device_id: dt * speed_of_sound 
-        for device_id, dt in time_diffs.items()
-    }
-    
-    # Get mic positions
-    p1 = mic_positions[reference_device]
-    remaining_devices = [d for d in sorted_devices if d != reference_device]
-    p2 = mic_positions[remaining_devices[0]]
-    p3 = mic_positions[remaining_devices[1]]
-    
-    # Get distance differences
-    d21 = distance_diffs[remaining_devices[0]]
-    d31 = distance_diffs[remaining_devices[1]]
-    
-    # Create matrices for solving system of equations
-    A = np.array([
-        [2*(p2[0] - p1[0]), 2*(p2[1] - p1[1])],
-        [2*(p3[0] - p1[0]), 2*(p3[1] - p1[1])]
-    ])
-    
-    # Distance equations
-    b = np.array([
-        d21**2 + np.sum(p1**2) - np.sum(p2**2),
-        d31**2 + np.sum(p1**2) - np.sum(p3**2)
-    ])
-    
-    # Solve for source position
-    try:
-        source_position = np.linalg.solve(A, b)
-    except np.linalg.LinAlgError:
-        source_position = np.array([float('nan'), float('nan')])
+    # Least-squares fit over every device with a known position (2D or 3D)
+    positions = positions_array(mic_positions, sorted_devices)
+    times = np.array([timestamps[d] for d in sorted_devices], dtype=float)
+    source_position, _ = locate(positions, times, speed_of_sound)
     
     res = {
         **mic_positions,
@@ -85,18 +64,44 @@ def get_sound_position(timestamps: dict,
     }
     return {k:v.tolist() for k,v in res.items()}
 
+def get_fix_uncertainty(timestamps: dict, coord_dict: dict, timing_sigma: dict = None,
+                        speed_of_sound: float = 343.0) -> Optional[dict]:
+    """Covariance and 1-sigma error ellipse of a get_sound_position fix, None if it is degenerate."""
+    if not coord_dict or coord_dict.get('source') is None:
+        return None
+    devices = [d for d in sorted(timestamps) if d in coord_dict and d != 'source']
+    times = np.array([[timestamps[d] for d in devices]], dtype=float)
+    sigma = np.array([(timing_sigma or {}).get(node_of(d), TIMING_SIGMA) for d in devices])
+    source = np.array([coord_dict['source']], dtype=float)
+    cov = covariance_batch(positions_array(coord_dict, devices), times, source, sigma, speed_of_sound)
+    return uncertainty_dict(cov[0])
+
 class NoiseDetector:
     # Audio configuration constants
-    FORMAT = pyaudio.paFloat32  # Audio format (32-bit float)
+    FORMAT = PA_FLOAT32  # Audio format (32-bit float)
     CHANNELS = 1  # Mono audio
     RATE = 44100  # Sampling rate (Hz)
     CHUNK_SIZE = 1024  # Number of frames per buffer (CHUNK_SIZE/RATE~0.0232seconds (23.2 ms))
     WINDOW_SIZE_SECS = CHUNK_SIZE/RATE
     # Detection parameters
-    THRESHOLD = 3   # Amplitude threshold for noise detection
+    THRESHOLD = 3   # Amplitude threshold for noise detection with the fixed trigger
     COOLDOWN = 1  # Seconds between detections to avoid multiple triggers
+    # Callback capture
+    RING_SECONDS = 5  # Audio history kept in the ring buffer
+    READ_TIMEOUT = 1.0  # Seconds to wait for the capture callback before giving up
+    SNIPPET_PRE_SECONDS = 0.005  # Part of the shared snippet before the onset
+    # Low-power mode (callback capture only): a strided scan over whole blocks
+    # wakes the full-rate path only for blocks with loud audio in them
+    LOW_POWER_BLOCK_CHUNKS = 8  # Chunks per scan (~186 ms): the ring wakes the scan ~5 times a second, not 43
+    LOW_POWER_STEP = 8  # Scan every 8th sample (5.5 kHz), still several samples of a 1 ms blast
+    WAKE_FRACTION = 0.5  # Scan threshold relative to the trigger level, as the strided peak can miss the true one
+    CPU_WATTS = 1.0  # Extra draw while the detector is busy, for the energy estimate
+    # The input device picked last time, tried before scanning all devices; None always scans
+    DEVICE_CACHE = os.path.expanduser("~/.cache/triangulate-noise/input-device.json")
 
-    def __init__(self, network=None, output_file = None):
+    def __init__(self, network=None, output_file = None, capture_mode = "callback",
+                 onset_method = "aic", snippet_seconds = None, low_power = False, trigger = "adaptive",
+                 classify_seconds = None, inputs = None, workers = None, parent = None):
         self.audio = None
         self.stream = None
         self.last_detection = 0
@@ -104,22 +109,114 @@ class NoiseDetector:
         # Add buffer start time tracking
         self.buffer_start_time = 0
         self.output_file = output_file
+        # Background JSONL writer with rotation and a columnar archive next to it
+        self.sink = EventSink(output_file).start() if output_file is not None else None
+        # Live feed for the map frontend, set by main() when --stream-port is given
+        self.event_stream = None
+        self.published_nodes = None
+        # "callback" fills a ring buffer from the PortAudio thread, "blocking" uses stream.read
+        self.capture_mode = capture_mode
+        self.ring = None
+        self.clock = None
+        self.read_pos = 0
+        self.overflow_count = 0
+        # (device index, [channel, ...]) pairs to capture from (callback capture only), None opens the
+        # first input device in mono. Every channel is detected on its own, by this detector for the
+        # first and by siblings for the rest, as extra microphones "<node id>#<n>" of this node
+        self.inputs = inputs
+        self.workers = workers
+        self.captures = []
+        self.channel = 0  # Column of the ring buffer this detector reads
+        self.sensor_index = 0
+        self.siblings = []
+        self.low_power = low_power
+        self.wake_until = 0
+        self.wakeups = 0
+        self.full_rate_chunks = 0
+        # Samples this detector skipped because the ring overwrote them first; the ring's own
+        # dropped_samples belongs to the capture callback, which is the only thread writing it
+        self.skipped_samples = 0
+        self.detect_cpu = 0.0
+        # "adaptive" triggers on SNR against a running noise floor per band, "fixed" on amplitude > THRESHOLD
+        self.trigger = trigger
+        self.noise_floor = NoiseFloor(self.RATE, self.CHUNK_SIZE)
+        self.trigger_count = 0
+        self.messages_sent = 0
+        # Sub-sample onset timing around each trigger (callback capture only), None keeps the raw peak
+        self.onset_timer = OnsetTimer(self.RATE, method=onset_method) if onset_method else None
+        self.last_peak_index = None
+        # Attach an int16 audio snippet of this length to each detection and
+        # derive TDOAs with GCC-PHAT (callback capture only), None sends times only
+        self.onset_method = onset_method
+        self.snippet_seconds = snippet_seconds
+        self.gcc = None
+        if snippet_seconds:
+            self.gcc = GccPhat(self.RATE, int(snippet_seconds * self.RATE))
+        # Label each detection (gunshot, drone, ...) from this much audio after the onset (callback
+        # capture only); it is sent to peers and detections of different types are never fused.
+        # None sends no type
+        self.classify_seconds = classify_seconds
+        self.classifier = EventClassifier(self.RATE, classify_seconds) if classify_seconds else None
+        # Node positions in meters keyed by node id (the IP unless set), None uses the default triangle.
+        # Change them with set_geometry
+        self.mic_positions = None
+        # Learns node positions and clock offsets from the fixes, set by main() with --calibrate
+        self.calibrator = None
+        # RSSI ranges to the peers (ranging.RangingService), set by main() with --ranging-port. Until
+        # calibration converges, and unless a geometry was given, fixes use the positions they imply
+        self.ranging = None
+        self.prior_geometry = None
+        if parent is not None:
+            # A further channel of `parent` (see attach_channels): its detections go to the parent's
+            # association, fixes and metrics, and only the parent handles peer events
+            self.associator, self.node_selector, self.tracker = parent.associator, parent.node_selector, parent.tracker
+            self.fix_lock, self.metrics = parent.fix_lock, parent.metrics
+            self.onset_timer, self.gcc, self.classifier = parent.onset_timer, parent.gcc, parent.classifier
+            self.snippet_seconds = parent.snippet_seconds
+            return
+        # Groups local and peer detections of the same bang and calls handle_fix
+        self.associator = EventAssociator(on_fix=self.handle_fix)
+        # Solves each fix with a bounded, well-conditioned subset of the nodes that heard it
+        self.node_selector = NodeSelector()
+        # Follows moving sources across fixes; each fix is written with the track it updated
+        self.tracker = MultiTargetTracker()
+        self.fix_lock = threading.Lock()
+        # Stage latencies and counters (see metrics.STAGES), the network's when there is one
+        self.metrics = network.metrics if network is not None else Metrics()
+        self.metrics.gauge("capture_overflows", lambda: self.capture_stats()["overflows"])
+        self.metrics.gauge("dropped_samples", lambda: self.capture_stats()["dropped_samples"])
+        self.metrics.gauge("lag_samples", lambda: self.capture_stats()["lag_samples"])
+        self.metrics.gauge("sink_queue_depth", lambda: self.sink.queue.qsize() if self.sink is not None else 0)
+        self.metrics.gauge("sink_dropped", lambda: self.sink.dropped if self.sink is not None else 0)
+        if network is not None:
+            network.event_handler = self.on_peer_event
         
     def initialize_audio(self) -> None:
         """Initialize PyAudio and open microphone stream."""
         try:
-            self.audio = pyaudio.PyAudio()
+            self.audio = open_audio()
+
+            if self.inputs:
+                self.captures = open_inputs(self.audio, self.inputs, self.RATE, self.CHUNK_SIZE, self.RING_SECONDS)
+                channels = [(c.ring, c.stream, channel) for c in self.captures for channel in c.channels]
+                self.ring, self.stream, self.channel = channels[0]
+                self.clock = self.captures[0].clock
+                self.attach_channels(channels[1:])
+                log.info(f"Capturing {len(channels)} channels from {len(self.captures)} devices")
+                return
             
             # Find the first available input device
-            input_device = None
-            for i in range(self.audio.get_device_count()):
-                device_info = self.audio.get_device_info_by_index(i)
-                if int(device_info.get('maxInputChannels', 0)) > 0:
-                    input_device = i
-                    break
+            input_device = first_input_device(self.audio, self.DEVICE_CACHE)
             
             if input_device is None:
                 raise Exception("No input devices found")
+
+            stream_callback = None
+            if self.capture_mode == "callback":
+                self.ring = RingBuffer(self.RING_SECONDS * self.RATE, self.RATE, self.CHANNELS)
+                self.clock = StreamClock(self.RATE)
+                self.read_pos = 0
+                stream_callback = self._audio_callback
                 
             self.stream = self.audio.open(
                 format=self.FORMAT,
@@ -127,16 +224,110 @@ class NoiseDetector:
                 rate=self.RATE,
                 input=True,
                 input_device_index=input_device,
-                frames_per_buffer=self.CHUNK_SIZE
+                frames_per_buffer=self.CHUNK_SIZE,
+                stream_callback=stream_callback
             )
-            print("Microphone initialized successfully!")
-            print("Listening for loud noises... (Press Ctrl+C to exit)")
+            log.info("Microphone initialized successfully!")
+            log.info("Listening for loud noises... (Press Ctrl+C to exit)")
         except Exception as e:
-            print(f"Error initializing audio: {str(e)}")
+            log.error(f"Error initializing audio: {str(e)}")
             raise
 
+    def _audio_callback(self, in_data, frame_count, time_info, status_flags):
+        """PortAudio callback: stamp the block and copy it into the ring buffer."""
+        if status_flags & PA_INPUT_OVERFLOW:
+            self.overflow_count += 1
+        capture_time = self.clock.stamp(time_info, frame_count)
+        self.ring.write(np.frombuffer(in_data, dtype=np.float32), capture_time)
+        return (None, PA_CONTINUE)
+
+    def read_chunk(self) -> Optional[tuple[np.ndarray, int]]:
+        """Next unread chunk from the ring buffer as (samples, first sample index)."""
+        ring = self.ring
+        if not ring.wait_until(self.read_pos + self.CHUNK_SIZE, self.READ_TIMEOUT):
+            return None
+        self._skip_overwritten()
+
+        start = self.read_pos
+        data = ring.read(start, self.CHUNK_SIZE)
+        if data is None:
+            return None
+        self.read_pos = start + self.CHUNK_SIZE
+        return data[:, self.channel], start
+
+    def attach_channels(self, channels) -> None:
+        """Also detect on `channels`, a list of (ring buffer, stream, column), as this node's sensors 1, 2, ...
+
+        Each gets a sibling detector with its own trigger state that shares
+        the network, the association (so its detections are fused here) and
+        the onset, snippet and classification settings.
+        """
+        for ring, stream, column in channels:
+            sibling = NoiseDetector(self.network, capture_mode="callback", onset_method=None,
+                                    low_power=self.low_power, trigger=self.trigger, parent=self)
+            sibling.CPU_WATTS = self.CPU_WATTS
+            sibling.ring, sibling.stream, sibling.channel = ring, stream, column
+            sibling.sensor_index = len(self.siblings) + 1
+            for name, value in self.tunables().items():
+                sibling.set_tunable(name, str(value))
+            self.siblings.append(sibling)
+
+    def channel_detectors(self) -> list:
+        return [self] + self.siblings
+
+    def sensor(self):
+        """Id of the microphone this detector listens to."""
+        return sensor_id(self.network.my_node_id() if self.network else None, self.sensor_index)
+
+    def _skip_overwritten(self) -> None:
+        """Skip whatever was overwritten while detection was lagging."""
+        oldest = self.ring.oldest_pos()
+        if self.read_pos < oldest:
+            self.skipped_samples += oldest - self.read_pos
+            self.read_pos = oldest
+
+    def _scan_block(self) -> bool:
+        """Low-power tier: True if the next block is loud enough for the full-rate path, else skip it."""
+        count = self.LOW_POWER_BLOCK_CHUNKS * self.CHUNK_SIZE
+        if not self.ring.wait_until(self.read_pos + count, self.READ_TIMEOUT):
+            return False
+        self._skip_overwritten()
+        samples = self.ring.read_strided(self.read_pos, count, self.LOW_POWER_STEP)
+        if samples is None:
+            return False
+        peaks = np.abs(samples[:, self.channel]).reshape(self.LOW_POWER_BLOCK_CHUNKS, -1).max(axis=1)
+        if np.max(peaks) > self.trigger_level() * self.WAKE_FRACTION:
+            # The ring still holds the audio before the trigger for onset timing and snippets
+            self.wakeups += 1
+            self.wake_until = self.read_pos + count
+            return True
+        if self.trigger == "adaptive":
+            # Strided peaks read low and woken blocks are loud, so the floors learn from full-rate chunks
+            # of quiet blocks: all of them while warming up, then the last one of each block
+            skip = 0 if not self.noise_floor.ready else count - self.CHUNK_SIZE
+            chunks = self.ring.read(self.read_pos + skip, count - skip)
+            if chunks is not None:
+                for chunk in chunks[:, self.channel].reshape(-1, self.CHUNK_SIZE):
+                    self.noise_floor.update(chunk)
+        self.read_pos += count
+        return False
+
+    def trigger_level(self) -> float:
+        """Peak amplitude that triggers a detection on its own."""
+        if self.trigger == "fixed":
+            return self.THRESHOLD
+        return self.noise_floor.peak_threshold()
+
+    def is_trigger(self, amplitude) -> bool:
+        """Whether the chunk just processed holds an event (cooldown aside)."""
+        if self.trigger == "fixed":
+            return amplitude > self.THRESHOLD
+        return self.noise_floor.triggered(amplitude)
+
     def process_audio(self) -> Optional[tuple[float, float]]:
         """Process audio chunk and return (amplitude, exact_timestamp)."""
+        if self.capture_mode == "callback":
+            return self._process_ring_chunk()
         try:
             # Record the exact time before reading the buffer
             buffer_start = time.time()
@@ -144,6 +335,9 @@ class NoiseDetector:
                 self.stream.read(self.CHUNK_SIZE, exception_on_overflow=False),
                 dtype=np.float32
             )
+            trigger_start = time.perf_counter()
+            if self.trigger == "adaptive":
+                self.noise_floor.update(data)
             
             # Calculate amplitude
             amplitude = np.max(np.abs(data))
@@ -156,80 +350,371 @@ class NoiseDetector:
             seconds_per_sample = 1.0 / self.RATE
             peak_time_offset = peak_sample_index * seconds_per_sample
             exact_timestamp = buffer_start + peak_time_offset
+            self.metrics.since("trigger", trigger_start)
             
             return amplitude, exact_timestamp, buffer_start
             
         except Exception as e:
-            print(f"Error processing audio: {str(e)}")
+            log.error(f"Error processing audio: {str(e)}")
+            return None
+
+    def _process_ring_chunk(self) -> Optional[tuple[float, float]]:
+        """Same as process_audio, but stamped from the sample clock of the ring buffer."""
+        if self.low_power and self.read_pos >= self.wake_until and not self._scan_block():
+            return None
+        chunk = self.read_chunk()
+        if chunk is None:
             return None
+        data, start = chunk
+        trigger_start = time.perf_counter()
+        self.metrics.observe("capture", time.time() - self.ring.time_of(start + self.CHUNK_SIZE))
+        self.full_rate_chunks += 1
+        if self.trigger == "adaptive":
+            self.noise_floor.update(data)
+
+        magnitude = np.abs(data)
+        peak_sample_index = np.argmax(magnitude)
+        amplitude = magnitude[peak_sample_index]
+
+        self.last_peak_index = start + int(peak_sample_index)
+        buffer_start = self.ring.time_of(start)
+        exact_timestamp = np.float64(self.ring.time_of(start + peak_sample_index))
+        self.metrics.since("trigger", trigger_start)
+        return amplitude, exact_timestamp, buffer_start
+
+    def refine_timestamp(self, peak_timestamp):
+        """Replace the peak time of the last chunk with its sub-sample onset time."""
+        if self.onset_timer is None or self.ring is None or self.last_peak_index is None:
+            return peak_timestamp
+        onset_time = self.onset_timer.time_onset(self.ring, self.last_peak_index, self.READ_TIMEOUT, self.channel)
+        if onset_time is None:
+            return peak_timestamp
+        return np.float64(onset_time)
+
+    def extract_snippet(self, onset_time) -> Optional[tuple[float, np.ndarray]]:
+        """Audio around the onset as (time of first sample, samples)."""
+        if self.gcc is None or self.ring is None:
+            return None
+        length = int(self.snippet_seconds * self.RATE)
+        start = self.ring.index_at(onset_time) - int(self.SNIPPET_PRE_SECONDS * self.RATE)
+        if not self.ring.wait_until(start + length, self.READ_TIMEOUT):
+            return None
+        start = max(start, self.ring.oldest_pos())
+        samples = self.ring.read(start, length)
+        if samples is None:
+            return None
+        return self.ring.time_of(start), samples[:, self.channel]
+
+    def classify_event(self, onset_time) -> Optional[str]:
+        """Event type of the local detection at `onset_time`, None when not classifying."""
+        if self.classifier is None or self.ring is None:
+            return None
+        result = self.classifier.classify_ring(self.ring, onset_time, self.READ_TIMEOUT, self.channel)
+        return result[0] if result is not None else "unknown"
+
+    def gcc_event_times(self, association) -> Optional[dict]:
+        """Arrival times of an event at every node from GCC-PHAT on the shared snippets."""
+        if self.gcc is None:
+            return None
+        detections = association.detections
+        if any(d.data is None for d in detections.values()):
+            return None
+        reference = self.network.my_node_id()
+        if reference not in detections:
+            reference = next(iter(detections))
+        self.gcc.clear()
+        for node_id, detection in detections.items():
+            snippet_start, samples = detection.data
+            self.gcc.add(node_id, samples, snippet_start)
+        return self.gcc.aligned_times(reference, detections[reference].time)
+
+    def on_peer_event(self, connection, amplitude, timestamp, snippet, event_type=None, channel=0,
+                      origin=None) -> None:
+        """Called from a connection thread for every detection from a peer, relayed ones under their origin."""
+        start = time.perf_counter()
+        self.associator.add(sensor_id(origin or connection.node_id, channel), timestamp, amplitude, snippet,
+                            event_type)
+        self.metrics.since("association", start)
+
+    def handle_fix(self, association) -> dict:
+        """Localize an associated event, write it out and return it."""
+        with self.fix_lock:
+            start = time.perf_counter()
+            self.apply_range_prior()
+            latest_event_times = self.gcc_event_times(association) or association.event_times()
+            if self.calibrator is not None:
+                latest_event_times = self.calibrate(association.id, latest_event_times)
+            local = association.detections.get(self.network.my_node_id())
+            amplitude = local.amplitude if local is not None else max(
+                d.amplitude for d in association.detections.values())
+            solve_times = latest_event_times
+            if self.mic_positions is not None:
+                amplitudes = {n: d.amplitude for n, d in association.detections.items()}
+                selected = self.node_selector.select(latest_event_times, amplitudes)
+                solve_times = {n: latest_event_times[n] for n in selected}
+            coord_dict = get_sound_position(solve_times, mic_positions=self.mic_positions)
+            latest_event = {
+                "event_id":association.id,
+                "event_times":latest_event_times,
+                "coord_dict":coord_dict,
+                "amplitude":amplitude,
+                "type":association.event_type,
+                "uncertainty":get_fix_uncertainty(solve_times, coord_dict, self.timing_sigma())
+            }
+            latest_event["track"] = self.tracker.update(latest_event)
+            self.metrics.since("solve", start)
+            self.metrics.count("fixes")
+            start = time.perf_counter()
+            if self.sink is not None:
+                self.sink.write(latest_event)
+            if self.event_stream is not None:
+                self.publish_fix(latest_event)
+            self.metrics.since("sink", start)
+
+            log.info(f"EVENT COORD UPDATED    : {latest_event}")
+            return latest_event
+
+    def timing_sigma(self) -> dict:
+        """Arrival time standard deviation per node: onset timing plus the clock sync uncertainty."""
+        sigma = {}
+        for conn in self.network.connections if self.network else []:
+            clock = conn.clock.stats()["uncertainty"] if conn.clock.synced else None
+            sigma[conn.node_id] = float(np.hypot(TIMING_SIGMA, clock or 0.0))
+        return sigma
+
+    def calibrate(self, event_id, event_times: dict) -> dict:
+        """Feed an event to the self-calibration and switch to its geometry once it is good enough."""
+        self.calibrator.add_event(event_id, event_times)
+        if not self.calibrator.calibrated:
+            return event_times
+        geometry = self.calibrator.geometry()
+        if geometry != self.mic_positions:
+            self.set_geometry(geometry)
+        return self.calibrator.correct(event_times)
+
+    def apply_range_prior(self) -> None:
+        """Use the RSSI geometry while nothing better is known, and hand its ranges to the calibration."""
+        if self.ranging is None:
+            return
+        if self.calibrator is not None:
+            self.calibrator.range_prior = self.ranging.current()
+            if self.calibrator.calibrated:
+                return
+        if self.mic_positions is not None and self.mic_positions is not self.prior_geometry:
+            return
+        geometry = self.ranging.geometry()
+        if geometry is not None and geometry != self.prior_geometry:
+            self.prior_geometry = geometry
+            self.set_geometry(geometry)
+
+    def use_calibration(self, calibrator: SelfCalibrator) -> None:
+        """Start from a (possibly loaded) calibration and keep refining it."""
+        self.calibrator = calibrator
+        if calibrator.calibrated:
+            self.set_geometry(calibrator.geometry())
+
+    def set_geometry(self, mic_positions: Optional[dict]) -> None:
+        """Node positions for localization, association windows and node selection."""
+        self.mic_positions = mic_positions
+        self.associator.set_geometry(mic_positions)
+        self.node_selector.index.set_positions(mic_positions)
+
+    def publish_fix(self, latest_event) -> None:
+        """Push a fix, and the node positions when they changed, to stream clients."""
+        coord_dict = latest_event["coord_dict"] or {}
+        nodes = {k: v for k, v in coord_dict.items() if k != 'source'}
+        if self.mic_positions is not None:
+            # Fixes may use only some of the nodes
+            nodes = {k: list(map(float, v)) for k, v in self.mic_positions.items()}
+        if nodes != self.published_nodes:
+            self.published_nodes = nodes
+            self.event_stream.publish("nodes", nodes)
+        self.event_stream.publish("fix", {
+            "event_id": latest_event["event_id"],
+            "time": min(latest_event["event_times"].values()),
+            "source": coord_dict.get('source'),
+            "amplitude": latest_event["amplitude"],
+            "type": latest_event["type"],
+            "uncertainty": latest_event["uncertainty"],
+            "nodes": sorted(latest_event["event_times"]),
+        })
+        track = latest_event.get("track")
+        if track is not None and track["confirmed"]:
+            self.event_stream.publish("track", track)
+
+    def health(self) -> dict:
+        """Per-node health snapshot for stream clients."""
+        peers = {}
+        for conn in self.network.connections if self.network else []:
+            peers[f"{conn.address}:{conn.port}"] = {
+                "clock": conn.clock.stats(),
+                "binary": conn.binary_out,
+            }
+        return {
+            "node": self.network.my_node_id() if self.network else None,
+            "capture": self.capture_stats(),
+            "power": self.power_stats(),
+            "trigger": self.trigger_stats(),
+            "metrics": self.metrics.snapshot(),
+            "gossip": self.network.gossip_stats() if self.network else None,
+            "peers": peers,
+            "sink_dropped": self.sink.dropped if self.sink is not None else 0,
+        }
+
+    def publish_health(self, interval: float = 2.0) -> None:
+        """Publish health() to stream clients every `interval` seconds, forever."""
+        while self.event_stream is not None:
+            try:
+                self.event_stream.publish("health", self.health())
+            except Exception as e:
+                log.error(f"Error publishing health: {e}")
+            time.sleep(interval)
+
+    def capture_stats(self) -> dict:
+        """Overflow and drop counters for the callback capture."""
+        overflows = self.overflow_count + sum(c.overflow_count for c in self.captures)
+        if self.ring is None:
+            return {"overflows": overflows, "dropped_samples": 0, "lag_samples": 0}
+        rings = {id(d.ring): d.ring for d in self.channel_detectors()}
+        # Channels of one ring move together and skip the same frames, so count them once per ring
+        skipped = {}
+        for d in self.channel_detectors():
+            skipped[id(d.ring)] = max(skipped.get(id(d.ring), 0), d.skipped_samples)
+        return {
+            "overflows": overflows,
+            "dropped_samples": sum(ring.dropped_samples for ring in rings.values()) + sum(skipped.values()),
+            "lag_samples": max(d.ring.write_pos - d.read_pos for d in self.channel_detectors()),
+        }
+
+    def trigger_stats(self) -> dict:
+        """Noise floor, tunables and how often this node triggers and broadcasts."""
+        audio_minutes = self.read_pos / self.RATE / 60
+        triggers = sum(d.trigger_count for d in self.channel_detectors())
+        return {
+            "mode": self.trigger,
+            "triggers": triggers,
+            "triggers_per_minute": triggers / audio_minutes if audio_minutes > 0 else None,
+            "messages_sent": sum(d.messages_sent for d in self.channel_detectors()),
+            **self.tunables(),
+            "noise_floor": self.noise_floor.stats(),
+        }
+
+    def tunables(self) -> dict:
+        return {"trigger": self.trigger, "threshold": self.THRESHOLD, "cooldown": self.COOLDOWN,
+                **{name: getattr(self.noise_floor, name) for name in NoiseFloor.TUNABLES}}
+
+    def set_tunable(self, name: str, value: str) -> None:
+        """Change a detection parameter while running, on every channel; raises KeyError or ValueError for bad input."""
+        for sibling in self.siblings:
+            sibling.set_tunable(name, value)
+        if name == "trigger":
+            if value not in ("adaptive", "fixed"):
+                raise ValueError(value)
+            self.trigger = value
+        elif name == "threshold":
+            self.THRESHOLD = float(value)
+        elif name == "cooldown":
+            self.COOLDOWN = float(value)
+        else:
+            self.noise_floor.set(name, value)
+
+    def power_stats(self) -> dict:
+        """Detector CPU time and the energy it costs per hour of audio, for sizing batteries."""
+        audio_hours = self.read_pos / self.RATE / 3600
+        cpu = sum(d.detect_cpu for d in self.channel_detectors())
+        cpu_per_hour = cpu / audio_hours if audio_hours > 0 else 0.0
+        return {
+            "mode": "low_power" if self.low_power else "full_rate",
+            "channels": len(self.channel_detectors()),
+            "cpu_seconds": cpu,
+            "audio_seconds": self.read_pos / self.RATE,
+            "cpu_seconds_per_hour": cpu_per_hour,
+            "energy_wh_per_hour": cpu_per_hour * self.CPU_WATTS / 3600,
+            "full_rate_fraction": self.full_rate_chunks * self.CHUNK_SIZE / max(self.read_pos, 1),
+            "wakeups": sum(d.wakeups for d in self.channel_detectors()),
+        }
 
     def detect_noise(self) -> None:
         """Main detection loop."""
+        if self.siblings:
+            # One step per channel and chunk, spread over a worker pool
+            run_channel_pool(self.channel_detectors(), self.workers)
+            return
         while True:
             try:
-                result = self.process_audio()
-                
-                if result is None:
-                    continue
+                if not self.detect_step():
+                    break
+            except KeyboardInterrupt:
+                log.info("Stopping noise detection...")
+                break
+
+    def detect_step(self) -> bool:
+        """Process one chunk and report it if it triggers; False once detection has to stop."""
+        cpu_start = time.thread_time()
+        try:
+            result = self.process_audio()
+            
+            if result is None:
+                if self.capture_mode == "callback" and not self.stream.is_active():
+                    log.info("Audio stream stopped")
+                    return False
+                return True
+            
+            amplitude, exact_timestamp, buffer_start = result
+            
+            # Check if the chunk triggers and cooldown period has passed
+            if (self.is_trigger(amplitude) and
+                exact_timestamp - self.last_detection > self.COOLDOWN):
+                self.last_detection = exact_timestamp
+                self.trigger_count += 1
+                self.metrics.count("detections")
+                start = time.perf_counter()
+                exact_timestamp = self.refine_timestamp(exact_timestamp)
                 
-                amplitude, exact_timestamp, buffer_start = result
+                my_ip = self.sensor()
+                snippet = self.extract_snippet(exact_timestamp)
+                event_type = self.classify_event(exact_timestamp)
+                self.metrics.since("timing", start)
+
+                log.info(f"Locally detected noise. Sensor={my_ip} Amplitude={amplitude:.2f} Time={exact_timestamp:.6f} Type={event_type} BufferStartTime={buffer_start} Now={time.time()}")
                 
-                # Check if amplitude exceeds threshold and cooldown period has passed
-                if (amplitude > self.THRESHOLD and 
-                    exact_timestamp - self.last_detection > self.COOLDOWN):
-                    self.last_detection = exact_timestamp
-                    
-                    latest_event_times = {
-                        self.network.get_my_ip():exact_timestamp.item(),
-                        }
-
-                    print(f"Locally detected noise. Amplitude={amplitude:.2f} Time={exact_timestamp:.6f} BufferStartTime={buffer_start} Now={time.time()}")
-                    
-                    # Send noise detection to all connected peers with precise timing
-                    if self.network:
-                        message = f"NOISE_DETECTED amplitude={amplitude:.2f} time={exact_timestamp:.6f}"
-                        for conn in self.network.connections:
-                            self.network.send(conn.id, message)                     
-
-                        time.sleep(self.COOLDOWN/4)
-                        for conn in self.network.connections:
-                            latest_event_times[conn.address]=conn.latest_event_time
-
-                        # Validate event_dict 
-                        timestamps = latest_event_times.values()
-                        if None not in timestamps:
-                            latest_event = {
-                                "event_times":latest_event_times,
-                                "coord_dict":get_sound_position(latest_event_times),
-                                "amplitude":amplitude.item()
-                            }
-                            # if (max(timestamps) - min(timestamps)<self.WINDOW_SIZE_SECS) and len(timestamps)==3:
-                            if len(timestamps)==3:
-                                if self.output_file is not None:
-                                    with open(self.output_file, 'a') as f:
-                                        json_line = json.dumps(latest_event)
-                                        f.write(json_line + '\n')
-
-                                print(f"EVENT COORD UPDATED    : {latest_event}")
-                            else:
-                                print(f"EVENT NOT COORD UPDATED: {latest_event}")
-
-                            
+                # Send noise detection to all connected peers with precise timing
+                if self.network:
+                    start = time.perf_counter()
+                    self.messages_sent += len(self.network.connections)
+                    self.network.broadcast_event(float(amplitude), float(exact_timestamp), snippet, self.RATE,
+                                                 event_type=event_type, channel=self.sensor_index)
+                    self.metrics.since("send", start)
 
-            except KeyboardInterrupt:
-                print("\nStopping noise detection...")
-                break
-            except Exception as e:
-                print(f"Unexpected error: {str(e)}")
-                break
+                # Peer detections arrive through on_peer_event; a fix is emitted
+                # by handle_fix as soon as enough of them line up with this one
+                start = time.perf_counter()
+                self.associator.add(my_ip, exact_timestamp.item(), amplitude.item(), snippet, event_type)
+                self.metrics.since("association", start)
+            return True
+
+        except Exception as e:
+            log.error(f"Unexpected error: {str(e)}")
+            return False
+        finally:
+            self.detect_cpu += time.thread_time() - cpu_start
 
     def cleanup(self) -> None:
         """Clean up audio resources."""
-        if self.stream is not None:
-            self.stream.stop_stream()
-            self.stream.close()
+        streams = [c.stream for c in self.captures] if self.captures else [self.stream]
+        for stream in streams:
+            if stream is not None:
+                stream.stop_stream()
+                stream.close()
         if self.audio is not None:
             self.audio.terminate()
+        if self.sink is not None:
+            self.sink.close()
+            self.sink = None
+        if self.calibrator is not None:
+            self.calibrator.stop()
+            if self.calibrator.path is not None:
+                self.calibrator.save(self.calibrator.path)
 
     def run(self) -> None:
         """Run the noise detector."""
@@ -238,29 +723,145 @@ class NoiseDetector:
         self.cleanup()
 
 
+def parse_args():
+    parser = argparse.ArgumentParser(usage="python main.py 4091 ./out.jsonl")
+    parser.add_argument("port", type=int, nargs="?")
+    parser.add_argument("output_file", nargs="?", default=None)
+    parser.add_argument("--input", action="append", default=None, metavar="DEVICE[:CH,CH,...]",
+                        help="Capture these channels of this input device, repeat for more devices; every channel "
+                             "is detected on its own and adds a microphone to the fix (see --list-devices)")
+    parser.add_argument("--workers", type=int, default=None,
+                        help="Threads that detect on the channels with --input (default: one per channel)")
+    parser.add_argument("--list-devices", action="store_true", help="Print the input devices and exit")
+    parser.add_argument("--snippet-ms", type=float, default=None,
+                        help="Share audio snippets of this length with peers and use GCC-PHAT TDOAs")
+    parser.add_argument("--classify-ms", type=float, default=None,
+                        help="Label detections (gunshot, artillery, explosion, drone) from this much audio and "
+                             "never fuse detections of different types; delays each detection by as much")
+    parser.add_argument("--stream-port", type=int, default=None,
+                        help="Serve fixes, node positions and health as Server-Sent Events on this port")
+    parser.add_argument("--cooldown", type=float, default=NoiseDetector.COOLDOWN,
+                        help="Seconds between local detections; lower it to follow moving or repeating sources")
+    parser.add_argument("--trigger", choices=["adaptive", "fixed"], default="adaptive",
+                        help="Trigger on SNR against a running noise floor, or on a fixed amplitude threshold")
+    parser.add_argument("--snr-db", type=float, default=10.0,
+                        help="SNR above the noise floor that triggers a detection with --trigger adaptive")
+    parser.add_argument("--min-amplitude", type=float, default=0.01,
+                        help="Never trigger below this peak amplitude with --trigger adaptive")
+    parser.add_argument("--threshold", type=float, default=NoiseDetector.THRESHOLD,
+                        help="Peak amplitude that triggers a detection with --trigger fixed")
+    parser.add_argument("--low-power", action="store_true",
+                        help="Scan the audio at a low rate and only run full-rate detection around loud blocks")
+    parser.add_argument("--cpu-watts", type=float, default=NoiseDetector.CPU_WATTS,
+                        help="Extra power draw while detecting, for the energy per hour estimate")
+    parser.add_argument("--calibrate", metavar="PATH", default=None,
+                        help="Learn node positions and clock offsets from detected events, saved to and loaded from PATH")
+    parser.add_argument("--protocol", choices=["binary", "text"], default="binary",
+                        help="Offer the binary wire protocol to peers (text peers still interoperate)")
+    parser.add_argument("--transport", choices=["thread", "asyncio"], default="thread",
+                        help="Thread per peer, or one asyncio loop with a bounded send queue per peer")
+    parser.add_argument("--queue-size", type=int, default=256,
+                        help="Outgoing messages queued per peer with --transport asyncio")
+    parser.add_argument("--queue-policy", choices=AsyncConnection.POLICIES, default="drop_oldest",
+                        help="What to drop when a peer's queue is full")
+    parser.add_argument("--discover", action="store_true",
+                        help="Find peers by UDP broadcast beacons and keep --degree connections to them")
+    parser.add_argument("--discovery-port", type=int, default=47999, help="UDP port of the discovery beacons")
+    parser.add_argument("--discovery-address", default="255.255.255.255",
+                        help="Broadcast or multicast address the beacons are sent to")
+    parser.add_argument("--degree", type=int, default=4, help="Connections to keep open with --discover")
+    parser.add_argument("--gossip-ttl", type=int, default=None,
+                        help="Relay detections to peers of peers for this many hops (default 6 with --discover, "
+                             "else 0)")
+    parser.add_argument("--ranging-port", type=int, default=None,
+                        help="Exchange Wi-Fi signal levels with peers on this UDP port and use the RSSI ranges as "
+                             "node positions until --calibrate converges")
+    parser.add_argument("--wifi-interface", default=None,
+                        help="Interface to read the signal level of with --ranging-port (default: the first)")
+    parser.add_argument("--metrics-interval", type=float, default=None,
+                        help="Write a JSON snapshot of the stage latencies and counters every this many seconds")
+    parser.add_argument("--metrics-file", default=None,
+                        help="Append the --metrics-interval snapshots to this file instead of the log")
+    args = parser.parse_args()
+    if args.port is None and not args.list_devices:
+        parser.error("the port is required")
+    return args
+
+def print_help():
+    print("Available commands:")
+    print("  help                           - Display this help message")
+    print("  connect <destination> <port>   - Establish a new connection")
+    print("  set [<name> <value>]           - Change a detection setting, or list them")
+    print("  tunables                       - List the detection settings")
+    print("  trigger                        - Trigger counts and noise floor")
+    print("  power                          - Detector CPU time and energy estimate")
+    print("  clocks                         - Clock offset of every peer")
+    print("  gossip                         - Gossip relaying and discovery counters")
+    print("  stats                          - Stage latencies, counters, queue depths and drops")
+    print("  ranges                         - RSSI ranges to peers (with --ranging-port)")
+
 def main():
-    if len(sys.argv) < 2:
-        print("Usage: python main.py 4091 ./out.jsonl")
-        sys.exit(1)
-
-    port = int(sys.argv[1])
-    if len(sys.argv)==3:
-        output_file = sys.argv[2]
-        with open(output_file, 'w') as f:
-            f.write('')
-    else:
-        output_file=None
+    args = parse_args()
+    log_listener = start_logging()
+
+    if args.list_devices:
+        audio = open_audio()
+        for index, name, channels in input_devices(audio):
+            print(f"{index}: {name} ({channels} channels)")
+        audio.terminate()
+        return
+
+    port = args.port
+    # Appended to across restarts, EventSink rotates it
+    output_file = args.output_file
 
-    network = P2PNetwork(port)
+    gossip_ttl = args.gossip_ttl if args.gossip_ttl is not None else (6 if args.discover else 0)
+    if args.transport == "asyncio":
+        network = AsyncP2PNetwork(port, queue_size=args.queue_size, policy=args.queue_policy,
+                                  protocol=args.protocol, gossip_ttl=gossip_ttl)
+    else:
+        network = P2PNetwork(port, protocol=args.protocol, gossip_ttl=gossip_ttl)
     
     # Start network server in a separate thread
     server_thread = threading.Thread(target=network.start_server)
     server_thread.daemon = True
     server_thread.start()
+    network.start_clock_sync()
+    discovery = None
+    if args.discover:
+        discovery = Discovery(network, args.discovery_port, args.discovery_address, degree=args.degree)
+        discovery.start()
 
     # Create and run noise detector with network reference
-    detector = NoiseDetector(network=network,output_file=output_file)
+    snippet_seconds = args.snippet_ms / 1000 if args.snippet_ms else None
+    detector = NoiseDetector(network=network,output_file=output_file,snippet_seconds=snippet_seconds,
+                             low_power=args.low_power, trigger=args.trigger,
+                             classify_seconds=args.classify_ms / 1000 if args.classify_ms else None,
+                             inputs=[parse_input(spec) for spec in args.input] if args.input else None,
+                             workers=args.workers)
+    detector.COOLDOWN = args.cooldown
+    detector.THRESHOLD = args.threshold
+    detector.noise_floor.snr_db = args.snr_db
+    detector.noise_floor.min_amplitude = args.min_amplitude
+    detector.CPU_WATTS = args.cpu_watts
     
+    if args.calibrate:
+        detector.use_calibration(SelfCalibrator.load(args.calibrate).start())
+
+    if args.ranging_port:
+        detector.ranging = RangingService(network, args.ranging_port, interface=args.wifi_interface).start()
+
+    if args.stream_port:
+        # http.server is only worth importing when streaming
+        from streamserver import EventStream, start_stream_server
+        detector.event_stream = EventStream()
+        start_stream_server(detector.event_stream, args.stream_port)
+        threading.Thread(target=detector.publish_health, daemon=True).start()
+
+    detector.metrics.gauge("log_dropped", lambda: log_listener.producer.dropped)
+    if args.metrics_interval:
+        MetricsDumper(detector.metrics, args.metrics_interval, args.metrics_file, log).start()
+
     # Start noise detection in a separate thread
     detector_thread = threading.Thread(target=detector.run)
     detector_thread.daemon = True
@@ -285,11 +886,40 @@ def main():
             elif cmd == "connect" and len(parts) == 3:
                 print("CONNECTING")
                 network.connect(parts[1], int(parts[2]))
+            elif cmd == "set" and len(parts) == 3:
+                try:
+                    detector.set_tunable(parts[1], parts[2])
+                except (KeyError, ValueError):
+                    print(f"Unknown setting or bad value: {parts[1]} {parts[2]}")
+            elif cmd in ("set", "tunables"):
+                for key, value in detector.tunables().items():
+                    print(f"{key}: {value}")
+            elif cmd == "trigger":
+                for key, value in detector.trigger_stats().items():
+                    print(f"{key}: {value}")
+            elif cmd == "power":
+                for key, value in detector.power_stats().items():
+                    print(f"{key}: {value}")
+            elif cmd == "clocks":
+                for peer, stats in network.clock_stats().items():
+                    print(f"{peer}: {stats}")
+            elif cmd == "gossip":
+                stats = network.gossip_stats()
+                if discovery is not None:
+                    stats.update(discovery.stats())
+                for key, value in stats.items():
+                    print(f"{key}: {value}")
+            elif cmd == "ranges" and detector.ranging is not None:
+                for (a, b), meters in detector.ranging.current().items():
+                    print(f"{a} - {b}: {meters:.1f} m")
+            elif cmd == "stats":
+                print(detector.metrics.report())
             
         except KeyboardInterrupt:
             print("\nShutting down...")
             network.terminate_all_connections()
             detector.cleanup()
+            log_listener.stop()
             break
 
 if __name__ == "__main__":
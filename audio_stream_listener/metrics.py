@@ -0,0 +1,153 @@
+import bisect
+import json
+import threading
+import time
+from typing import Callable, Dict, Optional
+
+import numpy as np
+
+# Stages between a bang and a written fix. capture and receive are ages (how
+# old a chunk is when the detector reads it, how old a peer's detection is
+# when it arrives, both on the wall clock); the others are time spent in the
+# stage. association includes the solve and sink of a fix it completes.
+STAGES = ("capture", "trigger", "timing", "send", "receive", "association", "solve", "sink")
+
+
+class LatencyHistogram:
+    """Latencies in fixed log-spaced buckets, 1 us to 100 s at 8 buckets per decade.
+
+    observe() is a bisect and an increment under an uncontended lock, so it
+    can sit on the hot path; percentiles are the upper edge of the bucket
+    they fall in (at most a third too high).
+    """
+
+    BOUNDS = tuple(float(b) for b in np.logspace(-6, 2, 8 * 8 + 1))
+
+    def __init__(self):
+        self.counts = [0] * (len(self.BOUNDS) + 1)
+        self.total = 0.0
+        self.max = 0.0
+        self.lock = threading.Lock()
+
+    def observe(self, seconds: float) -> None:
+        i = bisect.bisect_left(self.BOUNDS, seconds)
+        with self.lock:
+            self.counts[i] += 1
+            self.total += seconds
+            if seconds > self.max:
+                self.max = seconds
+
+    @property
+    def count(self) -> int:
+        return sum(self.counts)
+
+    def percentile(self, q: float) -> Optional[float]:
+        n = self.count
+        if n == 0:
+            return None
+        i = int(np.searchsorted(np.cumsum(self.counts), q / 100 * n))
+        return min(self.BOUNDS[i] if i < len(self.BOUNDS) else np.inf, self.max)
+
+    def merge(self, other: "LatencyHistogram") -> None:
+        """Add the observations of `other`, e.g. to summarize several nodes."""
+        with self.lock:
+            self.counts = [a + b for a, b in zip(self.counts, other.counts)]
+            self.total += other.total
+            self.max = max(self.max, other.max)
+
+    def stats(self) -> dict:
+        n = self.count
+        if n == 0:
+            return {"count": 0}
+        return {"count": n, "mean_ms": 1000 * self.total / n,
+                **{f"p{q}_ms": 1000 * self.percentile(q) for q in (50, 90, 99)},
+                "max_ms": 1000 * self.max}
+
+
+class Metrics:
+    """Per-stage latency histograms, counters and gauges of one node.
+
+    Time a stage with `start = time.perf_counter()` and `since(stage, start)`.
+    Gauges (queue depths, drop counters kept elsewhere) are callables read
+    only when a snapshot is taken, so they cost nothing on the hot path.
+    """
+
+    def __init__(self):
+        self.histograms: Dict[str, LatencyHistogram] = {stage: LatencyHistogram() for stage in STAGES}
+        self.counters: Dict[str, int] = {}
+        self.gauges: Dict[str, Callable[[], float]] = {}
+        self.lock = threading.Lock()
+        self.started = time.time()
+
+    def observe(self, stage: str, seconds: float) -> None:
+        self.histograms[stage].observe(seconds)
+
+    def since(self, stage: str, start: float) -> None:
+        """Record the perf_counter time elapsed since `start` for `stage`."""
+        self.histograms[stage].observe(time.perf_counter() - start)
+
+    def count(self, name: str, n: int = 1) -> None:
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + n
+
+    def gauge(self, name: str, read: Callable[[], float]) -> None:
+        self.gauges[name] = read
+
+    def snapshot(self) -> dict:
+        gauges = {}
+        for name, read in self.gauges.items():
+            try:
+                gauges[name] = read()
+            except Exception:
+                gauges[name] = None
+        return {
+            "time": time.time(),
+            "uptime": time.time() - self.started,
+            "latency": {stage: h.stats() for stage, h in self.histograms.items()},
+            "counters": dict(self.counters),
+            "gauges": gauges,
+        }
+
+    def report(self) -> str:
+        """snapshot() as text for the console."""
+        snapshot = self.snapshot()
+        lines = []
+        for stage, stats in snapshot["latency"].items():
+            if stats["count"]:
+                lines.append(f"{stage:<12} n={stats['count']} mean={stats['mean_ms']:.3f}ms "
+                             f"p50={stats['p50_ms']:.3f}ms p90={stats['p90_ms']:.3f}ms "
+                             f"p99={stats['p99_ms']:.3f}ms max={stats['max_ms']:.3f}ms")
+            else:
+                lines.append(f"{stage:<12} n=0")
+        for name, value in {**snapshot["counters"], **snapshot["gauges"]}.items():
+            lines.append(f"{name}: {value}")
+        return "\n".join(lines)
+
+
+class MetricsDumper:
+    """Background thread that appends a JSON snapshot of `metrics` to `path` (or logs it) every `interval` seconds."""
+
+    def __init__(self, metrics: Metrics, interval: float = 60.0, path: Optional[str] = None, log=None):
+        self.metrics = metrics
+        self.interval = interval
+        self.path = path
+        self.log = log
+        self.running = False
+
+    def start(self) -> "MetricsDumper":
+        self.running = True
+        threading.Thread(target=self.run, daemon=True).start()
+        return self
+
+    def stop(self) -> None:
+        self.running = False
+
+    def run(self) -> None:
+        while self.running:
+            time.sleep(self.interval)
+            line = json.dumps(self.metrics.snapshot(), default=float)
+            if self.path is not None:
+                with open(self.path, "a") as f:
+                    f.write(line + "\n")
+            elif self.log is not None:
+                self.log.info(line)
@@ -0,0 +1,137 @@
+import json
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from capture import RingBuffer, StreamClock
+
+# PortAudio's values, so that pyaudio (and libportaudio with its device scan) only
+# loads once audio is actually opened
+PA_FLOAT32 = 1  # pyaudio.paFloat32
+PA_INPUT_OVERFLOW = 2  # pyaudio.paInputOverflow
+PA_CONTINUE = 0  # pyaudio.paContinue
+
+
+def open_audio():
+    """A pyaudio.PyAudio(), importing pyaudio on first use."""
+    import pyaudio
+    return pyaudio.PyAudio()
+
+
+def parse_input(spec: str) -> Tuple[int, List[int]]:
+    """'DEVICE' or 'DEVICE:CH,CH,...' (PortAudio device index, 0-based channels) as (device, channels)."""
+    device, _, channels = spec.partition(':')
+    return int(device), [int(c) for c in channels.split(',')] if channels else [0]
+
+
+def input_devices(audio) -> List[Tuple[int, str, int]]:
+    """(index, name, input channels) of every PortAudio input device."""
+    devices = []
+    for i in range(audio.get_device_count()):
+        info = audio.get_device_info_by_index(i)
+        if info.get('maxInputChannels', 0) > 0:
+            devices.append((i, info.get('name'), int(info['maxInputChannels'])))
+    return devices
+
+
+def first_input_device(audio, cache_path: Optional[str] = None) -> Optional[int]:
+    """Index of the first input device; with `cache_path`, the last pick is checked first so restarts skip the scan."""
+    if cache_path is not None:
+        try:
+            with open(cache_path) as f:
+                cached = json.load(f)
+            info = audio.get_device_info_by_index(cached["index"])
+            if info.get('name') == cached["name"] and int(info.get('maxInputChannels', 0)) > 0:
+                return cached["index"]
+        except (OSError, ValueError, KeyError, TypeError):
+            pass
+    for i in range(audio.get_device_count()):
+        info = audio.get_device_info_by_index(i)
+        if int(info.get('maxInputChannels', 0)) > 0:
+            if cache_path is not None:
+                try:
+                    os.makedirs(os.path.dirname(cache_path) or ".", exist_ok=True)
+                    with open(cache_path, "w") as f:
+                        json.dump({"index": i, "name": info.get('name')}, f)
+                except OSError:
+                    pass
+            return i
+    return None
+
+
+class DeviceCapture:
+    """One input device, opened with as many channels as needed, filling its own ring buffer.
+
+    Channels of one device share its sample clock. Every device after the
+    first stamps with the stream-to-wall-clock offset of the first
+    (`reference`), so the devices of a host share one time base too.
+    """
+
+    def __init__(self, device: int, channels: Sequence[int], rate: int, chunk_size: int,
+                 ring_seconds: float, reference: Optional[StreamClock] = None):
+        self.device = device
+        self.channels = list(channels)
+        self.n_channels = max(self.channels) + 1
+        self.rate = rate
+        self.chunk_size = chunk_size
+        self.ring = RingBuffer(int(ring_seconds * rate), rate, self.n_channels)
+        self.clock = StreamClock(rate, reference)
+        self.stream = None
+        self.overflow_count = 0
+
+    def open(self, audio, sample_format=PA_FLOAT32) -> None:
+        self.stream = audio.open(
+            format=sample_format,
+            channels=self.n_channels,
+            rate=self.rate,
+            input=True,
+            input_device_index=self.device,
+            frames_per_buffer=self.chunk_size,
+            stream_callback=self._callback
+        )
+
+    def _callback(self, in_data, frame_count, time_info, status_flags):
+        if status_flags & PA_INPUT_OVERFLOW:
+            self.overflow_count += 1
+        capture_time = self.clock.stamp(time_info, frame_count)
+        self.ring.write(np.frombuffer(in_data, dtype=np.float32), capture_time)
+        return (None, PA_CONTINUE)
+
+
+def open_inputs(audio, inputs: Sequence[Tuple[int, Sequence[int]]], rate: int, chunk_size: int,
+                ring_seconds: float) -> List[DeviceCapture]:
+    """Open every (device, channels) of `inputs` on one time base."""
+    captures = []
+    for device, channels in inputs:
+        capture = DeviceCapture(device, channels, rate, chunk_size, ring_seconds,
+                                reference=captures[0].clock if captures else None)
+        capture.open(audio)
+        captures.append(capture)
+    return captures
+
+
+def run_channel_pool(detectors: Sequence, workers: Optional[int] = None) -> None:
+    """Run the detect_step of every channel detector on a shared pool of `workers` threads.
+
+    One dispatcher per ring buffer hands out a step per channel and waits
+    for all of them, so the channels of a device move through the audio
+    together. A detector drops out once its step returns False.
+    """
+    groups = {}
+    for detector in detectors:
+        groups.setdefault(id(detector.ring), []).append(detector)
+
+    with ThreadPoolExecutor(max_workers=workers or len(detectors)) as pool:
+        def dispatch(group):
+            while group:
+                steps = [pool.submit(d.detect_step) for d in group]
+                group = [d for d, step in zip(group, steps) if step.result()]
+
+        threads = [threading.Thread(target=dispatch, args=(group,), daemon=True) for group in groups.values()]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
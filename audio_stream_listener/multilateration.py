@@ -0,0 +1,241 @@
+from typing import Optional, Tuple
+
+import numpy as np
+
+SPEED_OF_SOUND = 343.0  # meters/second
+TIMING_SIGMA = 1 / 44100  # Default per-node arrival time standard deviation (one sample), seconds
+ELLIPSE_95 = 2.4477  # Scales 1-sigma ellipse axes to 95% confidence in 2D (sqrt of chi2(2) at 0.95)
+
+
+def _prepare(positions: np.ndarray, times: np.ndarray) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """Broadcast inputs to (B, N, D) positions, (B, N) times and a (B, N) validity mask."""
+    times = np.atleast_2d(np.asarray(times, dtype=np.float64))
+    positions = np.asarray(positions, dtype=np.float64)
+    if positions.ndim == 2:
+        positions = np.broadcast_to(positions, (times.shape[0],) + positions.shape)
+    valid = np.isfinite(times) & np.all(np.isfinite(positions), axis=-1)
+    return positions, times, valid
+
+
+def initial_guess(positions: np.ndarray, times: np.ndarray, valid: np.ndarray,
+                  speed_of_sound: float = SPEED_OF_SOUND) -> np.ndarray:
+    """Closed-form starting point for every event in the batch.
+
+    Writing |x - p_i| = c (t_i - t_e) with unknown emission time t_e and
+    squaring gives an equation linear in (x, c t_e, |x|^2 - (c t_e)^2). It
+    needs D + 2 nodes; events with fewer start from the centroid of the
+    nodes that heard them.
+    """
+    n_events, n_nodes, dims = positions.shape
+    weights = valid.astype(np.float64)
+    count = weights.sum(axis=1)
+    centroid = np.einsum('bn,bnd->bd', weights, positions) / np.maximum(count, 1)[:, None]
+
+    ranges = speed_of_sound * np.where(valid, times, 0.0)
+    A = np.concatenate((-2 * positions, 2 * ranges[..., None], np.ones((n_events, n_nodes, 1))), axis=2)
+    b = ranges ** 2 - np.sum(positions ** 2, axis=2)
+    A *= weights[..., None]
+    b *= weights
+    solution = np.einsum('bij,bj->bi', np.linalg.pinv(A), b)
+    guess = solution[:, :dims]
+
+    usable = (count >= dims + 2) & np.all(np.isfinite(guess), axis=1)
+    return np.where(usable[:, None], guess, centroid)
+
+
+def _residuals(x, bias, positions, ranges, valid):
+    """Range residuals |x - p_i| + bias - c t_i and the distances they used."""
+    dist = np.linalg.norm(x[:, None, :] - positions, axis=2)
+    res = np.where(valid, dist + bias[:, None] - ranges, 0.0)
+    return res, dist
+
+
+def solve_batch(positions: np.ndarray, times: np.ndarray,
+                speed_of_sound: float = SPEED_OF_SOUND,
+                iterations: int = 30, tolerance: float = 1e-9) -> Tuple[np.ndarray, np.ndarray]:
+    """Locate many events at once from arrival times.
+
+    positions: (N, D) node positions shared by all events, or (B, N, D).
+    times:     (B, N) arrival times, NaN where a node did not hear the event.
+    D may be 2 or 3. Returns the (B, D) source positions and the (B,) RMS
+    range residual in meters; events heard by fewer than D + 1 nodes are NaN.
+
+    A closed-form guess is refined with Levenberg-Marquardt on the hyperbolic
+    TDOA model, with the emission time as an extra unknown so no reference
+    node has to be chosen. Every step is a batched (D+1)x(D+1) solve.
+    """
+    positions, times, valid = _prepare(positions, times)
+    n_events, n_nodes, dims = positions.shape
+
+    # Relative times and centered coordinates keep the normal equations well scaled
+    t_ref = np.nanmin(np.where(valid, times, np.nan), axis=1, initial=np.inf)
+    t_ref = np.where(np.isfinite(t_ref), t_ref, 0.0)
+    rel_times = np.where(valid, times - t_ref[:, None], np.nan)
+    weights = valid.astype(np.float64)
+    center = np.einsum('bn,bnd->bd', weights, np.where(valid[..., None], positions, 0.0))
+    center /= np.maximum(weights.sum(axis=1), 1)[:, None]
+    local = np.where(valid[..., None], positions - center[:, None, :], 0.0)
+    ranges = speed_of_sound * np.where(valid, rel_times, 0.0)
+
+    x = initial_guess(local, rel_times, valid, speed_of_sound)
+    bias = np.einsum('bn,bn->b', weights,
+                     ranges - np.linalg.norm(x[:, None, :] - local, axis=2)) / np.maximum(weights.sum(axis=1), 1)
+    res, dist = _residuals(x, bias, local, ranges, valid)
+    cost = np.sum(res ** 2, axis=1)
+    damping = np.full(n_events, 1e-3)
+    eye = np.eye(dims + 1)
+
+    for _ in range(iterations):
+        unit = (x[:, None, :] - local) / np.maximum(dist, 1e-12)[..., None]
+        J = np.concatenate((unit, np.ones((n_events, n_nodes, 1))), axis=2) * weights[..., None]
+        JtJ = np.einsum('bni,bnj->bij', J, J)
+        Jtr = np.einsum('bni,bn->bi', J, res)
+        diag = np.einsum('bii->bi', JtJ)
+        lhs = JtJ + damping[:, None, None] * (eye * np.maximum(diag, 1e-9)[:, None, :])
+        step = np.linalg.solve(lhs + 1e-12 * eye, -Jtr[..., None])[..., 0]
+
+        x_new = x + step[:, :dims]
+        bias_new = bias + step[:, dims]
+        res_new, dist_new = _residuals(x_new, bias_new, local, ranges, valid)
+        cost_new = np.sum(res_new ** 2, axis=1)
+
+        accept = cost_new < cost
+        x = np.where(accept[:, None], x_new, x)
+        bias = np.where(accept, bias_new, bias)
+        res = np.where(accept[:, None], res_new, res)
+        dist = np.where(accept[:, None], dist_new, dist)
+        improvement = np.where(accept, cost - cost_new, 0.0)
+        cost = np.where(accept, cost_new, cost)
+        damping = np.where(accept, damping / 3, damping * 3)
+        if np.all(improvement <= tolerance * np.maximum(cost, 1e-12)):
+            break
+
+    source = x + center
+    rms = np.sqrt(cost / np.maximum(weights.sum(axis=1), 1))
+    solvable = weights.sum(axis=1) >= dims + 1
+    source[~solvable] = np.nan
+    rms[~solvable] = np.nan
+    return source, rms
+
+
+def locate(positions: np.ndarray, times: np.ndarray,
+           speed_of_sound: float = SPEED_OF_SOUND) -> Tuple[np.ndarray, float]:
+    """Single-event wrapper around solve_batch: (N, D) positions, (N,) times."""
+    source, rms = solve_batch(positions, np.asarray(times, dtype=np.float64)[None, :], speed_of_sound)
+    return source[0], float(rms[0])
+
+
+def covariance_batch(positions: np.ndarray, times: np.ndarray, sources: np.ndarray,
+                     sigma=TIMING_SIGMA, speed_of_sound: float = SPEED_OF_SOUND) -> np.ndarray:
+    """(B, D, D) covariance of solve_batch sources, from the Jacobian at the solution.
+
+    sigma is the arrival time standard deviation in seconds, as a scalar,
+    per node (N,) or per detection (B, N). Linearizing the range model around
+    the fix gives cov = (J^T W J)^-1 with W = 1 / (c sigma)^2, of which the
+    position block is returned. Degenerate fixes (too few nodes, nodes in a
+    line, no solution) get NaN instead of a meaningless number.
+    """
+    positions, times, valid = _prepare(positions, times)
+    n_events, n_nodes, dims = positions.shape
+    sources = np.atleast_2d(np.asarray(sources, dtype=np.float64))
+    sigma = np.broadcast_to(np.asarray(sigma, dtype=np.float64), (n_events, n_nodes))
+    weights = np.where(valid, 1.0 / (speed_of_sound * sigma) ** 2, 0.0)
+
+    delta = sources[:, None, :] - positions
+    unit = delta / np.maximum(np.linalg.norm(delta, axis=2), 1e-12)[..., None]
+    J = np.concatenate((unit, np.ones((n_events, n_nodes, 1))), axis=2)
+    J = np.where(np.isfinite(J), J, 0.0)
+    info = np.einsum('bn,bni,bnj->bij', weights, J, J)
+
+    cov = np.full((n_events, dims + 1, dims + 1), np.nan)
+    ok = (valid.sum(axis=1) >= dims + 1) & np.all(np.isfinite(sources), axis=1)
+    ok[ok] = np.linalg.cond(info[ok]) < 1e12
+    if ok.any():
+        cov[ok] = np.linalg.inv(info[ok])
+    return cov[:, :dims, :dims]
+
+
+def monte_carlo_covariance(positions: np.ndarray, times: np.ndarray, sigma=TIMING_SIGMA,
+                           samples: int = 200, speed_of_sound: float = SPEED_OF_SOUND, seed: int = 0,
+                           block: int = 100000) -> np.ndarray:
+    """(B, D, D) source covariance from re-solving with randomly perturbed arrival times.
+
+    Captures the nonlinearity that covariance_batch linearizes away (e.g.
+    sources far outside the array). All B * samples solves go through
+    solve_batch at once, in blocks of `block` events to bound memory.
+    """
+    positions, times, valid = _prepare(positions, times)
+    n_events, n_nodes, dims = positions.shape
+    rng = np.random.default_rng(seed)
+    sigma = np.broadcast_to(np.asarray(sigma, dtype=np.float64), (n_events, n_nodes))
+    perturbed = times[:, None, :] + rng.standard_normal((n_events, samples, n_nodes)) * sigma[:, None, :]
+    perturbed = perturbed.reshape(-1, n_nodes)
+    repeated = np.repeat(positions, samples, axis=0)
+    sources = np.empty((len(perturbed), dims))
+    for start in range(0, len(perturbed), block):
+        stop = start + block
+        sources[start:stop], _ = solve_batch(repeated[start:stop], perturbed[start:stop], speed_of_sound)
+    sources = sources.reshape(n_events, samples, dims)
+    centered = sources - np.nanmean(sources, axis=1, keepdims=True)
+    count = np.sum(np.all(np.isfinite(centered), axis=2), axis=1)
+    centered = np.where(np.isfinite(centered), centered, 0.0)
+    cov = np.einsum('bsi,bsj->bij', centered, centered) / np.maximum(count - 1, 1)[:, None, None]
+    cov[count < max(samples // 2, 2)] = np.nan
+    return cov
+
+
+def error_ellipse(cov: np.ndarray) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """1-sigma semi-major and semi-minor axes (m) and the major axis angle (degrees from +x) in x/y.
+
+    Works on one (D, D) covariance or a (B, D, D) batch; multiply the axes by
+    ELLIPSE_95 for a 95% region.
+    """
+    cov = np.asarray(cov, dtype=np.float64)
+    horizontal = cov[..., :2, :2]
+    finite = np.all(np.isfinite(horizontal), axis=(-2, -1))
+    values, vectors = np.linalg.eigh(np.where(finite[..., None, None], horizontal, np.eye(2)))
+    major = np.sqrt(np.maximum(values[..., 1], 0.0))
+    minor = np.sqrt(np.maximum(values[..., 0], 0.0))
+    angle = np.degrees(np.arctan2(vectors[..., 1, 1], vectors[..., 0, 1])) % 180
+    nan = np.where(finite, 1.0, np.nan)
+    return major * nan, minor * nan, angle * nan
+
+
+def uncertainty_dict(cov: np.ndarray, rms: Optional[float] = None) -> Optional[dict]:
+    """JSON-friendly summary of one fix's covariance, None for a degenerate fix."""
+    if not np.all(np.isfinite(cov)):
+        return None
+    major, minor, angle = error_ellipse(cov)
+    out = {
+        "covariance": cov.tolist(),
+        "semi_major": float(major),
+        "semi_minor": float(minor),
+        "orientation": float(angle),
+    }
+    if rms is not None and np.isfinite(rms):
+        out["rms"] = float(rms)
+    return out
+
+
+def positions_array(mic_positions: dict, device_ids: list, dims: Optional[int] = None) -> np.ndarray:
+    """Stack node positions in the order of `device_ids`, padding 2D positions when solving in 3D."""
+    dims = dims or max(len(mic_positions[d]) for d in device_ids)
+    out = np.zeros((len(device_ids), dims))
+    for i, device_id in enumerate(device_ids):
+        pos = np.asarray(mic_positions[device_id], dtype=np.float64)
+        out[i, :len(pos)] = pos
+    return out
+
+
+def times_matrix(event_times: list, device_ids: list) -> np.ndarray:
+    """(B, N) arrival times from a list of {device_id: time} dicts, NaN where a device is missing.
+
+    Turns the "event_times" of a day of JSONL events into input for solve_batch.
+    """
+    column = {device_id: i for i, device_id in enumerate(device_ids)}
+    out = np.full((len(event_times), len(device_ids)), np.nan)
+    for row, times in enumerate(event_times):
+        for device_id, t in times.items():
+            if device_id in column and t is not None:
+                out[row, column[device_id]] = t
+    return out
@@ -0,0 +1,199 @@
+import math
+import threading
+from collections import defaultdict
+from typing import Dict, Iterable, List, Optional, Set
+
+import numpy as np
+
+from multilateration import SPEED_OF_SOUND, locate, positions_array
+
+
+class NodeIndex:
+    """Uniform grid over node positions (x, y) for neighbour queries.
+
+    Joining, moving and dropping a node are O(1) dict updates, and a query
+    only visits the cells around the query point, so lookups stay cheap with
+    hundreds of nodes.
+    """
+
+    def __init__(self, cell_size: float = 100.0):
+        self.cell_size = cell_size
+        self.cells: Dict[tuple, Set] = defaultdict(set)
+        self.positions: Dict[object, np.ndarray] = {}
+        self.cell_of: Dict[object, tuple] = {}
+        self.lock = threading.Lock()
+
+    def _cell(self, position: np.ndarray) -> tuple:
+        return (math.floor(position[0] / self.cell_size), math.floor(position[1] / self.cell_size))
+
+    def update(self, node_id, position) -> None:
+        """Add a node or move it."""
+        position = np.asarray(position, dtype=float)
+        cell = self._cell(position)
+        with self.lock:
+            old = self.cell_of.get(node_id)
+            if old is not None and old != cell:
+                self._discard(node_id, old)
+            self.cells[cell].add(node_id)
+            self.cell_of[node_id] = cell
+            self.positions[node_id] = position
+
+    def remove(self, node_id) -> None:
+        with self.lock:
+            cell = self.cell_of.pop(node_id, None)
+            if cell is not None:
+                self._discard(node_id, cell)
+            self.positions.pop(node_id, None)
+
+    def _discard(self, node_id, cell) -> None:
+        members = self.cells[cell]
+        members.discard(node_id)
+        if not members:
+            del self.cells[cell]
+
+    def set_positions(self, positions: Optional[dict]) -> None:
+        """Bring the index in line with a full {node id: position} map, touching only what changed."""
+        positions = positions or {}
+        for node_id in [n for n in self.positions if n not in positions]:
+            self.remove(node_id)
+        for node_id, position in positions.items():
+            known = self.positions.get(node_id)
+            if known is None or not np.array_equal(known, np.asarray(position, dtype=float)):
+                self.update(node_id, position)
+
+    def within(self, point, radius: float) -> List:
+        """Nodes within `radius` meters of `point` (in x, y)."""
+        point = np.asarray(point, dtype=float)
+        cx, cy = self._cell(point)
+        reach = math.ceil(radius / self.cell_size)
+        found = []
+        with self.lock:
+            for x in range(cx - reach, cx + reach + 1):
+                for y in range(cy - reach, cy + reach + 1):
+                    for node_id in self.cells.get((x, y), ()):
+                        if np.linalg.norm(self.positions[node_id][:2] - point[:2]) <= radius:
+                            found.append(node_id)
+        return found
+
+    def nearest(self, point, k: int, among: Optional[Iterable] = None) -> List:
+        """Up to `k` nodes closest to `point`, optionally only from `among`, closest first."""
+        point = np.asarray(point, dtype=float)
+        among = set(among) if among is not None else None
+        cx, cy = self._cell(point)
+        with self.lock:
+            if not self.cells:
+                return []
+            xs = [c[0] for c in self.cells]
+            ys = [c[1] for c in self.cells]
+            max_ring = max(abs(cx - min(xs)), abs(cx - max(xs)), abs(cy - min(ys)), abs(cy - max(ys)))
+            found = []
+            for ring in range(max_ring + 1):
+                for x in range(cx - ring, cx + ring + 1):
+                    for y in range(cy - ring, cy + ring + 1):
+                        if max(abs(x - cx), abs(y - cy)) != ring:
+                            continue
+                        for node_id in self.cells.get((x, y), ()):
+                            if among is None or node_id in among:
+                                found.append((np.linalg.norm(self.positions[node_id][:2] - point[:2]), node_id))
+                # Everything within ring * cell_size has been seen by now
+                if len(found) >= k and sorted(found)[k - 1][0] <= ring * self.cell_size:
+                    break
+        return [node_id for _, node_id in sorted(found, key=lambda f: f[0])[:k]]
+
+    def __len__(self) -> int:
+        return len(self.positions)
+
+
+def _design(positions: np.ndarray, source: np.ndarray) -> np.ndarray:
+    """Rows [unit vector from node to source, 1] of the TDOA model with unknown emission time."""
+    delta = source - positions
+    unit = delta / np.maximum(np.linalg.norm(delta, axis=-1, keepdims=True), 1e-9)
+    return np.concatenate((unit, np.ones(unit.shape[:-1] + (1,))), axis=-1)
+
+
+def gdop(positions: np.ndarray, source: np.ndarray, weights: Optional[np.ndarray] = None) -> float:
+    """Geometric dilution of precision of a fix at `source` from (N, D) node positions.
+
+    Position error is roughly gdop * c * timing error; inf when the nodes
+    cannot fix the source at all.
+    """
+    H = _design(np.asarray(positions, dtype=float), np.asarray(source, dtype=float))
+    w = np.ones(len(H)) if weights is None else np.asarray(weights, dtype=float)
+    info = np.einsum('n,na,nb->ab', w, H, H)
+    try:
+        cov = np.linalg.inv(info)
+    except np.linalg.LinAlgError:
+        return math.inf
+    dims = H.shape[1] - 1
+    trace = np.trace(cov[:dims, :dims])
+    return math.sqrt(trace) if trace > 0 else math.inf
+
+
+class NodeSelector:
+    """Picks a small, well-conditioned subset of the nodes that heard an event.
+
+    The candidates are the `pool` nodes closest to the earliest arrival (found
+    through the NodeIndex). A rough source position from the earliest few is
+    used to add nodes greedily, each time the one that lowers the
+    SNR-weighted GDOP the most, until `max_nodes` are chosen or the gain
+    drops below `min_gain`. Work per event is therefore bounded by `pool`,
+    not by the size of the mesh.
+    """
+
+    def __init__(self, index: Optional[NodeIndex] = None, max_nodes: int = 8, pool: int = 24,
+                 min_gain: float = 0.02, speed_of_sound: float = SPEED_OF_SOUND):
+        self.index = index if index is not None else NodeIndex()
+        self.max_nodes = max_nodes
+        self.pool = pool
+        self.min_gain = min_gain
+        self.speed_of_sound = speed_of_sound
+
+    def select(self, event_times: dict, amplitudes: Optional[dict] = None) -> List:
+        """Node ids to solve `event_times` with; all known nodes when there are few enough."""
+        known = [n for n, t in event_times.items() if t is not None and n in self.index.positions]
+        if len(known) <= self.max_nodes:
+            return known
+        first = min(known, key=event_times.get)
+        candidates = self.index.nearest(self.index.positions[first], self.pool, among=known)
+        positions = positions_array(self.index.positions, candidates)
+        dims = positions.shape[1]
+        times = np.array([event_times[n] for n in candidates])
+
+        by_time = np.argsort(times)
+        seed = by_time[:dims + 2]
+        source, _ = locate(positions[seed], times[seed], self.speed_of_sound)
+        if not np.all(np.isfinite(source)):
+            source = positions[by_time[0]]
+
+        # Received energy as the SNR weight; all equal without amplitudes
+        weights = np.ones(len(candidates))
+        if amplitudes:
+            weights = np.array([amplitudes.get(n, 0.0) for n in candidates], dtype=float) ** 2
+            weights = np.maximum(weights / max(weights.max(), 1e-12), 1e-3)
+
+        H = _design(positions, source)
+        outer = np.einsum('na,nb->nab', H, H) * weights[:, None, None]
+        chosen = list(by_time[:dims + 1])
+        info = outer[chosen].sum(axis=0)
+        current = self._dop(info[None], dims)[0]
+        remaining = [i for i in range(len(candidates)) if i not in chosen]
+        while remaining and len(chosen) < self.max_nodes:
+            scores = self._dop(info[None] + outer[remaining], dims)
+            best = int(np.argmin(scores))
+            if np.isfinite(current) and scores[best] > current * (1 - self.min_gain):
+                break
+            chosen.append(remaining.pop(best))
+            info = info + outer[chosen[-1]]
+            current = scores[best]
+        return [candidates[i] for i in chosen]
+
+    @staticmethod
+    def _dop(info: np.ndarray, dims: int) -> np.ndarray:
+        """Weighted GDOP of a batch of (D+1)x(D+1) information matrices, inf when singular."""
+        out = np.full(len(info), math.inf)
+        ok = np.abs(np.linalg.det(info)) > 1e-12
+        if ok.any():
+            cov = np.linalg.inv(info[ok])
+            trace = np.einsum('bii->b', cov[:, :dims, :dims])
+            out[ok] = np.sqrt(np.maximum(trace, 0))
+        return out
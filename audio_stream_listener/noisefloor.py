@@ -0,0 +1,86 @@
+from typing import Sequence
+
+import numpy as np
+
+
+class NoiseFloor:
+    """Running noise floor per frequency band, for triggering on SNR instead of absolute level.
+
+    Each chunk is reduced to its energy in a few bands plus its peak
+    amplitude, in dB. The floor of each is an exponential moving
+    percentile: it steps up by `step_db * quantile` when a chunk is above
+    it and down by `step_db * (1 - quantile)` when below, so it settles on
+    the `quantile` of recent chunks and a short bang barely moves it. The
+    first `warmup_chunks` chunks set each floor with a plain mean, and a
+    floor only counts towards the SNR once warmed up. Work per chunk is one
+    chunk-sized FFT, whatever the history.
+    """
+
+    TUNABLES = ("snr_db", "min_amplitude", "quantile", "step_db")
+
+    def __init__(self, rate: int, chunk_size: int, bands: Sequence[float] = (50, 300, 1000, 3000, 8000),
+                 snr_db: float = 10.0, min_amplitude: float = 0.01, quantile: float = 0.5,
+                 step_db: float = 0.5, warmup_chunks: int = 43):
+        self.chunk_size = chunk_size
+        self.bands = tuple(bands)
+        freqs = np.fft.rfftfreq(chunk_size, 1.0 / rate)
+        # Band i is [bands[i], bands[i + 1]), the last one runs up to Nyquist
+        self.band_starts = np.searchsorted(freqs, self.bands)
+        self.snr_db = snr_db
+        self.min_amplitude = min_amplitude
+        self.quantile = quantile
+        self.step_db = step_db
+        self.warmup_chunks = warmup_chunks
+        self.floor = np.zeros(len(self.bands) + 1)  # Band energies, then the peak
+        self.counts = np.zeros(len(self.floor), dtype=int)
+        self.last_snr = -np.inf
+
+    @property
+    def ready(self) -> bool:
+        return bool(self.counts[-1] >= self.warmup_chunks)
+
+    def levels(self, samples: np.ndarray) -> np.ndarray:
+        """Band energies and peak amplitude of a chunk, in dB."""
+        spectrum = np.fft.rfft(samples, self.chunk_size)
+        energy = np.add.reduceat(spectrum.real ** 2 + spectrum.imag ** 2, self.band_starts)
+        peak = np.max(np.abs(samples))
+        return np.concatenate((10 * np.log10(energy + 1e-20), [20 * np.log10(peak + 1e-20)]))
+
+    def update(self, samples: np.ndarray) -> float:
+        """Feed one chunk; returns its SNR in dB (largest over the bands and the peak) against the floor before it."""
+        levels = self.levels(samples)
+        warm = self.counts >= self.warmup_chunks
+        self.last_snr = float(np.max((levels - self.floor)[warm])) if warm[-1] else -np.inf
+        self._track(levels)
+        return self.last_snr
+
+    def _track(self, levels: np.ndarray) -> None:
+        self.counts += 1
+        warm = self.counts > self.warmup_chunks
+        above = levels > self.floor
+        step = np.where(above, self.step_db * self.quantile, -self.step_db * (1 - self.quantile))
+        mean_step = (levels - self.floor) / np.minimum(self.counts, self.warmup_chunks)
+        self.floor += np.where(warm, step, mean_step)
+
+    def triggered(self, amplitude: float) -> bool:
+        """True if the last chunk fed to update() is an event: loud enough above the floor, and at all."""
+        return self.last_snr >= self.snr_db and amplitude >= self.min_amplitude
+
+    def peak_threshold(self) -> float:
+        """Peak amplitude that on its own would be `snr_db` above the floor, inf while warming up."""
+        if not self.ready:
+            return np.inf
+        return max(self.min_amplitude, 10 ** ((self.floor[-1] + self.snr_db) / 20))
+
+    def set(self, name: str, value: float) -> None:
+        if name not in self.TUNABLES:
+            raise KeyError(name)
+        setattr(self, name, float(value))
+
+    def stats(self) -> dict:
+        return {
+            "ready": self.ready,
+            "floor_db": dict(zip([f"{int(b)}Hz" for b in self.bands] + ["peak"], self.floor.round(1).tolist())),
+            "last_snr_db": self.last_snr if np.isfinite(self.last_snr) else None,
+            **{name: getattr(self, name) for name in self.TUNABLES},
+        }
@@ -0,0 +1,157 @@
+from typing import Callable, Optional
+
+import numpy as np
+
+
+def parabolic_refine(y: np.ndarray, idx: int) -> float:
+    """Fractional position of the peak at `idx` from a parabola through its neighbours."""
+    if idx <= 0 or idx >= len(y) - 1:
+        return float(idx)
+    a, b, c = y[idx - 1], y[idx], y[idx + 1]
+    denom = a - 2 * b + c
+    if denom == 0:
+        return float(idx)
+    return idx + 0.5 * (a - c) / denom
+
+
+def sinc_refine(y: np.ndarray, idx: int, taps: int = 16, upsample: int = 32) -> float:
+    """Fractional peak position from band-limited (sinc) interpolation around `idx`."""
+    lo, hi = max(0, idx - taps), min(len(y), idx + taps + 1)
+    n = np.arange(lo, hi)
+    grid = idx + np.linspace(-1, 1, 2 * upsample + 1)
+    interp = np.sinc(grid[:, None] - n[None, :]) @ y[lo:hi]
+    return float(grid[np.argmax(interp)])
+
+
+REFINERS = {
+    "none": lambda y, idx: float(idx),
+    "parabolic": parabolic_refine,
+    "sinc": sinc_refine,
+}
+
+
+def energy_onset(x: np.ndarray, rate: int, window: int = 32, fraction: float = 0.2,
+                 noise_samples: Optional[int] = None) -> float:
+    """First crossing of a short-term energy envelope above the noise floor.
+
+    The envelope is a causal moving average of x**2, so a step in energy
+    crosses `fraction` of its height `fraction * window` samples late; that
+    lag is removed from the interpolated crossing. There is no peak to
+    refine, so unlike the other methods it takes no `refine`.
+    """
+    energy = x.astype(np.float64) ** 2
+    csum = np.concatenate(([0.0], np.cumsum(energy)))
+    envelope = np.empty_like(energy)
+    envelope[window - 1:] = (csum[window:] - csum[:-window]) / window
+    envelope[:window - 1] = csum[1:window] / np.arange(1, window)
+
+    noise_samples = noise_samples or max(window, len(x) // 4)
+    noise = np.median(envelope[:noise_samples])
+    level = noise + fraction * (envelope.max() - noise)
+    above = np.flatnonzero(envelope >= level)
+    if len(above) == 0:
+        return float(np.argmax(envelope))
+    i = above[0]
+    if i == 0:
+        return 0.0
+    # Linear interpolation of the crossing between i-1 and i
+    crossing = i - 1 + (level - envelope[i - 1]) / (envelope[i] - envelope[i - 1])
+    return max(0.0, crossing - fraction * window)
+
+
+def aic_onset(x: np.ndarray, rate: int, refine: Callable = None) -> float:
+    """Akaike information criterion picker (Maeda 1985), computed with cumulative sums."""
+    x = x.astype(np.float64)
+    n = len(x)
+    k = np.arange(1, n)
+    csum = np.cumsum(x)
+    csum2 = np.cumsum(x ** 2)
+    head_mean = csum[:-1] / k
+    head_var = csum2[:-1] / k - head_mean ** 2
+    tail_n = n - k
+    tail_mean = (csum[-1] - csum[:-1]) / tail_n
+    tail_var = (csum2[-1] - csum2[:-1]) / tail_n - tail_mean ** 2
+
+    eps = np.finfo(np.float64).tiny
+    aic = np.full(n, np.inf)
+    aic[1:] = k * np.log(np.maximum(head_var, eps)) + (tail_n - 1) * np.log(np.maximum(tail_var, eps))
+    # Variances of one or two samples are meaningless
+    aic[:2] = np.inf
+    aic[-2:] = np.inf
+
+    idx = int(np.argmin(aic))
+    refine = refine or parabolic_refine
+    finite = np.where(np.isfinite(aic), aic, aic[idx])
+    return refine(-finite, idx)
+
+
+def default_template(rate: int, decay: float = 0.001, length: float = 0.005) -> np.ndarray:
+    """Exponentially decaying impulse, a generic model of a muzzle blast envelope."""
+    t = np.arange(int(length * rate)) / rate
+    return np.exp(-t / decay)
+
+
+def matched_filter_onset(x: np.ndarray, rate: int, template: Optional[np.ndarray] = None,
+                         refine: Callable = None) -> float:
+    """Lag of the best match between |x| and a template, via FFT correlation."""
+    if template is None:
+        template = default_template(rate)
+    envelope = np.abs(x.astype(np.float64))
+    envelope -= np.median(envelope)
+    n = len(envelope) + len(template)
+    nfft = 1 << (n - 1).bit_length()
+    corr = np.fft.irfft(np.fft.rfft(envelope, nfft) * np.conj(np.fft.rfft(template, nfft)), nfft)
+    corr = corr[:len(envelope)]
+    idx = int(np.argmax(corr))
+    refine = refine or parabolic_refine
+    return refine(corr, idx)
+
+
+ONSET_METHODS = {
+    "energy": energy_onset,
+    "aic": aic_onset,
+    "matched": matched_filter_onset,
+}
+
+
+class OnsetTimer:
+    """Sub-sample onset timing on the ring buffer around a trigger.
+
+    The analysis window reaches `pre_seconds` back from the trigger sample and
+    `post_seconds` past it, so an onset that straddles chunk boundaries is seen
+    in one piece. `method` is one of ONSET_METHODS or any callable taking
+    (samples, rate, refine=...) and returning a fractional sample index.
+    `refine` (default "parabolic") picks the peak interpolation; the energy
+    method interpolates its threshold crossing linearly and rejects one.
+    """
+
+    def __init__(self, rate: int, method="aic", refine: Optional[str] = None,
+                 pre_seconds: float = 0.02, post_seconds: float = 0.005, **method_kwargs):
+        self.rate = rate
+        self.method = ONSET_METHODS[method] if isinstance(method, str) else method
+        if self.method is energy_onset:
+            if refine is not None:
+                raise ValueError(f"Energy onsets have no peak to refine, got refine={refine!r}")
+            self.refine = None
+        else:
+            self.refine = REFINERS[refine or "parabolic"]
+        self.pre_samples = int(pre_seconds * rate)
+        self.post_samples = int(post_seconds * rate)
+        self.method_kwargs = method_kwargs
+
+    def locate(self, window: np.ndarray) -> float:
+        """Fractional onset index within `window`."""
+        if self.refine is None:
+            return self.method(window, self.rate, **self.method_kwargs)
+        return self.method(window, self.rate, refine=self.refine, **self.method_kwargs)
+
+    def time_onset(self, ring, trigger_index: int, timeout: float = 1.0, channel: int = 0) -> Optional[float]:
+        """Onset time near `trigger_index` on `channel`, waiting for the post-trigger samples if needed."""
+        end = trigger_index + self.post_samples
+        if not ring.wait_until(end, timeout):
+            return None
+        start = max(trigger_index - self.pre_samples, ring.oldest_pos())
+        window = ring.read(start, end - start)
+        if window is None:
+            return None
+        return ring.time_of(start + self.locate(window[:, channel]))
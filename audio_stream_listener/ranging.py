@@ -0,0 +1,245 @@
+import argparse
+import logging
+import socket
+import threading
+import time
+from typing import Dict, Optional, Tuple
+
+import numpy as np
+
+from calibration import classical_mds
+from logqueue import start_logging
+
+log = logging.getLogger(__name__)
+
+# Constants for RSSI to distance calculation
+TX_POWER = -59  # RSSI at 1 meter
+PATH_LOSS_EXPONENT = 2  # Environment factor (free space)
+
+# Port for communication
+PORT = 12345
+BEACON = "TNRANGE"
+
+
+def calculate_distance(rssi, tx_power=TX_POWER, path_loss_exponent=PATH_LOSS_EXPONENT):
+    """
+    Calculate the distance from RSSI using the path loss model.
+    Args:
+        rssi (float): Received Signal Strength Indicator (RSSI) in dBm.
+        tx_power (int): RSSI value at 1 meter (default -59 dBm).
+        path_loss_exponent (float): Path loss exponent (default 2 for free space).
+    Returns:
+        float: Estimated distance in meters.
+    """
+    distance = 10 ** ((tx_power - rssi) / (10 * path_loss_exponent))
+    return round(distance, 2)
+
+
+class WirelessLevel:
+    """Signal level of a Wi-Fi interface from /proc/net/wireless.
+
+    The file stays open and is re-read from the start for every sample, so
+    sampling is a read syscall instead of forking `iw`. None when the
+    interface (or wireless extensions) is missing.
+    """
+
+    PATH = "/proc/net/wireless"
+
+    def __init__(self, interface: Optional[str] = None, path: str = PATH):
+        self.interface = interface
+        self.path = path
+        self.file = None
+
+    def read(self) -> Optional[float]:
+        try:
+            if self.file is None:
+                self.file = open(self.path)
+            self.file.seek(0)
+            lines = self.file.read().splitlines()[2:]
+        except OSError:
+            self.file = None
+            return None
+        for line in lines:
+            name, _, fields = line.partition(':')
+            if self.interface is not None and name.strip() != self.interface:
+                continue
+            fields = fields.split()
+            if len(fields) < 3:
+                continue
+            try:
+                level = float(fields[2].rstrip('.'))
+            except ValueError:
+                continue
+            # Some drivers report dBm as an unsigned byte
+            return level - 256 if level > 0 else level
+        return None
+
+
+class RssiFilter:
+    """Scalar Kalman filter on RSSI in dB: a random walk of `drift` dB^2 per second seen with `noise` dB^2."""
+
+    def __init__(self, drift: float = 0.5, noise: float = 16.0):
+        self.drift = drift
+        self.noise = noise
+        self.level: Optional[float] = None
+        self.variance = np.inf
+        self.last = 0.0
+
+    def update(self, rssi: float, now: Optional[float] = None) -> float:
+        now = time.time() if now is None else now
+        if self.level is None:
+            self.level, self.variance = float(rssi), self.noise
+        else:
+            variance = self.variance + self.drift * max(now - self.last, 0.0)
+            gain = variance / (variance + self.noise)
+            self.level += gain * (rssi - self.level)
+            self.variance = (1 - gain) * variance
+        self.last = now
+        return self.level
+
+
+class RangingService:
+    """Pairwise RSSI ranges to every peer over one UDP socket, and the geometry they imply.
+
+    Every `interval` seconds the node samples its link level, smooths it
+    with an RssiFilter and sends "TNRANGE node=<id> rssi=<dBm> ranges=..."
+    from the same socket it receives on to each connected peer's address.
+    A pair's range comes from the mean of both ends' smoothed levels, and
+    the `ranges` field relays each node's own ranges so every node learns
+    the full matrix. The level is that of the interface's link, which is
+    the link to the peer when nodes talk directly (ad-hoc, Wi-Fi Direct, or
+    one node being the others' hotspot); through a shared access point it
+    is only a coarse hint.
+    """
+
+    def __init__(self, network, port: int = PORT, interval: float = 2.0, interface: Optional[str] = None,
+                 tx_power: float = TX_POWER, path_loss_exponent: float = PATH_LOSS_EXPONENT,
+                 expiry: float = 30.0):
+        self.network = network
+        self.port = port
+        self.interval = interval
+        self.signal = WirelessLevel(interface)
+        self.filter = RssiFilter()
+        self.tx_power = tx_power
+        self.path_loss_exponent = path_loss_exponent
+        self.expiry = expiry
+        self.peer_levels: Dict[str, Tuple[float, float]] = {}  # node id -> (smoothed dBm, time)
+        self.ranges: Dict[Tuple[str, str], Tuple[float, float]] = {}  # sorted id pair -> (meters, time)
+        self.lock = threading.Lock()
+        self.sock: Optional[socket.socket] = None
+        self.running = False
+
+    def start(self) -> "RangingService":
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.sock.bind(("", self.port))
+        self.sock.settimeout(self.interval)
+        self.running = True
+        threading.Thread(target=self.listen, daemon=True).start()
+        threading.Thread(target=self.announce, daemon=True).start()
+        return self
+
+    def stop(self) -> None:
+        self.running = False
+
+    def set_range(self, a: str, b: str, meters: float, when: float) -> None:
+        with self.lock:
+            self.ranges[tuple(sorted((a, b)))] = (meters, when)
+
+    def announce(self) -> None:
+        while self.running:
+            rssi = self.signal.read()
+            if rssi is not None:
+                me = self.network.my_node_id()
+                level = self.filter.update(rssi)
+                own = ",".join(f"{b if a == me else a}:{meters:.2f}"
+                               for (a, b), meters in self.current().items() if me in (a, b))
+                beacon = f"{BEACON} node={me} rssi={level:.1f} ranges={own}".encode()
+                for address in {c.address for c in self.network.connections}:
+                    try:
+                        self.sock.sendto(beacon, (address, self.port))
+                    except OSError as e:
+                        log.error(f"Error sending ranging beacon to {address}: {e}")
+            time.sleep(self.interval)
+
+    def listen(self) -> None:
+        while self.running:
+            try:
+                data, _ = self.sock.recvfrom(4096)
+            except socket.timeout:
+                continue
+            except OSError:
+                time.sleep(self.interval)
+                continue
+            self.handle_beacon(data.decode(errors="replace"), time.time())
+
+    def handle_beacon(self, message: str, now: float) -> None:
+        parts = message.split()
+        if not parts or parts[0] != BEACON:
+            return
+        fields = dict(part.split('=', 1) for part in parts[1:] if '=' in part)
+        peer = fields.get('node')
+        try:
+            rssi = float(fields['rssi'])
+        except (KeyError, ValueError):
+            return
+        if peer is None or not np.isfinite(rssi):
+            return
+        me = self.network.my_node_id()
+        with self.lock:
+            self.peer_levels[peer] = (rssi, now)
+        if self.filter.level is not None:
+            level = (self.filter.level + rssi) / 2
+            self.set_range(me, peer, calculate_distance(level, self.tx_power, self.path_loss_exponent), now)
+        for entry in filter(None, fields.get('ranges', '').split(',')):
+            other, _, meters = entry.rpartition(':')
+            try:
+                meters = float(meters)
+            except ValueError:
+                continue
+            if other and other != me and np.isfinite(meters) and meters >= 0:
+                self.set_range(peer, other, meters, now)
+
+    def current(self) -> Dict[Tuple[str, str], float]:
+        """Ranges in meters heard within `expiry` seconds, keyed by sorted node id pair."""
+        now = time.time()
+        with self.lock:
+            return {pair: meters for pair, (meters, when) in self.ranges.items() if now - when < self.expiry}
+
+    def geometry(self, dims: int = 2) -> Optional[Dict[str, list]]:
+        """Node positions from the ranges by classical MDS (missing pairs get the mean range), None below 3 nodes."""
+        ranges = self.current()
+        nodes = sorted({n for pair in ranges for n in pair})
+        if len(nodes) < dims + 1:
+            return None
+        index = {n: i for i, n in enumerate(nodes)}
+        distance = np.full((len(nodes), len(nodes)), np.mean(list(ranges.values())))
+        np.fill_diagonal(distance, 0.0)
+        for (a, b), meters in ranges.items():
+            distance[index[a], index[b]] = distance[index[b], index[a]] = meters
+        return {n: p.tolist() for n, p in zip(nodes, classical_mds(distance, dims))}
+
+
+class _Peers:
+    """Fixed peer list standing in for a P2PNetwork when run on its own."""
+
+    def __init__(self, addresses):
+        self.connections = [type("Peer", (), {"address": a})() for a in addresses]
+
+    def my_node_id(self) -> str:
+        return socket.gethostname()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Print RSSI ranges to peers running the same script")
+    parser.add_argument("peers", nargs="+", help="Peer IP addresses")
+    parser.add_argument("--port", type=int, default=PORT)
+    parser.add_argument("--interface", default=None)
+    args = parser.parse_args()
+
+    start_logging()
+    service = RangingService(_Peers(args.peers), args.port, interface=args.interface).start()
+    while True:
+        time.sleep(service.interval)
+        for (a, b), meters in service.current().items():
+            print(f"Distance {a} - {b}: {meters} meters")
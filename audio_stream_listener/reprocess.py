@@ -0,0 +1,358 @@
+import argparse
+import json
+import os
+import struct
+import time
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+from association import EventAssociator
+from classify import EventClassifier
+from eventsink import EventSink
+from gcc_phat import GccPhat
+from noisefloor import NoiseFloor
+from multilateration import (SPEED_OF_SOUND, TIMING_SIGMA, covariance_batch, monte_carlo_covariance,
+                             positions_array, solve_batch, times_matrix, uncertainty_dict)
+from onset import ONSET_METHODS, OnsetTimer
+from tracker import MultiTargetTracker
+
+# Same detection parameters as NoiseDetector, so offline fixes match live ones. Its default
+# adaptive trigger is the same NoiseFloor; the fixed one is only comparable on the same scale
+CHUNK_SIZE = 1024
+THRESHOLD = 0.5  # Peak amplitude on to_float's [-1, 1] scale, which integer WAVs cannot exceed
+SNR_DB = 10.0
+MIN_AMPLITUDE = 0.01
+COOLDOWN = 1
+PREROLL_SECONDS = 10  # Audio before a segment that its noise floor is run over first
+SNIPPET_PRE_SECONDS = 0.005
+SEGMENT_SECONDS = 60  # Audio per pool task
+
+WAVE_FORMAT_PCM = 1
+WAVE_FORMAT_IEEE_FLOAT = 3
+WAVE_FORMAT_EXTENSIBLE = 0xFFFE
+WAV_DTYPES = {
+    (WAVE_FORMAT_PCM, 8): np.dtype('u1'),
+    (WAVE_FORMAT_PCM, 16): np.dtype('<i2'),
+    (WAVE_FORMAT_PCM, 32): np.dtype('<i4'),
+    (WAVE_FORMAT_IEEE_FLOAT, 32): np.dtype('<f4'),
+    (WAVE_FORMAT_IEEE_FLOAT, 64): np.dtype('<f8'),
+}
+
+
+def open_wav(path: str) -> Tuple[int, np.ndarray]:
+    """(sample rate, memory-mapped (frames, channels) samples) of a WAV file, without reading it."""
+    with open(path, 'rb') as f:
+        riff, _, wave = struct.unpack('<4sI4s', f.read(12))
+        if riff != b'RIFF' or wave != b'WAVE':
+            raise ValueError(f"{path} is not a WAV file")
+        fmt = None
+        while True:
+            header = f.read(8)
+            if len(header) < 8:
+                raise ValueError(f"{path} has no data chunk")
+            chunk_id, size = struct.unpack('<4sI', header)
+            if chunk_id == b'fmt ':
+                body = f.read(size)
+                audio_format, channels, rate, _, _, bits = struct.unpack_from('<HHIIHH', body)
+                if audio_format == WAVE_FORMAT_EXTENSIBLE:
+                    audio_format = struct.unpack_from('<H', body, 24)[0]
+                fmt = (audio_format, channels, rate, bits)
+            elif chunk_id == b'data':
+                offset = f.tell()
+                break
+            else:
+                f.seek(size + (size & 1), os.SEEK_CUR)
+    if fmt is None:
+        raise ValueError(f"{path} has no fmt chunk")
+    audio_format, channels, rate, bits = fmt
+    dtype = WAV_DTYPES.get((audio_format, bits))
+    if dtype is None:
+        raise ValueError(f"{path}: unsupported sample format {audio_format} with {bits} bits")
+    # The data chunk size is often wrong in files from interrupted recordings
+    frames = (os.path.getsize(path) - offset) // (dtype.itemsize * channels)
+    return rate, np.memmap(path, dtype=dtype, mode='r', offset=offset, shape=(frames, channels))
+
+
+def to_float(samples: np.ndarray) -> np.ndarray:
+    """WAV samples scaled to [-1, 1] float32, like the paFloat32 capture."""
+    if samples.dtype.kind == 'f':
+        return samples.astype(np.float32)
+    if samples.dtype == np.uint8:
+        return (samples.astype(np.float32) - 128) / 128
+    return samples.astype(np.float32) / np.iinfo(samples.dtype).max
+
+
+def find_triggers(task) -> Tuple[str, np.ndarray, np.ndarray]:
+    """Pool task: (node id, peak sample indices, amplitudes) of triggering chunks in one segment.
+
+    The adaptive trigger first runs its noise floor over the PREROLL_SECONDS
+    before the segment, so the floor is settled wherever the segment starts.
+    """
+    node_id, path, first_chunk, n_chunks, trigger, threshold, snr_db, min_amplitude = task
+    rate, samples = open_wav(path)
+    n_chunks = min(n_chunks, len(samples) // CHUNK_SIZE - first_chunk)
+    start = first_chunk * CHUNK_SIZE
+    chunks = to_float(samples[start:start + n_chunks * CHUNK_SIZE, 0]).reshape(n_chunks, CHUNK_SIZE)
+    magnitude = np.abs(chunks)
+    peaks = np.argmax(magnitude, axis=1)
+    amplitudes = magnitude[np.arange(n_chunks), peaks]
+    if trigger == "fixed":
+        loud = np.flatnonzero(amplitudes > threshold)
+    else:
+        floor = NoiseFloor(rate, CHUNK_SIZE, snr_db=snr_db, min_amplitude=min_amplitude)
+        preroll = max(first_chunk - int(PREROLL_SECONDS * rate) // CHUNK_SIZE, 0) * CHUNK_SIZE
+        for chunk in to_float(samples[preroll:start, 0]).reshape(-1, CHUNK_SIZE):
+            floor.update(chunk)
+        triggered = np.zeros(n_chunks, dtype=bool)
+        for c in range(n_chunks):
+            floor.update(chunks[c])
+            triggered[c] = floor.triggered(amplitudes[c])
+        loud = np.flatnonzero(triggered)
+    return node_id, start + loud * CHUNK_SIZE + peaks[loud], amplitudes[loud]
+
+
+def apply_cooldown(peaks: np.ndarray, amplitudes: np.ndarray, rate: int,
+                   cooldown: float) -> Tuple[np.ndarray, np.ndarray]:
+    """Drop triggers within `cooldown` seconds of the last kept one, as detect_noise does."""
+    keep = []
+    last = -np.inf
+    for i, peak in enumerate(peaks):
+        if (peak - last) / rate > cooldown:
+            keep.append(i)
+            last = peak
+    return peaks[keep], amplitudes[keep]
+
+
+def time_onsets(task) -> Tuple[str, np.ndarray, list, list]:
+    """Pool task: (node id, fractional onset indices, snippets, event types) for one node's triggers.
+
+    Each snippet is (first sample index, float32 samples) or None, each
+    event type a label as classify_event gives it, None when not classifying.
+    """
+    node_id, path, peaks, onset_method, snippet_seconds, classify_seconds = task
+    rate, samples = open_wav(path)
+    timer = OnsetTimer(rate, method=onset_method) if onset_method else None
+    classifier = EventClassifier(rate, classify_seconds) if classify_seconds else None
+    onsets = np.asarray(peaks, dtype=np.float64)
+    snippets = [None] * len(peaks)
+    event_types = [None] * len(peaks)
+    for i, peak in enumerate(peaks):
+        if timer is not None:
+            start = max(peak - timer.pre_samples, 0)
+            window = to_float(samples[start:peak + timer.post_samples, 0])
+            onsets[i] = start + timer.locate(window)
+        if snippet_seconds:
+            start = max(int(onsets[i]) - int(SNIPPET_PRE_SECONDS * rate), 0)
+            snippets[i] = (start, to_float(samples[start:start + int(snippet_seconds * rate), 0]))
+        if classifier is not None:
+            start = max(int(onsets[i]) - int(classifier.pre_seconds * rate), 0)
+            event_types[i] = classifier.classify(to_float(samples[start:start + classifier.length, 0]))[0]
+    return node_id, onsets, snippets, event_types
+
+
+def load_manifest(path: str) -> Dict[str, dict]:
+    """Per-node settings from a JSON manifest, with WAV paths resolved next to it.
+
+        {"nodes": {"node-a": {"wav": "a.wav", "position": [0, 0],
+                              "start_time": 1712345678.0, "clock_offset": 0.0}, ...}}
+
+    `start_time` is the node's clock at the first sample (0 if unknown) and
+    `clock_offset` is added to the node's times to bring them onto the
+    common clock.
+    """
+    with open(path) as f:
+        manifest = json.load(f)
+    base = os.path.dirname(os.path.abspath(path))
+    nodes = {}
+    for node_id, node in manifest["nodes"].items():
+        nodes[node_id] = {
+            "wav": os.path.join(base, node["wav"]),
+            "position": node["position"],
+            "start_time": float(node.get("start_time", 0.0)),
+            "clock_offset": float(node.get("clock_offset", 0.0)),
+        }
+    return nodes
+
+
+def detect(nodes: Dict[str, dict], pool: ProcessPoolExecutor, threshold: float = THRESHOLD,
+           cooldown: float = COOLDOWN, onset_method: Optional[str] = "aic",
+           snippet_seconds: Optional[float] = None, trigger: str = "adaptive", snr_db: float = SNR_DB,
+           min_amplitude: float = MIN_AMPLITUDE, classify_seconds: Optional[float] = None) -> Dict[str, list]:
+    """Every node's detections as [(time, amplitude, snippet, event type)].
+
+    The snippet is (start time, samples) or None, the event type None
+    unless `classify_seconds` is given.
+
+    Triggering is split into SEGMENT_SECONDS pieces across the pool; the
+    cooldown is applied per node afterwards, so results do not depend on
+    where the segments are cut.
+    """
+    tasks = []
+    rates = {}
+    for node_id, node in nodes.items():
+        rate, samples = open_wav(node["wav"])
+        rates[node_id] = rate
+        total = len(samples) // CHUNK_SIZE
+        per_task = max(int(SEGMENT_SECONDS * rate) // CHUNK_SIZE, 1)
+        tasks += [(node_id, node["wav"], c, per_task, trigger, threshold, snr_db, min_amplitude)
+                  for c in range(0, total, per_task)]
+
+    triggers = {node_id: ([], []) for node_id in nodes}
+    for node_id, peaks, amplitudes in pool.map(find_triggers, tasks, chunksize=4):
+        triggers[node_id][0].append(peaks)
+        triggers[node_id][1].append(amplitudes)
+
+    kept = {}
+    for node_id, (peaks, amplitudes) in triggers.items():
+        kept[node_id] = apply_cooldown(np.concatenate(peaks or [np.empty(0, int)]),
+                                       np.concatenate(amplitudes or [np.empty(0)]),
+                                       rates[node_id], cooldown)
+
+    onset_tasks = [(node_id, nodes[node_id]["wav"], peaks, onset_method, snippet_seconds, classify_seconds)
+                   for node_id, (peaks, _) in kept.items()]
+    detections = {}
+    for node_id, onsets, snippets, event_types in pool.map(time_onsets, onset_tasks):
+        node, rate = nodes[node_id], rates[node_id]
+        to_time = lambda index: node["start_time"] + node["clock_offset"] + index / rate
+        detections[node_id] = [
+            (to_time(onset), float(amplitude), None if s is None else (to_time(s[0]), s[1]), event_type)
+            for onset, amplitude, s, event_type in zip(onsets, kept[node_id][1], snippets, event_types)]
+    return detections
+
+
+def associate(detections: Dict[str, list], positions: dict, min_nodes: int = 3) -> list:
+    """Group detections into events in time order; returns the final state of every Association."""
+    associations = {}
+    associator = EventAssociator(min_nodes=min_nodes, max_detections=1 << 20,
+                                 on_fix=lambda a: associations.__setitem__(a.id, a))
+    associator.set_geometry(positions)
+    merged = sorted(((t, node_id, amplitude, snippet, event_type)
+                     for node_id, node_detections in detections.items()
+                     for t, amplitude, snippet, event_type in node_detections), key=lambda d: (d[0], d[1]))
+    for t, node_id, amplitude, snippet, event_type in merged:
+        associator.add(node_id, t, amplitude, snippet, event_type)
+    return sorted(associations.values(), key=lambda a: a.first_time)
+
+
+def gcc_event_times(association, rate: int, snippet_seconds: float) -> dict:
+    """Arrival times from GCC-PHAT on the snippets, referenced to the earliest detection."""
+    gcc = GccPhat(rate, int(snippet_seconds * rate))
+    detections = association.detections
+    for node_id, detection in detections.items():
+        gcc.add(node_id, detection.data[1], detection.data[0])
+    reference = min(detections, key=lambda n: detections[n].time)
+    return gcc.aligned_times(reference, detections[reference].time)
+
+
+def localize(associations: list, positions: dict, rate: int = 44100,
+             snippet_seconds: Optional[float] = None, timing_sigma: float = TIMING_SIGMA,
+             monte_carlo: int = 0, speed_of_sound: float = SPEED_OF_SOUND) -> List[dict]:
+    """Events in the live JSONL schema, with every position and covariance solved in one batch.
+
+    With `monte_carlo` > 0 the covariances come from that many perturbed
+    re-solves per event instead of the linearization. Fixes go through a
+    MultiTargetTracker in time order, as on a live node, for their "track".
+    """
+    event_times = [gcc_event_times(a, rate, snippet_seconds) if snippet_seconds else a.event_times()
+                   for a in associations]
+    node_ids = sorted(positions)
+    if not associations:
+        return []
+    node_positions = positions_array(positions, node_ids)
+    times = times_matrix(event_times, node_ids)
+    sources, rms = solve_batch(node_positions, times, speed_of_sound)
+    if monte_carlo:
+        covariances = monte_carlo_covariance(node_positions, times, timing_sigma, monte_carlo, speed_of_sound)
+    else:
+        covariances = covariance_batch(node_positions, times, sources, timing_sigma, speed_of_sound)
+    events = []
+    tracker = MultiTargetTracker()
+    for association, times, source, cov, fit in zip(associations, event_times, sources, covariances, rms):
+        coord_dict = {node_id: list(map(float, positions[node_id])) for node_id in sorted(times)}
+        coord_dict['source'] = source.tolist()
+        event = {
+            "event_id": association.id,
+            "event_times": times,
+            "coord_dict": coord_dict,
+            "amplitude": max(d.amplitude for d in association.detections.values()),
+            "type": association.event_type,
+            "uncertainty": uncertainty_dict(cov, fit),
+        }
+        event["track"] = tracker.update(event)
+        events.append(event)
+    return events
+
+
+def reprocess(manifest: str, output_file: str, workers: Optional[int] = None, threshold: float = THRESHOLD,
+              cooldown: float = COOLDOWN, onset_method: Optional[str] = "aic",
+              snippet_seconds: Optional[float] = None, min_nodes: int = 3,
+              timing_sigma: float = TIMING_SIGMA, monte_carlo: int = 0, trigger: str = "adaptive",
+              snr_db: float = SNR_DB, min_amplitude: float = MIN_AMPLITUDE,
+              classify_seconds: Optional[float] = None) -> List[dict]:
+    """Detect, associate and localize the recordings in `manifest`, writing events to `output_file`."""
+    nodes = load_manifest(manifest)
+    positions = {node_id: node["position"] for node_id, node in nodes.items()}
+    rates = {open_wav(node["wav"])[0] for node in nodes.values()}
+    if len(rates) != 1:
+        raise ValueError(f"Recordings have different sample rates: {sorted(rates)}")
+
+    started = time.time()
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        detections = detect(nodes, pool, threshold, cooldown, onset_method, snippet_seconds, trigger, snr_db,
+                            min_amplitude, classify_seconds)
+    print(f"{sum(map(len, detections.values()))} detections in {time.time() - started:.1f}s")
+
+    associations = associate(detections, positions, min_nodes)
+    events = localize(associations, positions, rates.pop(), snippet_seconds, timing_sigma, monte_carlo)
+    sink = EventSink(output_file, max_queue=0).start()
+    for event in events:
+        sink.write(event)
+    sink.close()
+    print(f"{len(events)} events written to {output_file} in {time.time() - started:.1f}s")
+    return events
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        usage="python reprocess.py recordings.json ./out.jsonl",
+        description="Localize events offline from one WAV recording per node")
+    parser.add_argument("manifest", help="JSON file with each node's WAV path, position and clock offset")
+    parser.add_argument("output_file")
+    parser.add_argument("--workers", type=int, default=None, help="Processes to use (all cores by default)")
+    parser.add_argument("--trigger", choices=["adaptive", "fixed"], default="adaptive",
+                        help="Trigger on SNR against a running noise floor, as live nodes do, or on --threshold")
+    parser.add_argument("--snr-db", type=float, default=SNR_DB,
+                        help="SNR above the noise floor that triggers with --trigger adaptive")
+    parser.add_argument("--min-amplitude", type=float, default=MIN_AMPLITUDE,
+                        help="Never trigger below this peak amplitude with --trigger adaptive")
+    parser.add_argument("--threshold", type=float, default=THRESHOLD,
+                        help="Peak amplitude that triggers with --trigger fixed, full scale being 1 whatever "
+                             "the WAV sample format")
+    parser.add_argument("--cooldown", type=float, default=COOLDOWN)
+    parser.add_argument("--onset", choices=sorted(ONSET_METHODS) + ["none"], default="aic",
+                        help="Sub-sample onset picker, or none to keep the chunk peak")
+    parser.add_argument("--snippet-ms", type=float, default=None,
+                        help="Derive TDOAs with GCC-PHAT on snippets of this length")
+    parser.add_argument("--classify-ms", type=float, default=None,
+                        help="Label detections from this much audio after the onset, as live nodes do")
+    parser.add_argument("--min-nodes", type=int, default=3)
+    parser.add_argument("--timing-sigma-us", type=float, default=TIMING_SIGMA * 1e6,
+                        help="Arrival time standard deviation used for the fix covariances")
+    parser.add_argument("--monte-carlo", type=int, default=0, metavar="SAMPLES",
+                        help="Estimate covariances from this many perturbed re-solves per event")
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    reprocess(args.manifest, args.output_file, args.workers, args.threshold, args.cooldown,
+              None if args.onset == "none" else args.onset,
+              args.snippet_ms / 1000 if args.snippet_ms else None, args.min_nodes,
+              args.timing_sigma_us * 1e-6, args.monte_carlo, args.trigger, args.snr_db, args.min_amplitude,
+              args.classify_ms / 1000 if args.classify_ms else None)
+
+
+if __name__ == "__main__":
+    main()
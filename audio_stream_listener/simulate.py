@@ -0,0 +1,401 @@
+import threading
+import time
+from typing import List, Optional
+
+import numpy as np
+
+from capture import RingBuffer, StreamClock
+from connection import AsyncP2PNetwork, P2PNetwork
+from main import NoiseDetector
+from metrics import STAGES, LatencyHistogram
+from multilateration import SPEED_OF_SOUND
+from wire import sensor_id
+
+
+def gunshot(rate: int, rng: np.random.Generator) -> np.ndarray:
+    """Muzzle blast: a ~1 ms N-wave followed by 50 ms of decaying reverberant noise."""
+    n_wave = int(0.001 * rate)
+    wave = np.linspace(1.0, -1.0, n_wave)
+    tail_t = np.arange(int(0.05 * rate)) / rate
+    tail = 0.3 * rng.standard_normal(len(tail_t)) * np.exp(-tail_t / 0.01)
+    return np.concatenate((wave, tail))
+
+
+def artillery(rate: int, rng: np.random.Generator) -> np.ndarray:
+    """Low-frequency boom: lowpassed noise with a 20 ms rise and 300 ms decay."""
+    t = np.arange(int(0.6 * rate)) / rate
+    noise = rng.standard_normal(len(t))
+    kernel = np.ones(int(rate / 150)) / int(rate / 150)  # Moving average, roughly <150 Hz
+    boom = np.convolve(noise, kernel, mode="same")
+    envelope = np.minimum(t / 0.02, 1.0) * np.exp(-t / 0.3)
+    boom *= envelope
+    return boom / np.max(np.abs(boom))
+
+
+def drone(rate: int, rng: np.random.Generator) -> np.ndarray:
+    """Rotor buzz: harmonics of a wobbling ~180 Hz blade-pass frequency for 1.5 s."""
+    t = np.arange(int(1.5 * rate)) / rate
+    f0 = 180 + 5 * np.sin(2 * np.pi * 0.7 * t)
+    phase = 2 * np.pi * np.cumsum(f0) / rate
+    buzz = sum(np.sin(k * phase) / k for k in range(1, 8))
+    buzz = buzz * np.minimum(t / 0.1, 1.0) + 0.05 * rng.standard_normal(len(t))
+    return buzz / np.max(np.abs(buzz))
+
+
+SOURCE_MODELS = {"gunshot": gunshot, "artillery": artillery, "drone": drone}
+
+
+class Scenario:
+    """Nodes and sources at known positions, plus the imperfections to simulate.
+
+    `level` is the peak amplitude of a source at 1 m; it falls off as 1/r.
+    `clock_skew[i]` is added to every timestamp node i produces, i.e. its
+    residual clock error after synchronization. `loss` is the probability
+    that a detection sent to one peer is lost. `hosts[i]` is the host that
+    microphone i is a channel of; by default every microphone is its own
+    host. Channels of a host share its clock error.
+    """
+
+    def __init__(self, node_positions: np.ndarray, events: List[tuple], rate: int = 44100,
+                 noise: float = 0.05, clock_skew: Optional[np.ndarray] = None, loss: float = 0.0,
+                 level: float = 2000.0, seed: int = 0, hosts: Optional[np.ndarray] = None):
+        self.node_positions = np.asarray(node_positions, dtype=float)
+        self.hosts = np.arange(len(self.node_positions)) if hosts is None else np.asarray(hosts)
+        self.events = events  # (emission time, position, kind)
+        self.rate = rate
+        self.noise = noise
+        self.clock_skew = np.zeros(self.hosts.max() + 1) if clock_skew is None else np.asarray(clock_skew)
+        self.loss = loss
+        self.level = level
+        self.seed = seed
+
+    @property
+    def duration(self) -> float:
+        last = max(t for t, _, _ in self.events)
+        return last + self.max_distance() / SPEED_OF_SOUND + 2.0
+
+    def max_distance(self) -> float:
+        pos = np.array([p for _, p, _ in self.events])
+        return float(np.max(np.linalg.norm(pos[:, None, :] - self.node_positions[None, :, :], axis=2)))
+
+    def arrival_times(self) -> np.ndarray:
+        """(events, nodes) true arrival times, without clock skew."""
+        pos = np.array([p for _, p, _ in self.events])
+        emitted = np.array([t for t, _, _ in self.events])
+        dist = np.linalg.norm(pos[:, None, :] - self.node_positions[None, :, :], axis=2)
+        return emitted[:, None] + dist / SPEED_OF_SOUND
+
+    def render(self) -> np.ndarray:
+        """(nodes, samples) float32 microphone signals starting at time 0."""
+        rng = np.random.default_rng(self.seed)
+        n_samples = int(self.duration * self.rate)
+        out = self.noise * rng.standard_normal((len(self.node_positions), n_samples))
+        arrivals = self.arrival_times()
+        for k, (_, position, kind) in enumerate(self.events):
+            wave = SOURCE_MODELS[kind](self.rate, rng)
+            wave_t = np.arange(len(wave)) / self.rate
+            for i, node in enumerate(self.node_positions):
+                gain = self.level / max(np.linalg.norm(position - node), 1.0)
+                start = int(np.floor(arrivals[k, i] * self.rate))
+                stop = min(start + len(wave) + 1, n_samples)
+                # Fractional-sample delay by interpolating the source waveform
+                local_t = np.arange(start, stop) / self.rate - arrivals[k, i]
+                out[i, start:stop] += gain * np.interp(local_t, wave_t, wave, left=0.0, right=0.0)
+        return out.astype(np.float32)
+
+
+def make_scenario(n_nodes: int = 4, n_events: int = 10, kind: str = "gunshot", spacing: float = 100.0,
+                  area: float = 300.0, interval: float = 1.5, noise: float = 0.05, skew: float = 0.0,
+                  loss: float = 0.0, seed: int = 0, channels: int = 1, array_spacing: float = 1.0) -> Scenario:
+    """Nodes on a circle of diameter `spacing`, sources uniformly within `area` meters around them.
+
+    `skew` is the standard deviation of the per-node clock error in seconds.
+    `kind="mixed"` draws each event's source model at random. With
+    `channels` > 1 every node is a microphone array of that many channels
+    on a circle of diameter `array_spacing`.
+    """
+    rng = np.random.default_rng(seed)
+    angles = 2 * np.pi * np.arange(n_nodes) / n_nodes
+    nodes = spacing / 2 * np.column_stack((np.cos(angles), np.sin(angles)))
+    hosts = None
+    if channels > 1:
+        array_angles = 2 * np.pi * np.arange(channels) / channels
+        array = array_spacing / 2 * np.column_stack((np.cos(array_angles), np.sin(array_angles)))
+        nodes = (nodes[:, None, :] + array[None, :, :]).reshape(-1, 2)
+        hosts = np.repeat(np.arange(n_nodes), channels)
+    kinds = [rng.choice(sorted(SOURCE_MODELS)) if kind == "mixed" else kind for _ in range(n_events)]
+    events = [(1.0 + k * interval, rng.uniform(-area / 2, area / 2, 2), str(kinds[k])) for k in range(n_events)]
+    clock_skew = rng.normal(0.0, skew, n_nodes) if skew else None
+    return Scenario(nodes, events, noise=noise, clock_skew=clock_skew, loss=loss, seed=seed, hosts=hosts)
+
+
+class SimulatedStream:
+    """Stands in for the PyAudio stream; inactive once the simulator has fed everything."""
+
+    def __init__(self):
+        self.active = True
+
+    def is_active(self) -> bool:
+        return self.active
+
+    def stop_stream(self):
+        self.active = False
+
+    def close(self):
+        pass
+
+
+class PacketLoss:
+    """Network mixin that drops each outgoing detection with probability `loss`, per peer."""
+
+    def __init__(self, port: int, loss: float = 0.0, seed: int = 0, **kwargs):
+        super().__init__(port, **kwargs)
+        self.loss = loss
+        self.rng = np.random.default_rng(seed)
+        self.lost = 0
+
+    def broadcast_event(self, amplitude, timestamp, snippet=None, rate=44100, connections=None, event_type=None,
+                        channel=0):
+        connections = list(self.connections if connections is None else connections)
+        keep = self.rng.random(len(connections)) >= self.loss
+        self.lost += int(np.sum(~keep))
+        super().broadcast_event(amplitude, timestamp, snippet, rate,
+                                [c for c, k in zip(connections, keep) if k], event_type, channel)
+
+
+class LossyNetwork(PacketLoss, P2PNetwork):
+    pass
+
+
+class LossyAsyncNetwork(PacketLoss, AsyncP2PNetwork):
+    pass
+
+
+class SimulatedDetector(NoiseDetector):
+    """NoiseDetector fed from memory instead of a microphone, recording its fixes."""
+
+    READ_TIMEOUT = 0.2
+
+    def __init__(self, network, epoch: float, skew: float, channels: int = 1, **kwargs):
+        super().__init__(network=network, **kwargs)
+        self.ring = RingBuffer(self.RING_SECONDS * self.RATE, self.RATE, channels)
+        self.clock = StreamClock(self.RATE)
+        # Stream time 0 is `epoch` on every node's clock, plus that node's error
+        self.clock.offset = epoch + skew
+        self.stream = SimulatedStream()
+        self.fixes = []
+        self.fix_wall_times = []
+        self.cpu_time = 0.0
+
+    def feed(self, chunk: np.ndarray, stream_time: float) -> None:
+        """Capture a (frames,) or (frames, channels) chunk."""
+        time_info = {'input_buffer_adc_time': stream_time, 'current_time': stream_time}
+        self._audio_callback(chunk.tobytes(), len(chunk), time_info, 0)
+
+    def handle_fix(self, association) -> dict:
+        latest_event = super().handle_fix(association)
+        self.fixes.append(latest_event)
+        self.fix_wall_times.append(time.perf_counter())
+        return latest_event
+
+    def run(self) -> None:
+        self.detect_noise()
+        self.cpu_time = sum(d.detect_cpu for d in self.channel_detectors())
+
+
+def startup_probe(t0: float, **detector_kwargs) -> dict:
+    """Seconds to import (from `t0`, the caller's perf_counter before importing this module), set up a node,
+    and detect a first event fed as fast as the detector takes it.
+
+    The event comes right after the adaptive trigger's noise floor warm-up,
+    which on live audio alone takes `warmup_chunks` chunks (~1 s).
+    """
+    imported = time.perf_counter()
+    network = P2PNetwork(0)
+    detector = SimulatedDetector(network, time.time(), 0.0, **detector_kwargs)
+    ready = time.perf_counter()
+    scenario = make_scenario(1, 1)
+    signals = scenario.render()
+    chunk = NoiseDetector.CHUNK_SIZE
+    detected = []
+    add = detector.associator.add
+
+    def timed_add(*args, **kwargs):
+        # Stamped by the detector thread as it hands the detection on, not when the feed loop gets to look
+        if not detected:
+            detected.append(time.perf_counter())
+        return add(*args, **kwargs)
+
+    detector.associator.add = timed_add
+    thread = threading.Thread(target=detector.run, daemon=True)
+    feed_start = time.perf_counter()
+    thread.start()
+    for c in range(signals.shape[1] // chunk):
+        detector.feed(signals[:, c * chunk:(c + 1) * chunk].T, c * chunk / scenario.rate)
+    while not detected and thread.is_alive():
+        time.sleep(0.001)
+    detector.stream.stop_stream()
+    thread.join()
+    return {"import": imported - t0, "setup": ready - imported,
+            "first_detection": detected[0] - feed_start if detected else None}
+
+
+class Simulation:
+    """N virtual nodes wired together over loopback sockets in one process.
+
+    A host with several microphones is one node capturing several channels,
+    each detected as sensor "<node id>#<n>". With topology "ring" every
+    host only connects to its two neighbours, and detections reach the
+    rest by gossip relaying (`gossip_ttl` hops).
+    """
+
+    def __init__(self, scenario: Scenario, base_port: int = 47000, transport: str = "thread",
+                 topology: str = "full", gossip_ttl: int = 0, **detector_kwargs):
+        self.scenario = scenario
+        self.topology = topology
+        self.epoch = time.time()
+        network_class = LossyAsyncNetwork if transport == "asyncio" else LossyNetwork
+        n_hosts = int(scenario.hosts.max()) + 1
+        self.host_mics = [np.flatnonzero(scenario.hosts == h) for h in range(n_hosts)]
+        # Sensor id of every microphone, in scenario order
+        self.node_ids = [None] * len(scenario.node_positions)
+        for h, mics in enumerate(self.host_mics):
+            for channel, mic in enumerate(mics):
+                self.node_ids[mic] = sensor_id(f"sim-{h}", channel)
+        geometry = dict(zip(self.node_ids, scenario.node_positions))
+        self.networks = []
+        self.detectors: List[SimulatedDetector] = []
+        for i, mics in enumerate(self.host_mics):
+            network = network_class(base_port + i, loss=scenario.loss, seed=scenario.seed + i,
+                                    gossip_ttl=gossip_ttl)
+            network.node_id = f"sim-{i}"
+            detector = SimulatedDetector(network, self.epoch, float(scenario.clock_skew[i]), channels=len(mics),
+                                         **detector_kwargs)
+            detector.attach_channels([(detector.ring, detector.stream, c) for c in range(1, len(mics))])
+            detector.set_geometry(geometry)
+            self.networks.append(network)
+            self.detectors.append(detector)
+        self.feed_wall_times: Optional[np.ndarray] = None
+        self.wall_time = 0.0
+        self.process_cpu = 0.0
+
+    def links(self) -> List[tuple]:
+        """(i, j) host pairs to connect, i < j."""
+        n = len(self.networks)
+        if self.topology == "ring" and n > 3:
+            return sorted((min(i, (i + 1) % n), max(i, (i + 1) % n)) for i in range(n))
+        return [(i, j) for i in range(n) for j in range(i + 1, n)]
+
+    def connect(self) -> None:
+        for network in self.networks:
+            threading.Thread(target=network.start_server, daemon=True).start()
+        time.sleep(0.2)
+        links = self.links()
+        for i, j in links:
+            self.networks[i].connect('127.0.0.1', self.networks[j].listening_port)
+        degree = [sum(i in link for link in links) for i in range(len(self.networks))]
+        # Wait for HELLOs so every peer is known by node id
+        deadline = time.time() + 5
+        while time.time() < deadline and not all(
+                len(n.connections) == d and all(c.binary_out for c in n.connections)
+                for n, d in zip(self.networks, degree)):
+            time.sleep(0.01)
+
+    def run(self, max_lag_chunks: int = 4) -> float:
+        """Feed the rendered audio chunk by chunk; returns the wall time it took."""
+        signals = self.scenario.render()
+        chunk = NoiseDetector.CHUNK_SIZE
+        rate = self.scenario.rate
+        arrivals = self.scenario.arrival_times()
+        arrival_chunks = (arrivals * rate).astype(int) // chunk
+        self.feed_wall_times = np.full(arrivals.shape, np.nan)
+
+        threads = [threading.Thread(target=d.run, daemon=True) for d in self.detectors]
+        for thread in threads:
+            thread.start()
+
+        start = time.perf_counter()
+        cpu_start = time.process_time()
+        for c in range(signals.shape[1] // chunk):
+            for mics, detector in zip(self.host_mics, self.detectors):
+                detector.feed(signals[mics, c * chunk:(c + 1) * chunk].T, c * chunk / rate)
+            now = time.perf_counter()
+            self.feed_wall_times[arrival_chunks == c] = now
+            # Stay at most a few chunks (plus what a detector must see ahead: a low-power scan
+            # block, a classification window) ahead of the slowest detector
+            for detector, thread in zip(self.detectors, threads):
+                lag = max_lag_chunks + (detector.LOW_POWER_BLOCK_CHUNKS if detector.low_power else 0)
+                if detector.classifier is not None:
+                    lag += detector.classifier.length // chunk + 1
+                while (thread.is_alive() and detector.ring.write_pos - min(
+                        d.read_pos for d in detector.channel_detectors()) > lag * chunk):
+                    time.sleep(0.0005)
+        for detector in self.detectors:
+            detector.stream.stop_stream()
+        for thread in threads:
+            thread.join()
+        # Let the last detections cross the network
+        time.sleep(0.3)
+        self.wall_time = time.perf_counter() - start
+        self.process_cpu = time.process_time() - cpu_start
+        return self.wall_time
+
+    def results(self, match_window: float = 0.5) -> dict:
+        """Score every node's fixes against the true sources.
+
+        A fix belongs to the event whose first arrival is closest to the
+        fix's earliest event time. Latency runs from feeding the chunk that
+        holds the last contributing arrival to handle_fix returning.
+        """
+        scenario = self.scenario
+        arrivals = scenario.arrival_times()
+        first_arrivals = arrivals.min(axis=1)
+        sources = np.array([p for _, p, _ in scenario.events])
+        node_index = {node_id: i for i, node_id in enumerate(self.node_ids)}
+        errors, latencies, detected = [], [], set()
+        false_fixes = type_errors = 0
+        for detector in self.detectors:
+            for fix, wall_time in zip(detector.fixes, detector.fix_wall_times):
+                source = (fix["coord_dict"] or {}).get("source")
+                nodes = [node_index[n] for n in fix["event_times"] if n in node_index]
+                first = min(fix["event_times"].values()) - self.epoch
+                k = int(np.argmin(np.abs(first_arrivals - first)))
+                if source is None or abs(first_arrivals[k] - first) > match_window:
+                    false_fixes += 1
+                    continue
+                detected.add(k)
+                if fix.get("type") not in (None, "unknown", scenario.events[k][2]):
+                    type_errors += 1
+                errors.append(np.linalg.norm(np.asarray(source[:2]) - sources[k, :2]))
+                latencies.append(wall_time - np.nanmax(self.feed_wall_times[k, nodes]))
+        n_nodes = len(self.detectors)
+        return {
+            "fixes": sum(len(d.fixes) for d in self.detectors),
+            "events": len(scenario.events),
+            "missed": len(scenario.events) - len(detected),
+            "false_fixes": false_fixes,
+            "type_errors": type_errors,
+            "errors": np.array(errors),
+            "latencies": np.array(latencies),
+            "detector_cpu": np.array([d.cpu_time for d in self.detectors]),
+            "process_cpu_per_node": self.process_cpu / n_nodes,
+            "wall_time": self.wall_time,
+            "audio_seconds": scenario.duration,
+            "lost_messages": sum(n.lost for n in self.networks),
+            "relayed": sum(n.relayed for n in self.networks),
+            "stages": self.stage_latencies(),
+            "triggers": sum(d.trigger_stats()["triggers"] for d in self.detectors),
+            "messages_sent": sum(d.trigger_stats()["messages_sent"] for d in self.detectors),
+        }
+
+    def stage_latencies(self) -> dict:
+        """Stage latency histograms (metrics.STAGES) summed over the nodes."""
+        merged = {stage: LatencyHistogram() for stage in STAGES}
+        for network in self.networks:
+            for stage, histogram in network.metrics.histograms.items():
+                merged[stage].merge(histogram)
+        return {stage: histogram.stats() for stage, histogram in merged.items()}
+
+    def close(self) -> None:
+        for network in self.networks:
+            network.terminate_all_connections()
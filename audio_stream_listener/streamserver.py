@@ -0,0 +1,130 @@
+import itertools
+import json
+import logging
+import queue
+import threading
+from collections import deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import List, Optional
+from urllib.parse import parse_qs, urlparse
+
+log = logging.getLogger(__name__)
+
+
+class EventStream:
+    """Fan-out of live updates to Server-Sent Events clients.
+
+    Every published message gets an increasing id and is kept in a bounded
+    replay buffer, so a client that joins late (or reconnects with
+    Last-Event-ID) first gets what it missed. The latest message of each
+    `sticky` kind (e.g. node positions) is always replayed, even after it
+    has rotated out of the buffer. Each client has its own
+    bounded queue; a client that cannot keep up is disconnected instead of
+    slowing down the publisher.
+    """
+
+    def __init__(self, replay: int = 256, client_queue: int = 256, sticky=("nodes", "health")):
+        self.replay = deque(maxlen=replay)
+        self.sticky = {kind: None for kind in sticky}
+        self.client_queue = client_queue
+        self.clients: List[queue.Queue] = []
+        self.ids = itertools.count(1)
+        self.lock = threading.Lock()
+
+    def publish(self, kind: str, data) -> None:
+        """Send `data` (JSON-serializable) to every client as an SSE event of type `kind`."""
+        with self.lock:
+            message = (next(self.ids), kind, json.dumps(data))
+            self.replay.append(message)
+            if kind in self.sticky:
+                self.sticky[kind] = message
+            clients = list(self.clients)
+        for client in clients:
+            try:
+                client.put_nowait(message)
+            except queue.Full:
+                self.unsubscribe(client)
+                with client.mutex:
+                    client.queue.clear()
+                client.put_nowait(None)  # Tells the handler to hang up
+
+    def subscribe(self, last_id: int = 0):
+        """(queue for live messages, replayed messages newer than last_id)"""
+        client = queue.Queue(maxsize=self.client_queue)
+        with self.lock:
+            backlog = [m for m in self.replay if m[0] > last_id]
+            replayed = {m[0] for m in self.replay}
+            snapshot = [m for m in self.sticky.values() if m is not None and m[0] not in replayed]
+            backlog = sorted(snapshot) + backlog
+            self.clients.append(client)
+        return client, backlog
+
+    def unsubscribe(self, client) -> None:
+        with self.lock:
+            if client in self.clients:
+                self.clients.remove(client)
+
+
+class StreamHandler(BaseHTTPRequestHandler):
+    stream: EventStream = None
+    keepalive = 15.0
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        if url.path != "/events":
+            self.send_error(404)
+            return
+        since = self.headers.get("Last-Event-ID") or parse_qs(url.query).get("since", ["0"])[0]
+        try:
+            last_id = int(since)
+        except ValueError:
+            last_id = 0
+
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Cache-Control", "no-cache")
+        self.send_header("Connection", "keep-alive")
+        # The Next.js dev server runs on another port
+        self.send_header("Access-Control-Allow-Origin", "*")
+        self.end_headers()
+
+        client, backlog = self.stream.subscribe(last_id)
+        try:
+            for message in backlog:
+                self._send(message)
+            while True:
+                try:
+                    message = client.get(timeout=self.keepalive)
+                except queue.Empty:
+                    self.wfile.write(b": keepalive\n\n")
+                    self.wfile.flush()
+                    continue
+                if message is None:
+                    break
+                self._send(message)
+        except (BrokenPipeError, ConnectionResetError):
+            pass
+        finally:
+            self.stream.unsubscribe(client)
+
+    def _send(self, message):
+        event_id, kind, data = message
+        self.wfile.write(f"id: {event_id}\nevent: {kind}\ndata: {data}\n\n".encode())
+        self.wfile.flush()
+
+    def log_message(self, format, *args):
+        pass
+
+
+def start_stream_server(stream: EventStream, port: int, host: str = "") -> Optional[ThreadingHTTPServer]:
+    """Serve `stream` at http://<host>:<port>/events from a daemon thread."""
+    handler = type("BoundStreamHandler", (StreamHandler,), {"stream": stream})
+    try:
+        server = ThreadingHTTPServer((host, port), handler)
+    except OSError as e:
+        log.error(f"Error starting event stream on port {port}: {e}")
+        return None
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    log.info(f"Streaming events on http://localhost:{port}/events")
+    return server
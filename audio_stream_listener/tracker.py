@@ -0,0 +1,227 @@
+import itertools
+import math
+import threading
+from typing import Dict, List, Optional, Sequence
+
+import numpy as np
+
+CHI2_GATE = {1: 6.63, 2: 9.21, 3: 11.34}  # 99% gates for 1-3 measured dimensions
+
+
+def constant_velocity(dims: int, dt: float, q: float):
+    """(F, Q) of a constant-velocity model with white-noise acceleration of spectral density q."""
+    eye = np.eye(dims)
+    F = np.kron(np.array([[1.0, dt], [0.0, 1.0]]), eye)
+    Q = np.kron(q * np.array([[dt ** 3 / 3, dt ** 2 / 2], [dt ** 2 / 2, dt]]), eye)
+    return F, Q
+
+
+class Track:
+    """One target, filtered by an IMM of constant-velocity models with different process noise.
+
+    State is [position, velocity]. The quiet model follows steady motion,
+    the agile one absorbs turns and speed changes; their mode
+    probabilities say which fits better. Every update is a fixed amount of
+    small-matrix work.
+    """
+
+    def __init__(self, track_id: int, time: float, position: np.ndarray, R: np.ndarray,
+                 process_noise: Sequence[float], transition: np.ndarray, initial_speed: float):
+        dims = len(position)
+        self.id = track_id
+        self.dims = dims
+        self.process_noise = process_noise
+        self.transition = transition
+        x = np.concatenate((position, np.zeros(dims)))
+        P = np.block([[R, np.zeros((dims, dims))], [np.zeros((dims, dims)), initial_speed ** 2 * np.eye(dims)]])
+        self.x = [x.copy() for _ in process_noise]
+        self.P = [P.copy() for _ in process_noise]
+        self.mu = np.full(len(process_noise), 1.0 / len(process_noise))
+        self.time = time
+        self.first_time = time
+        self.hits = 1
+        self.last_event_id = None
+        self.snapshot = None
+
+    @property
+    def H(self) -> np.ndarray:
+        return np.hstack((np.eye(self.dims), np.zeros((self.dims, self.dims))))
+
+    def estimate(self):
+        """Mode-weighted state and covariance."""
+        x = sum(m * x for m, x in zip(self.mu, self.x))
+        P = sum(m * (P + np.outer(xj - x, xj - x)) for m, xj, P in zip(self.mu, self.x, self.P))
+        return x, P
+
+    def _mixed_prediction(self, time: float):
+        """IMM mixing followed by each model's prediction to `time`."""
+        dt = max(time - self.time, 0.0)
+        c = self.transition.T @ self.mu  # Predicted mode probabilities
+        weights = (self.transition * self.mu[:, None]) / np.maximum(c[None, :], 1e-300)
+        xs, Ps = [], []
+        for j, q in enumerate(self.process_noise):
+            x0 = sum(weights[i, j] * self.x[i] for i in range(len(self.x)))
+            P0 = sum(weights[i, j] * (self.P[i] + np.outer(self.x[i] - x0, self.x[i] - x0))
+                     for i in range(len(self.x)))
+            F, Q = constant_velocity(self.dims, dt, q)
+            xs.append(F @ x0)
+            Ps.append(F @ P0 @ F.T + Q)
+        return xs, Ps, c
+
+    def outside(self, time: float, z: np.ndarray, R: np.ndarray, gate: float) -> bool:
+        """Cheap test that a measurement is certainly outside the gate, before the full IMM prediction.
+
+        The squared Mahalanobis distance is at least |y|^2 / trace(S), and
+        trace(S) is bounded from the combined state with the noisiest model.
+        """
+        dt = max(time - self.time, 0.0)
+        x, P = self.estimate()
+        d = self.dims
+        y = z - x[:d] - dt * x[d:]
+        trace_s = (np.trace(P[:d, :d]) + 2 * dt * abs(np.trace(P[:d, d:])) + dt ** 2 * np.trace(P[d:, d:])
+                   + max(self.process_noise) * d * (dt ** 3 / 3 + dt) + np.trace(R))
+        return float(y @ y) > 2 * gate * trace_s
+
+    def distance(self, time: float, z: np.ndarray, R: np.ndarray):
+        """(squared Mahalanobis distance, log det of innovation covariance) of a measurement."""
+        xs, Ps, c = self._mixed_prediction(time)
+        H = self.H
+        x = sum(m * x for m, x in zip(c, xs))
+        P = sum(m * (P + np.outer(xj - x, xj - x)) for m, xj, P in zip(c, xs, Ps))
+        S = H @ P @ H.T + R
+        y = z - H @ x
+        return float(y @ np.linalg.solve(S, y)), float(np.linalg.slogdet(S)[1])
+
+    def update(self, time: float, z: np.ndarray, R: np.ndarray, event_id=None) -> None:
+        if event_id is not None and event_id == self.last_event_id and self.snapshot is not None:
+            # A refined fix of the event we already used: redo that update instead of adding another
+            self.x, self.P, self.mu, self.time, self.hits = self.snapshot
+        self.snapshot = ([x.copy() for x in self.x], [P.copy() for P in self.P], self.mu.copy(),
+                         self.time, self.hits)
+        self.last_event_id = event_id
+
+        xs, Ps, c = self._mixed_prediction(time)
+        H = self.H
+        likelihood = np.empty(len(xs))
+        for j in range(len(xs)):
+            S = H @ Ps[j] @ H.T + R
+            y = z - H @ xs[j]
+            K = np.linalg.solve(S, H @ Ps[j]).T
+            xs[j] = xs[j] + K @ y
+            Ps[j] = (np.eye(len(xs[j])) - K @ H) @ Ps[j]
+            d2 = float(y @ np.linalg.solve(S, y))
+            likelihood[j] = math.exp(-0.5 * d2) / math.sqrt(max(np.linalg.det(2 * math.pi * S), 1e-300))
+        mu = c * likelihood
+        self.mu = mu / mu.sum() if mu.sum() > 0 else c
+        self.x, self.P = xs, Ps
+        self.time = max(self.time, time)
+        self.hits += 1
+
+    def summary(self, confirmed: bool) -> dict:
+        x, P = self.estimate()
+        dims = self.dims
+        return {
+            "track_id": self.id,
+            "time": self.time,
+            "position": x[:dims].tolist(),
+            "velocity": x[dims:].tolist(),
+            "position_covariance": P[:dims, :dims].tolist(),
+            "mode_probabilities": self.mu.tolist(),
+            "hits": self.hits,
+            "confirmed": confirmed,
+        }
+
+
+class MultiTargetTracker:
+    """Gated nearest-neighbour multi-target tracker over localized fixes.
+
+    Each fix is gated against every live track's predicted position (chi2,
+    99%) and updates the most likely one, preferring confirmed tracks, or
+    starts a tentative track. Tracks
+    are confirmed after `confirm_hits` updates and dropped after
+    `max_coast` seconds without one. The measurement noise is the fix's
+    own covariance when it has one (plus `model_sigma` for what the
+    localization model leaves out), else `default_sigma`. Work per fix is
+    bounded by `max_tracks`.
+    """
+
+    def __init__(self, process_noise: Sequence[float] = (0.5, 20.0), switch_probability: float = 0.05,
+                 confirm_hits: int = 3, max_coast: float = 10.0, max_tracks: int = 64,
+                 default_sigma: float = 5.0, model_sigma: float = 0.5, initial_speed: float = 30.0):
+        self.process_noise = tuple(process_noise)
+        n = len(self.process_noise)
+        self.transition = np.full((n, n), switch_probability / max(n - 1, 1))
+        np.fill_diagonal(self.transition, 1 - switch_probability)
+        self.confirm_hits = confirm_hits
+        self.max_coast = max_coast
+        self.max_tracks = max_tracks
+        self.default_sigma = default_sigma
+        self.model_sigma = model_sigma
+        self.initial_speed = initial_speed
+        self.tracks: Dict[int, Track] = {}
+        self.event_tracks: Dict[object, int] = {}
+        self.ids = itertools.count(1)
+        self.lock = threading.Lock()
+
+    def _measurement(self, fix: dict):
+        """(time, position, covariance) of a fix, None if it has no usable position."""
+        source = (fix.get("coord_dict") or {}).get("source")
+        times = [t for t in (fix.get("event_times") or {}).values() if t is not None]
+        if source is None or not times or not np.all(np.isfinite(source)):
+            return None
+        z = np.asarray(source, dtype=float)
+        cov = (fix.get("uncertainty") or {}).get("covariance")
+        if cov is not None and np.shape(cov) == (len(z), len(z)):
+            R = np.asarray(cov, dtype=float) + self.model_sigma ** 2 * np.eye(len(z))
+        else:
+            R = self.default_sigma ** 2 * np.eye(len(z))
+        return min(times), z, R
+
+    def update(self, fix: dict) -> Optional[dict]:
+        """Feed one fix (the live JSONL event); returns the summary of the track it went to."""
+        measurement = self._measurement(fix)
+        if measurement is None:
+            return None
+        time, z, R = measurement
+        event_id = fix.get("event_id")
+        with self.lock:
+            self._prune(time)
+            track = self.tracks.get(self.event_tracks.get(event_id))
+            if track is None:
+                gate = CHI2_GATE.get(len(z), 11.34)
+                scored = [(t.distance(time, z, R), t) for t in self.tracks.values()
+                          if t.dims == len(z) and not t.outside(time, z, R, gate)]
+                scored = [(d2 + logdet, t) for (d2, logdet), t in scored if d2 <= gate]
+                if scored:
+                    # Confirmed tracks first, then the most likely (tentative tracks have wide gates)
+                    track = min(scored, key=lambda s: (s[1].hits < self.confirm_hits, s[0]))[1]
+            if track is not None and event_id is not None and track.hits == 1 and track.last_event_id == event_id:
+                # Refined fix of the event that started the track: start it again
+                del self.tracks[track.id]
+                track = None
+            if track is None:
+                if len(self.tracks) >= self.max_tracks:
+                    # Make room by dropping the stalest tentative (or else stalest) track
+                    victim = min(self.tracks.values(), key=lambda t: (t.hits >= self.confirm_hits, t.time))
+                    del self.tracks[victim.id]
+                track = Track(next(self.ids), time, z, R, self.process_noise, self.transition, self.initial_speed)
+                track.last_event_id = event_id
+                self.tracks[track.id] = track
+            else:
+                track.update(time, z, R, event_id)
+            if event_id is not None:
+                self.event_tracks[event_id] = track.id
+                if len(self.event_tracks) > 4 * self.max_tracks:
+                    # Only recent events can be refined again
+                    for old in list(self.event_tracks)[:len(self.event_tracks) - 2 * self.max_tracks]:
+                        del self.event_tracks[old]
+            return track.summary(track.hits >= self.confirm_hits)
+
+    def _prune(self, now: float) -> None:
+        for track_id in [i for i, t in self.tracks.items() if now - t.time > self.max_coast]:
+            del self.tracks[track_id]
+
+    def confirmed(self) -> List[dict]:
+        """Summaries of every confirmed track."""
+        with self.lock:
+            return [t.summary(True) for t in self.tracks.values() if t.hits >= self.confirm_hits]
@@ -0,0 +1,209 @@
+import base64
+import struct
+from typing import Optional, Tuple
+
+import numpy as np
+
+# Both sides send HELLO when a connection opens. Once a node has seen the
+# peer's HELLO it writes BINARY_MARKER as a text line and from then on only
+# sends frames. Nodes that never send HELLO keep getting text lines.
+PROTOCOL_VERSION = 1
+HELLO = "HELLO"
+BINARY_MARKER = "BINARY"
+
+MAGIC = b"TN"
+HEADER = struct.Struct("<2sBBI")  # magic, version, message type, payload length
+
+MSG_EVENT = 1
+MSG_SNIPPET = 2
+MSG_HEARTBEAT = 3
+MSG_CLOCK_SYNC = 4
+MSG_TEXT = 5
+MSG_GOSSIP = 6
+
+EVENT_FLAG_SNIPPET = 0x01  # A MSG_SNIPPET with the same event id follows
+
+# Event type codes; older peers send no type byte and mean "unknown"
+EVENT_TYPES = ("unknown", "gunshot", "artillery", "explosion", "drone")
+
+EVENT = struct.Struct("<IdfB")  # event id, time, amplitude, flags
+EVENT_TYPE = struct.Struct("<B")  # appended to EVENT, index into EVENT_TYPES
+EVENT_CHANNEL = struct.Struct("<H")  # appended after EVENT_TYPE, the sender's microphone (0 = the node itself)
+SNIPPET = struct.Struct("<IdI")  # event id, time of first sample, sample rate; int16 samples follow
+HEARTBEAT = struct.Struct("<Id")  # sequence number, send time
+CLOCK_SYNC = struct.Struct("<IBddd")  # sequence number, is_reply, t1, t2, t3
+GOSSIP = struct.Struct("<BH")  # hops left, origin node id length; the origin (utf-8) and its event's frames follow
+
+INT16_SCALE = 32767
+MAX_PAYLOAD = 1 << 24
+
+
+class ProtocolError(Exception):
+    pass
+
+
+def to_int16(samples: np.ndarray) -> np.ndarray:
+    return (np.clip(samples, -1.0, 1.0) * INT16_SCALE).astype('<i2')
+
+
+def encode_snippet(samples: np.ndarray) -> str:
+    """Pack float samples in [-1, 1] as base64 int16 for the text protocol."""
+    return base64.b64encode(to_int16(samples).tobytes()).decode('ascii')
+
+
+def decode_snippet(text: str) -> np.ndarray:
+    """Inverse of encode_snippet."""
+    return np.frombuffer(base64.b64decode(text), dtype='<i2').astype(np.float32) / INT16_SCALE
+
+
+def hello_line(node_id: Optional[str] = None, port: Optional[int] = None, gossip: bool = False) -> str:
+    line = f"{HELLO} proto={PROTOCOL_VERSION}"
+    if node_id:
+        line += f" node={node_id}"
+    if port:
+        line += f" port={port}"
+    if gossip:
+        line += " gossip=1"
+    return line
+
+
+def parse_hello(message: str) -> Tuple[int, Optional[str], Optional[int], bool]:
+    """(protocol version, node id, listening port, relays gossip) announced in a HELLO line."""
+    fields = dict(part.split('=', 1) for part in message.split()[1:] if '=' in part)
+    port = int(fields['port']) if 'port' in fields else None
+    return int(fields.get('proto', 0)), fields.get('node'), port, fields.get('gossip') == '1'
+
+
+def sensor_id(node_id, channel: int = 0):
+    """Id of a microphone: the node id for its first one, "<node id>#<n>" for the others."""
+    return node_id if not channel else f"{node_id}#{channel}"
+
+
+def node_of(sensor):
+    """Inverse of sensor_id, the node a microphone belongs to."""
+    return sensor.split('#', 1)[0] if isinstance(sensor, str) else sensor
+
+
+def format_event_text(amplitude: float, timestamp: float,
+                      snippet: Optional[Tuple[float, np.ndarray]] = None, event_type: Optional[str] = None,
+                      channel: int = 0) -> str:
+    """The legacy NOISE_DETECTED text line."""
+    message = f"NOISE_DETECTED amplitude={amplitude:.2f} time={timestamp:.6f}"
+    if event_type is not None:
+        message += f" type={event_type}"
+    if channel:
+        message += f" channel={channel}"
+    if snippet is not None:
+        message += f" snippet_start={snippet[0]:.6f} snippet={encode_snippet(snippet[1])}"
+    return message
+
+
+def parse_event_text(message: str):
+    """(amplitude, timestamp, snippet, type, channel) from a NOISE_DETECTED line; snippet is (start, samples) or None."""
+    fields = dict(part.split('=', 1) for part in message.split()[1:])
+    snippet = None
+    if 'snippet' in fields:
+        snippet = (float(fields['snippet_start']), decode_snippet(fields['snippet']))
+    return (float(fields['amplitude']), float(fields['time']), snippet, fields.get('type'),
+            int(fields.get('channel', 0)))
+
+
+def frame(msg_type: int, payload: bytes) -> bytes:
+    return HEADER.pack(MAGIC, PROTOCOL_VERSION, msg_type, len(payload)) + payload
+
+
+def encode_event(event_id: int, amplitude: float, timestamp: float,
+                 snippet: Optional[Tuple[float, np.ndarray]] = None, rate: int = 44100,
+                 event_type: Optional[str] = None, channel: int = 0) -> bytes:
+    """MSG_EVENT frame, followed by a MSG_SNIPPET frame when a snippet is given."""
+    flags = EVENT_FLAG_SNIPPET if snippet is not None else 0
+    payload = EVENT.pack(event_id, timestamp, amplitude, flags)
+    if event_type is not None or channel:
+        payload += EVENT_TYPE.pack(EVENT_TYPES.index(event_type or "unknown"))
+    if channel:
+        payload += EVENT_CHANNEL.pack(channel)
+    out = frame(MSG_EVENT, payload)
+    if snippet is not None:
+        out += frame(MSG_SNIPPET, SNIPPET.pack(event_id, snippet[0], rate) + to_int16(snippet[1]).tobytes())
+    return out
+
+
+def encode_gossip(hops: int, origin: str, event_frames: bytes) -> bytes:
+    """MSG_GOSSIP frame: another node's event (its encode_event bytes) to relay for `hops` more hops."""
+    origin_bytes = origin.encode()
+    return frame(MSG_GOSSIP, GOSSIP.pack(hops, len(origin_bytes)) + origin_bytes + event_frames)
+
+
+def decode_gossip(payload: memoryview) -> Tuple[int, str, memoryview]:
+    """(hops left, origin node id, the event's frames)"""
+    hops, length = GOSSIP.unpack_from(payload)
+    start = GOSSIP.size
+    return hops, bytes(payload[start:start + length]).decode(), payload[start + length:]
+
+
+def encode_text(message: str) -> bytes:
+    return frame(MSG_TEXT, message.encode())
+
+
+def encode_heartbeat(seq: int, send_time: float) -> bytes:
+    return frame(MSG_HEARTBEAT, HEARTBEAT.pack(seq, send_time))
+
+
+def encode_clock_sync(seq: int, is_reply: bool, t1: float, t2: float = 0.0, t3: float = 0.0) -> bytes:
+    return frame(MSG_CLOCK_SYNC, CLOCK_SYNC.pack(seq, is_reply, t1, t2, t3))
+
+
+def parse_header(header) -> Tuple[int, int]:
+    """(message type, payload length) from the 8 header bytes."""
+    magic, version, msg_type, length = HEADER.unpack(header)
+    if magic != MAGIC:
+        raise ProtocolError(f"Bad frame magic {magic!r}")
+    if version > PROTOCOL_VERSION:
+        raise ProtocolError(f"Unsupported protocol version {version}")
+    if length > MAX_PAYLOAD:
+        raise ProtocolError(f"Frame of {length} bytes is too large")
+    return msg_type, length
+
+
+def decode_event(payload: memoryview) -> Tuple[int, float, float, int, Optional[str], int]:
+    """(event id, time, amplitude, flags, type, channel); type is None when the sender did not classify."""
+    event_id, timestamp, amplitude, flags = EVENT.unpack_from(payload)
+    event_type, channel = None, 0
+    offset = EVENT.size
+    if len(payload) >= offset + EVENT_TYPE.size:
+        code, = EVENT_TYPE.unpack_from(payload, offset)
+        event_type = EVENT_TYPES[code] if code < len(EVENT_TYPES) else "unknown"
+        offset += EVENT_TYPE.size
+    if len(payload) >= offset + EVENT_CHANNEL.size:
+        channel, = EVENT_CHANNEL.unpack_from(payload, offset)
+    return event_id, timestamp, amplitude, flags, event_type, channel
+
+
+def decode_snippet_frame(payload: memoryview) -> Tuple[int, float, int, np.ndarray]:
+    """(event id, time of first sample, rate, float32 samples); the int16 view is zero-copy."""
+    event_id, start, rate = SNIPPET.unpack_from(payload)
+    pcm = np.frombuffer(payload, dtype='<i2', offset=SNIPPET.size)
+    return event_id, start, rate, pcm.astype(np.float32) / INT16_SCALE
+
+
+def read_frame(stream) -> Optional[Tuple[int, memoryview]]:
+    """Read one frame from a binary file object, None on EOF."""
+    header = stream.read(HEADER.size)
+    if len(header) < HEADER.size:
+        return None
+    msg_type, length = parse_header(header)
+    payload = stream.read(length)
+    if len(payload) < length:
+        return None
+    return msg_type, memoryview(payload)
+
+
+async def read_frame_async(reader) -> Optional[Tuple[int, memoryview]]:
+    """read_frame for an asyncio.StreamReader."""
+    try:
+        header = await reader.readexactly(HEADER.size)
+        msg_type, length = parse_header(header)
+        payload = await reader.readexactly(length)
+    except EOFError:
+        return None
+    return msg_type, memoryview(payload)
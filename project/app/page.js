@@ -5,16 +5,48 @@ const WIDTH = "1920"
 const HEIGHT = "1080"
 
 import RectangleMap from './RectangleMap';
+import { useEventStream } from '@/hooks/use-event-stream';
+
+const MARGIN = 0.1;  // Fraction of the map left empty around the outermost points
+
+// Map positions in meters onto the 0-1 scale RectangleMap expects
+function toMapObjects(nodes, fixes) {
+  const nodePoints = Object.values(nodes);
+  const fixPoints = fixes
+    .map((fix) => fix.source)
+    .filter((p) => p && p.every((v) => v !== null && Number.isFinite(v)));
+  const points = [...nodePoints, ...fixPoints];
+  if (points.length === 0) {
+    return [];
+  }
+
+  const xs = points.map((p) => p[0]);
+  const ys = points.map((p) => p[1]);
+  const minX = Math.min(...xs);
+  const minY = Math.min(...ys);
+  const span = Math.max(Math.max(...xs) - minX, Math.max(...ys) - minY) || 1;
+  const scale = (v, min) => MARGIN + (1 - 2 * MARGIN) * (v - min) / span;
+
+  const objects = nodePoints.map((p) => ({ type: 'user', x: scale(p[0], minX), y: scale(p[1], minY), size: 0.02 }));
+  fixPoints.forEach((p, i) => {
+    // Older fixes shrink, the latest is the largest
+    const age = (fixPoints.length - 1 - i) / Math.max(fixPoints.length, 1);
+    objects.push({ type: 'object', x: scale(p[0], minX), y: scale(p[1], minY), size: 0.035 * (1 - 0.8 * age) });
+  });
+  return objects;
+}
 
 export default function Home() {
-  const objects = [
-    { type: 'user', x: 0.125, y: 0.25, size: 0.025 },   // A blue user (x: 12.5%, y: 25%, size: 2.5% of container width)
-    { type: 'object', x: 0.5, y: 0.5, size: 0.0375 }, // A red object (x: 37.5%, y: 50%, size: 3.75% of container width)
-    { type: 'user', x: 0.625, y: 0.333, size: 0.03125 }, // Another blue user (x: 62.5%, y: 33.3%, size: 3.125% of container width)
-  ];
+  const { nodes, fixes, tracks, health, connected } = useEventStream();
+  const objects = toMapObjects(nodes, fixes);
 
   return (
     <main className="bg-gray-100 min-h-screen">
+      <div className="p-4 text-sm text-gray-600">
+        {connected ? 'Live' : 'Connecting to listener...'}
+        {health && ` | node ${health.node} | ${Object.keys(health.peers).length} peers | ${health.capture.overflows} overflows`}
+        {` | ${Object.keys(tracks).length} tracks`}
+      </div>
       <RectangleMap objects={objects} />
     </main>
   );
@@ -0,0 +1,51 @@
+import * as React from "react"
+
+const DEFAULT_URL = process.env.NEXT_PUBLIC_EVENTS_URL || "http://localhost:8765/events"
+const MAX_FIXES = 50
+// The listener's tracker drops a track after 10 s without a fix (max_coast) but
+// sends no message for it, so tracks expire here on the stream's own clock
+const TRACK_EXPIRY_SECONDS = 10
+const MAX_TRACKS = 64
+
+// Tracks updated within TRACK_EXPIRY_SECONDS of `now` (event time), newest MAX_TRACKS of them.
+function pruneTracks(tracks, now) {
+  const live = Object.values(tracks)
+    .filter((t) => now - t.time <= TRACK_EXPIRY_SECONDS)
+    .sort((a, b) => b.time - a.time)
+    .slice(0, MAX_TRACKS)
+  return Object.fromEntries(live.map((t) => [t.track_id, t]))
+}
+
+// Live fixes, confirmed tracks, node positions and node health from the listener's event stream.
+// EventSource reconnects by itself and resends Last-Event-ID, so the listener
+// replays whatever was missed.
+export function useEventStream(url = DEFAULT_URL) {
+  const [nodes, setNodes] = React.useState({})
+  const [fixes, setFixes] = React.useState([])
+  const [tracks, setTracks] = React.useState({})
+  const [health, setHealth] = React.useState(null)
+  const [connected, setConnected] = React.useState(false)
+
+  React.useEffect(() => {
+    const source = new EventSource(url)
+    source.onopen = () => setConnected(true)
+    source.onerror = () => setConnected(false)
+    source.addEventListener("nodes", (e) => setNodes(JSON.parse(e.data)))
+    source.addEventListener("health", (e) => setHealth(JSON.parse(e.data)))
+    source.addEventListener("fix", (e) => {
+      const fix = JSON.parse(e.data)
+      setFixes((previous) => [
+        ...previous.filter((f) => f.event_id !== fix.event_id),
+        fix,
+      ].slice(-MAX_FIXES))
+      setTracks((previous) => pruneTracks(previous, fix.time))
+    })
+    source.addEventListener("track", (e) => {
+      const track = JSON.parse(e.data)
+      setTracks((previous) => pruneTracks({ ...previous, [track.track_id]: track }, track.time))
+    })
+    return () => source.close()
+  }, [url])
+
+  return { nodes, fixes, tracks, health, connected }
+}